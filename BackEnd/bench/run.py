@@ -0,0 +1,443 @@
+"""Offline load/latency benchmark for the NutriGuard backend.
+
+Starts one stub server per upstream provider (see stubs.py), starts the app with
+uvicorn in a scratch directory pointed at those stubs, seeds users, then drives
+scenario mixes and writes a JSON report:
+
+    python bench/run.py --out bench-report.json
+    python bench/run.py --profile bench/profiles/degraded.json --scenarios scan_burst
+    python bench/run.py --out new.json --compare baseline.json --threshold 0.15
+
+Per scenario the report holds throughput, per-endpoint latency percentiles and
+error counts (client side), event-loop lag of the app process and the server-side
+stage quantiles scraped from /internal/stats. --compare exits non-zero when any
+endpoint p95 regresses by more than --threshold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import re
+import secrets
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+HERE = Path(__file__).resolve().parent
+BACKEND_DIR = HERE.parent
+
+# Default upstream behaviour, roughly matching what we see in production
+DEFAULT_PROFILE: Dict[str, Any] = {
+    "providers": {
+        "openrouter": {"median_ms": 1500, "sigma": 0.6, "error_rate": 0.02, "error_status": 503},
+        "calorieninjas": {"median_ms": 250, "sigma": 0.4, "error_rate": 0.01, "error_status": 503},
+        "spoonacular": {"median_ms": 300, "sigma": 0.5, "error_rate": 0.01, "error_status": 503},
+        "google_cse": {"median_ms": 200, "sigma": 0.4, "error_rate": 0.01, "error_status": 503},
+    },
+    "seed": {"users": 20, "history_per_user": 60, "days_per_user": 14},
+    # UPSTREAM_QUOTAS for the app; generous by default so runs measure the app, not the free tiers
+    "quotas": "openrouter=6000:,calorieninjas=6000:,spoonacular=6000:,google_cse=6000:",
+}
+
+SCENARIOS = ("scan_burst", "dashboard", "history_scroll", "metrics_save", "mixed")
+
+# Fake JPEG payload; the backend only base64-encodes it
+IMAGE_BYTES = b"\xff\xd8\xff\xe0" + os.urandom(150_000) + b"\xff\xd9"
+# Per-run INTERNAL_STATS_TOKEN for the app under test, so the harness may reset its stats
+STATS_TOKEN = secrets.token_hex(16)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = (len(sorted_vals) - 1) * q
+    lo, hi = int(k), min(int(k) + 1, len(sorted_vals) - 1)
+    return sorted_vals[lo] + (sorted_vals[hi] - sorted_vals[lo]) * (k - lo)
+
+
+def _summarize(latencies: List[float]) -> Dict[str, float]:
+    vals = sorted(latencies)
+    return {
+        "p50_ms": round(_percentile(vals, 0.50) * 1000, 2),
+        "p90_ms": round(_percentile(vals, 0.90) * 1000, 2),
+        "p95_ms": round(_percentile(vals, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(vals, 0.99) * 1000, 2),
+        "max_ms": round((vals[-1] if vals else 0.0) * 1000, 2),
+    }
+
+
+PROM_LINE = re.compile(r'^(?P<name>[a-z_]+)\{(?P<labels>[^}]*)\} (?P<value>\S+)$')
+
+
+def _parse_prometheus(text: str) -> Dict[str, Dict[str, Any]]:
+    """Collapse summary lines into {"<metric>|<stage>|<provider>": {p50_ms, p95_ms, p99_ms, count, errors}}."""
+    out: Dict[str, Dict[str, Any]] = {}
+    for line in text.splitlines():
+        m = PROM_LINE.match(line)
+        if not m:
+            continue
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', m.group("labels")))
+        if "stage" not in labels:
+            continue  # gauges (breaker state, quota levels) are not latency series
+        name, value = m.group("name"), float(m.group("value"))
+        metric = name.replace("nutriguard_", "")
+        base = re.sub(r"_(seconds(_sum|_count)?|errors_total)$", "", metric)
+        key = f"{base}|{labels.get('stage')}|{labels.get('provider')}"
+        row = out.setdefault(key, {})
+        if "quantile" in labels:
+            row[f"p{int(float(labels['quantile']) * 100)}_ms"] = round(value * 1000, 2)
+        elif name.endswith("_count"):
+            row["count"] = int(value)
+        elif name.endswith("_errors_total"):
+            row["errors"] = int(value)
+    return out
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, endpoint: str, seconds: float, ok: bool):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+        if not ok:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def total(self) -> int:
+        return sum(len(v) for v in self.latencies.values())
+
+
+class Bench:
+    def __init__(self, base_url: str, users: List[Dict[str, str]]):
+        self.base_url = base_url
+        self.users = users
+        self.rec = Recorder()
+
+    async def call(self, client: httpx.AsyncClient, method: str, path: str, label: Optional[str] = None, **kw) -> Optional[httpx.Response]:
+        label = label or f"{method} {path}"
+        start = time.perf_counter()
+        try:
+            resp = await client.request(method, path, **kw)
+            self.rec.add(label, time.perf_counter() - start, resp.status_code < 500)
+            return resp
+        except Exception:
+            self.rec.add(label, time.perf_counter() - start, False)
+            return None
+
+    # --- user journeys ---
+    async def food_scan(self, client, h):
+        up = await self.call(client, "POST", "/upload-image", files={"file": ("meal.jpg", IMAGE_BYTES, "image/jpeg")})
+        if not up or up.status_code != 200:
+            return
+        image_url = up.json()["image_url"]
+        res = await self.call(client, "POST", "/identify-food", json={"image_url": image_url})
+        if not res or res.status_code != 200:
+            return
+        data = res.json()
+        nutrition = data.get("nutrition") or {"items": [], "totals": {}}
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        await self.call(client, "POST", "/metrics/save", headers=h, json={"day": day, "nutrition": nutrition})
+        await self.call(client, "POST", "/history/save", headers=h, json={
+            "image_url": image_url, "scan_type": "food",
+            "result_json": json.dumps({"itemName": data.get("item_name"), "nutrition": nutrition}),
+        })
+
+    async def raw_scan(self, client, h):
+        up = await self.call(client, "POST", "/upload-image", files={"file": ("fridge.jpg", IMAGE_BYTES, "image/jpeg")})
+        if not up or up.status_code != 200:
+            return
+        image_url = up.json()["image_url"]
+        res = await self.call(client, "POST", "/identify-raw-ingredients", headers=h, json={"image_url": image_url})
+        if not res or res.status_code != 200:
+            return
+        data = res.json()
+        # The result screen loads every dish image (through the dish image proxy)
+        await asyncio.gather(*(
+            self.call(client, "GET", d["image_url"], label="GET /dish-image/{digest}")
+            for d in data.get("dishes") or [] if d.get("image_url")
+        ))
+        if random.random() < 0.5 and data.get("ingredients"):
+            await self.call(client, "POST", "/suggest-dishes-with-filters", headers=h, json={
+                "ingredients": data["ingredients"], "times": [random.choice(["breakfast", "lunch", "dinner"])], "diabetic": random.random() < 0.3,
+            })
+        await self.call(client, "POST", "/history/save", headers=h, json={
+            "image_url": image_url, "scan_type": "raw_ingredients",
+            "result_json": json.dumps({"ingredients": data.get("ingredients"), "dishes": data.get("dishes")}),
+        })
+
+    async def dashboard(self, client, h):
+        day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+        await asyncio.gather(
+            self.call(client, "GET", "/user/targets", headers=h),
+            self.call(client, "GET", "/metrics/weekly-status", headers=h),
+            self.call(client, "GET", "/metrics/get", headers=h, params={"day": day}),
+            self.call(client, "GET", "/user/profile", headers=h),
+        )
+
+    async def history_scroll(self, client, h):
+        await self.call(client, "GET", "/history", headers=h)
+
+    async def metrics_save(self, client, h):
+        day = f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}"
+        items = [{"name": "roti", "calories": 120, "protein_g": 3, "carbohydrates_total_g": 20, "fat_total_g": 3, "sugar_g": 0.5, "fiber_g": 2}]
+        await self.call(client, "POST", "/metrics/save", headers=h, json={
+            "day": day, "nutrition": {"items": items, "totals": {"calories": 120, "protein": 3, "carbs": 20, "fat": 3, "sugar": 0.5, "fiber": 2}},
+        })
+
+    async def mixed(self, client, h):
+        r = random.random()
+        if r < 0.15:
+            await self.food_scan(client, h)
+        elif r < 0.22:
+            await self.raw_scan(client, h)
+        elif r < 0.55:
+            await self.dashboard(client, h)
+        elif r < 0.85:
+            await self.history_scroll(client, h)
+        else:
+            await self.metrics_save(client, h)
+
+    async def scan_burst(self, client, h):
+        if random.random() < 0.75:
+            await self.food_scan(client, h)
+        else:
+            await self.raw_scan(client, h)
+
+    async def run_scenario(self, name: str, concurrency: int, duration: float, think_ms: float) -> Dict[str, Any]:
+        journey: Callable = getattr(self, name)
+        self.rec = Recorder()
+        deadline = time.perf_counter() + duration
+        limits = httpx.Limits(max_connections=concurrency * 4, max_keepalive_connections=concurrency * 4)
+
+        async def vu(idx: int):
+            user = self.users[idx % len(self.users)]
+            h = {"Authorization": f"Bearer {user['token']}"}
+            async with httpx.AsyncClient(base_url=self.base_url, timeout=120.0, limits=limits) as client:
+                # Mealtime bursts: everyone starts at once; other scenarios ramp over 1s
+                if name != "scan_burst":
+                    await asyncio.sleep(random.random())
+                while time.perf_counter() < deadline:
+                    await journey(client, h)
+                    if think_ms:
+                        await asyncio.sleep(random.expovariate(1000.0 / think_ms))
+
+        async with httpx.AsyncClient(base_url=self.base_url, headers={"X-Stats-Token": STATS_TOKEN}) as admin:
+            await admin.get("/internal/stats", params={"reset": "true"})
+            started = time.perf_counter()
+            await asyncio.gather(*(vu(i) for i in range(concurrency)))
+            elapsed = time.perf_counter() - started
+            stats_text = (await admin.get("/internal/stats", params={"reset": "true"})).text
+
+        server = _parse_prometheus(stats_text)
+        lag = server.pop("loop|event_loop.lag|internal", {})
+        endpoints = {}
+        for ep, lats in sorted(self.rec.latencies.items()):
+            endpoints[ep] = {"count": len(lats), "errors": self.rec.errors.get(ep, 0), "throughput_rps": round(len(lats) / elapsed, 2), **_summarize(lats)}
+        return {
+            "concurrency": concurrency,
+            "duration_s": round(elapsed, 2),
+            "requests": self.rec.total(),
+            "throughput_rps": round(self.rec.total() / elapsed, 2),
+            "errors": sum(self.rec.errors.values()),
+            "endpoints": endpoints,
+            "event_loop_lag": lag,
+            "server_stages": server,
+        }
+
+
+def _wait_http(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except Exception:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"timed out waiting for {url}")
+
+
+def start_stack(profile: Dict[str, Any], workdir: Path, seed: int):
+    procs: List[subprocess.Popen] = []
+    ports = {}
+    for provider, cfg in profile["providers"].items():
+        port = _free_port()
+        ports[provider] = port
+        procs.append(subprocess.Popen([
+            sys.executable, str(HERE / "stubs.py"), "--provider", provider, "--port", str(port),
+            "--median-ms", str(cfg.get("median_ms", 200)), "--sigma", str(cfg.get("sigma", 0.5)),
+            "--error-rate", str(cfg.get("error_rate", 0.0)), "--error-status", str(cfg.get("error_status", 503)),
+            "--seed", str(seed),
+        ]))
+    for provider, port in ports.items():
+        _wait_http(f"http://127.0.0.1:{port}/__health")
+
+    app_port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": str(BACKEND_DIR),
+        "OPENROUTER_API_KEY": "bench", "CALORIENINJAS_API_KEY": "bench", "SPOONACULAR_API_KEY": "bench",
+        "GOOGLE_API_KEY": "bench", "GOOGLE_CX": "bench",
+        "OPENROUTER_BASE_URL": f"http://127.0.0.1:{ports['openrouter']}/api/v1",
+        "CALORIENINJAS_BASE_URL": f"http://127.0.0.1:{ports['calorieninjas']}",
+        "SPOONACULAR_BASE_URL": f"http://127.0.0.1:{ports['spoonacular']}",
+        "GOOGLE_CSE_URL": f"http://127.0.0.1:{ports['google_cse']}/customsearch/v1",
+        "PUBLIC_URL": f"http://127.0.0.1:{app_port}",
+        "LOG_LEVEL": env.get("LOG_LEVEL", "WARNING"),
+        "UPSTREAM_QUOTAS": profile["quotas"],
+    })
+    # The app only honours /internal/stats?reset=true with its token
+    env["INTERNAL_STATS_TOKEN"] = STATS_TOKEN
+    procs.append(subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "Main:app", "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning", "--no-access-log"],
+        cwd=str(workdir), env=env,
+    ))
+    base_url = f"http://127.0.0.1:{app_port}"
+    _wait_http(f"{base_url}/ping", timeout=60.0)
+    return base_url, procs
+
+
+def seed_data(base_url: str, seed_cfg: Dict[str, int]) -> List[Dict[str, str]]:
+    users = []
+    with httpx.Client(base_url=base_url, timeout=30.0) as c:
+        for i in range(seed_cfg["users"]):
+            uname = f"bench_{i}"
+            r = c.post("/register", json={"username": uname, "password": "bench", "age": 30 + i % 40, "is_diabetic": i % 4 == 0})
+            if r.status_code != 200:
+                r = c.post("/login", json={"username": uname, "password": "bench"})
+            r.raise_for_status()
+            token = r.json()["token"]
+            h = {"Authorization": f"Bearer {token}"}
+            c.post("/user/targets", headers=h, json={"calories": 2200, "protein": 110, "carbs": 250, "fat": 70, "maxSugar": 40, "fiberTarget": 30})
+            for d in range(seed_cfg["days_per_user"]):
+                day = f"2024-06-{d + 1:02d}"
+                c.post("/metrics/save", headers=h, json={"day": day, "nutrition": {
+                    "items": [{"name": "dal", "calories": 300, "protein_g": 15, "carbohydrates_total_g": 40, "fat_total_g": 8, "sugar_g": 2, "fiber_g": 6, "sodium_mg": 300}],
+                    "totals": {"calories": 300, "protein": 15, "carbs": 40, "fat": 8, "sugar": 2, "fiber": 6}}})
+            for k in range(seed_cfg["history_per_user"]):
+                result = {"ingredients": ["tomato", "onion", "paneer"], "dishes": [
+                    {"name": f"Dish {j}", "description": "x" * 120, "steps": [f"Step {s}" for s in range(8)], "ingredients": ["1 cup rice"] * 6}
+                    for j in range(4)]} if k % 3 == 0 else {"itemName": "dal, rice", "nutrition": {"items": [{"name": "dal", "calories": 300}] * 3, "totals": {"calories": 900}}}
+                c.post("/history/save", headers=h, json={"image_url": f"{base_url}/public/seed_{k}.jpg", "scan_type": "raw_ingredients" if k % 3 == 0 else "food", "result_json": json.dumps(result)})
+            users.append({"username": uname, "token": token})
+    return users
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=str(BACKEND_DIR), text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(new: Dict[str, Any], base: Dict[str, Any], threshold: float) -> int:
+    """Print p95/throughput deltas per scenario/endpoint; return count of p95 regressions over threshold."""
+    regressions = 0
+    print(f"{'scenario':<16}{'endpoint':<38}{'p95 base':>10}{'p95 new':>10}{'delta':>9}{'rps delta':>11}")
+    for scen, nres in new.get("scenarios", {}).items():
+        bres = base.get("scenarios", {}).get(scen)
+        if not bres:
+            continue
+        for ep, nep in nres["endpoints"].items():
+            bep = bres["endpoints"].get(ep)
+            if not bep or not bep["p95_ms"]:
+                continue
+            delta = (nep["p95_ms"] - bep["p95_ms"]) / bep["p95_ms"]
+            rps_delta = (nep["throughput_rps"] - bep["throughput_rps"]) / bep["throughput_rps"] if bep["throughput_rps"] else 0.0
+            flag = "  REGRESSION" if delta > threshold else ""
+            regressions += 1 if flag else 0
+            print(f"{scen:<16}{ep:<38}{bep['p95_ms']:>10.1f}{nep['p95_ms']:>10.1f}{delta:>+9.1%}{rps_delta:>+11.1%}{flag}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--profile", help="JSON file overriding DEFAULT_PROFILE (providers/seed/quotas)")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of {SCENARIOS}")
+    ap.add_argument("--concurrency", type=int, default=20, help="virtual users per scenario (scan_burst uses 2x)")
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds per scenario")
+    ap.add_argument("--think-ms", type=float, default=200.0, help="mean think time between journeys")
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--out", default="bench-report.json")
+    ap.add_argument("--compare", help="baseline report to diff against")
+    ap.add_argument("--threshold", type=float, default=0.15, help="allowed relative p95 regression")
+    ap.add_argument("--keep-workdir", action="store_true")
+    args = ap.parse_args()
+
+    random.seed(args.seed)
+    profile = json.loads(json.dumps(DEFAULT_PROFILE))
+    if args.profile:
+        override = json.loads(Path(args.profile).read_text())
+        for section in ("providers", "seed"):
+            for k, v in (override.get(section) or {}).items():
+                if isinstance(v, dict):
+                    profile[section].setdefault(k, {}).update(v)
+                else:
+                    profile[section][k] = v
+        if "quotas" in override:
+            profile["quotas"] = override["quotas"]
+
+    workdir = Path(tempfile.mkdtemp(prefix="nutriguard-bench-"))
+    procs: List[subprocess.Popen] = []
+    try:
+        base_url, procs = start_stack(profile, workdir, args.seed)
+        users = seed_data(base_url, profile["seed"])
+        bench = Bench(base_url, users)
+        results = {}
+        for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+            if name not in SCENARIOS:
+                raise SystemExit(f"unknown scenario {name!r}")
+            conc = args.concurrency * 2 if name == "scan_burst" else args.concurrency
+            think = 0.0 if name == "scan_burst" else args.think_ms
+            print(f"[bench] {name}: {conc} users for {args.duration:.0f}s", flush=True)
+            results[name] = asyncio.run(bench.run_scenario(name, conc, args.duration, think))
+            r = results[name]
+            print(f"[bench] {name}: {r['requests']} req, {r['throughput_rps']} rps, {r['errors']} errors, loop lag p99={r['event_loop_lag'].get('p99_ms')}ms", flush=True)
+        report = {
+            "meta": {
+                "git_rev": _git_rev(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "args": vars(args),
+                "profile": profile,
+            },
+            "scenarios": results,
+        }
+        Path(args.out).write_text(json.dumps(report, indent=2, sort_keys=True))
+        print(f"[bench] wrote {args.out}")
+        if args.compare:
+            base = json.loads(Path(args.compare).read_text())
+            if compare(report, base, args.threshold):
+                sys.exit(1)
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
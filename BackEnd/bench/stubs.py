@@ -0,0 +1,188 @@
+"""Local stand-ins for the upstream providers used by the backend.
+
+One provider per process so latency in one stub never skews another:
+
+    python stubs.py --provider openrouter --port 9101 --median-ms 1500 --sigma 0.6 --error-rate 0.02
+
+Latency is log-normal around --median-ms; a fraction --error-rate of requests fail
+with --error-status (429 responses carry a Retry-After header). Response bodies
+mimic the real APIs closely enough for the backend's parsers.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import random
+import time
+import uuid
+import zlib
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+PROVIDERS = ("openrouter", "calorieninjas", "spoonacular", "google_cse")
+
+FOODS = ["dal tadka", "jeera rice", "roti", "paneer butter masala", "cucumber raita", "gulab jamun"]
+INGREDIENTS = ["tomato", "onion", "potato", "paneer", "spinach", "rice", "ginger", "green chilli"]
+DISHES = ["Aloo Palak", "Paneer Bhurji", "Tomato Rice", "Palak Paneer", "Aloo Tamatar Sabzi"]
+
+# 32x32 JPEG served as every dish image (Spoonacular/CSE image links point back at the stub)
+DISH_JPEG = base64.b64decode(
+    "/9j/4AAQSkZJRgABAQAAAQABAAD/2wBDAA0JCgsKCA0LCgsODg0PEyAVExISEyccHhcgLikxMC4pLSwzOko+MzZG"
+    "NywtQFdBRkxOUlNSMj5aYVpQYEpRUk//2wBDAQ4ODhMREyYVFSZPNS01T09PT09PT09PT09PT09PT09PT09PT09P"
+    "T09PT09PT09PT09PT09PT09PT09PT09PT0//wAARCAAgACADASIAAhEBAxEB/8QAHwAAAQUBAQEBAQEAAAAAAAAA"
+    "AAECAwQFBgcICQoL/8QAtRAAAgEDAwIEAwUFBAQAAAF9AQIDAAQRBRIhMUEGE1FhByJxFDKBkaEII0KxwRVS0fAk"
+    "M2JyggkKFhcYGRolJicoKSo0NTY3ODk6Q0RFRkdISUpTVFVWV1hZWmNkZWZnaGlqc3R1dnd4eXqDhIWGh4iJipKT"
+    "lJWWl5iZmqKjpKWmp6ipqrKztLW2t7i5usLDxMXGx8jJytLT1NXW19jZ2uHi4+Tl5ufo6erx8vP09fb3+Pn6/8QA"
+    "HwEAAwEBAQEBAQEBAQAAAAAAAAECAwQFBgcICQoL/8QAtREAAgECBAQDBAcFBAQAAQJ3AAECAxEEBSExBhJBUQdh"
+    "cRMiMoEIFEKRobHBCSMzUvAVYnLRChYkNOEl8RcYGRomJygpKjU2Nzg5OkNERUZHSElKU1RVVldYWVpjZGVmZ2hp"
+    "anN0dXZ3eHl6goOEhYaHiImKkpOUlZaXmJmaoqOkpaanqKmqsrO0tba3uLm6wsPExcbHyMnK0tPU1dbX2Nna4uPk"
+    "5ebn6Onq8vP09fb3+Pn6/9oADAMBAAIRAxEAPwCSiiivBPbCiiigAooooAKKKKAP/9k="
+)
+
+
+class Behaviour:
+    def __init__(self, median_ms: float, sigma: float, error_rate: float, error_status: int):
+        self.median_ms = max(0.1, median_ms)
+        self.sigma = max(0.0, sigma)
+        self.error_rate = error_rate
+        self.error_status = error_status
+
+    async def delay_or_fail(self):
+        await asyncio.sleep(random.lognormvariate(math.log(self.median_ms), self.sigma) / 1000.0)
+        if random.random() < self.error_rate:
+            headers = {"Retry-After": "1"} if self.error_status == 429 else None
+            return JSONResponse({"error": "stub failure"}, status_code=self.error_status, headers=headers)
+        return None
+
+
+def _completion(model: str, content: str) -> dict:
+    return {
+        "id": f"gen-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 900, "completion_tokens": 120, "total_tokens": 1020},
+    }
+
+
+def _openrouter_content(prompt_text: str) -> str:
+    lowered = prompt_text.lower()
+    if "raw ingredients" in lowered and "image" in lowered:
+        dishes = random.sample(DISHES, 3)
+        return json.dumps({
+            "ingredients": random.sample(INGREDIENTS, 4),
+            "dishes": [{"name": d, "description": f"Home-style {d.lower()}", "justification": "Uses what you have"} for d in dishes],
+        })
+    if "culinary assistant" in lowered:
+        return json.dumps({"dishes": [{"name": d, "description": "Stub dish", "justification": "Matches filters"} for d in random.sample(DISHES, 5)]})
+    items = random.sample(FOODS, random.randint(1, 3))
+    return "```json\n" + json.dumps({"items": [{"name": n, "serving": "1 bowl"} for n in items]}) + "\n```"
+
+
+def build_app(provider: str, behaviour: Behaviour) -> FastAPI:
+    app = FastAPI()
+
+    if provider == "openrouter":
+        @app.post("/api/v1/chat/completions")
+        async def chat(request: Request):
+            failed = await behaviour.delay_or_fail()
+            if failed:
+                return failed
+            body = await request.json()
+            text_parts = []
+            for m in body.get("messages", []):
+                content = m.get("content")
+                if isinstance(content, str):
+                    text_parts.append(content)
+                elif isinstance(content, list):
+                    text_parts.extend(c.get("text", "") for c in content if isinstance(c, dict))
+            return _completion(body.get("model", "stub"), _openrouter_content(" ".join(text_parts)))
+
+    elif provider == "calorieninjas":
+        @app.get("/v1/nutrition")
+        async def nutrition(query: str = ""):
+            failed = await behaviour.delay_or_fail()
+            if failed:
+                return failed
+            name = query.split(" ", 2)[-1] if query else "food"
+            return {"items": [{
+                "name": name, "calories": round(random.uniform(50, 450), 1), "serving_size_g": 100.0,
+                "fat_total_g": 7.1, "fat_saturated_g": 1.2, "protein_g": 6.3, "sodium_mg": 210,
+                "potassium_mg": 95, "cholesterol_mg": 0, "carbohydrates_total_g": 31.4,
+                "fiber_g": 2.9, "sugar_g": 3.1,
+            }]}
+
+    elif provider == "spoonacular":
+        titles = {}  # recipe id -> searched title, so /information matches the search
+
+        @app.get("/recipes/complexSearch")
+        async def search(request: Request, query: str = ""):
+            failed = await behaviour.delay_or_fail()
+            if failed:
+                return failed
+            rid = zlib.crc32(query.encode()) % 1_000_000
+            titles[rid] = query
+            return {"results": [{"id": rid, "title": query, "image": f"{request.base_url}img/{rid}.jpg"}], "totalResults": 1}
+
+        @app.get("/recipes/{recipe_id}/information")
+        async def information(request: Request, recipe_id: int):
+            failed = await behaviour.delay_or_fail()
+            if failed:
+                return failed
+            return {
+                "id": recipe_id,
+                "title": titles.get(recipe_id, f"Recipe {recipe_id}"),
+                "image": f"{request.base_url}img/{recipe_id}.jpg",
+                "analyzedInstructions": [{"steps": [{"number": i + 1, "step": f"Step {i + 1}"} for i in range(6)]}],
+                "extendedIngredients": [{"name": i, "original": f"1 cup {i}"} for i in random.sample(INGREDIENTS, 5)],
+            }
+
+    elif provider == "google_cse":
+        @app.get("/customsearch/v1")
+        async def cse(request: Request, q: str = ""):
+            failed = await behaviour.delay_or_fail()
+            if failed:
+                return failed
+            return {"items": [{"link": f"{request.base_url}img/{zlib.crc32(q.encode()) % 100000}.jpg"}]}
+
+    else:
+        raise ValueError(f"unknown provider {provider!r}")
+
+    if provider in ("spoonacular", "google_cse"):
+        # Image host behind the returned links; shares the provider's latency and error behaviour
+        @app.get("/img/{name}")
+        async def image(name: str):
+            failed = await behaviour.delay_or_fail()
+            if failed:
+                return failed
+            return Response(DISH_JPEG, media_type="image/jpeg")
+
+    @app.get("/__health")
+    async def health():
+        return {"ok": True}
+
+    return app
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--provider", choices=PROVIDERS, required=True)
+    ap.add_argument("--port", type=int, required=True)
+    ap.add_argument("--median-ms", type=float, default=200.0)
+    ap.add_argument("--sigma", type=float, default=0.5)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--error-status", type=int, default=503)
+    ap.add_argument("--seed", type=int, default=None)
+    args = ap.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+    app = build_app(args.provider, Behaviour(args.median_ms, args.sigma, args.error_rate, args.error_status))
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
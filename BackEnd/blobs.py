@@ -0,0 +1,157 @@
+"""Compression for large JSON blobs in data.db.
+
+history.result_json (a raw-ingredients scan keeps every dish with its steps and ingredient
+lines), suggestion_cache.value and the recipe store's JSON columns were the bulk of the file.
+Values of MIN_BYTES or more are stored as a BLOB: one byte naming the preset dictionary, then
+raw deflate (zlib) primed with that dictionary. The dictionary holds the keys and phrases our
+payloads repeat, so even a 1 KB scan compresses well, which plain per-row deflate cannot do.
+Shorter values, and values that would not shrink, stay TEXT; readers accept both:
+
+    conn.execute("INSERT ... VALUES (?)", (blobs.pack(text),))
+    text = blobs.unpack(row[0])
+
+Blobs are only inflated for rows a request actually returns, on the reader threads.
+compress_existing() converts rows written before compression, in the background, then runs
+VACUUM once if that saved BLOB_VACUUM_MIN_FREE of the file (shrunk rows mostly leave free
+space inside pages rather than free pages, so only VACUUM returns it).
+"""
+import asyncio
+import os
+import sqlite3
+import zlib
+from typing import List, Optional, Tuple, Union
+
+import db_reader
+import db_writer
+from logs import get_logger
+
+log = get_logger("db")
+
+MIN_BYTES = int(os.getenv("BLOB_COMPRESS_MIN_BYTES", "256"))
+LEVEL = 6
+MIGRATION_BATCH = 200
+MIGRATION_PAUSE_S = 0.05
+MIGRATION_DELAY_S = float(os.getenv("BLOB_MIGRATION_DELAY_S", "10"))
+VACUUM_MIN_FREE = float(os.getenv("BLOB_VACUUM_MIN_FREE", "0.25"))
+
+# Compressed (table, column) pairs; rows are walked by rowid
+COLUMNS = (
+    ("history", "result_json"),
+    ("suggestion_cache", "value"),
+    ("recipes", "steps"),
+    ("recipes", "ingredients"),
+    ("recipes", "nutrition"),
+)
+
+# Dictionary 1: compact JSON and phrases from food scans (CalorieNinjas items and totals),
+# raw-ingredient scans (dishes, steps, ingredient lines, proxied images) and Spoonacular
+# recipes. Deflate looks back 32 KB; the most common strings are at the end.
+# Never edit a dictionary: rows compressed with it become unreadable. Add a new id instead.
+_DICT_1 = (
+    b'Wash and chop the vegetables. Soak the rice for 30 minutes, then drain. Heat oil or ghee in a '
+    b'pan over medium heat. Add cumin seeds and let them splutter. Add the chopped onions and saute '
+    b'until golden brown. Add ginger garlic paste and green chillies and cook for a minute. Add the '
+    b'tomatoes, turmeric powder, red chilli powder, coriander powder, garam masala and salt to taste. '
+    b'Cook until the tomatoes are soft and the oil separates. Add water, cover and simmer for 10 '
+    b'minutes, stirring occasionally. Mix well. Bring to a boil, then reduce the heat to low. '
+    b'Garnish with fresh coriander leaves and a squeeze of lemon juice. Serve hot with rice or roti.'
+    b'","1 cup rice","2 tablespoons oil","1 teaspoon cumin seeds","1/2 teaspoon turmeric powder",'
+    b'"1 teaspoon red chilli powder","1 teaspoon garam masala","1 onion, finely chopped","2 tomatoes, '
+    b'chopped","1 tablespoon ginger garlic paste","2 green chillies, slit","salt to taste","fresh '
+    b'coriander leaves, chopped","2 cups water"],'
+    b'{"Calories":{"amount":,"unit":"kcal"},"Protein":{"amount":,"unit":"g"},"Carbohydrates":{"amount"'
+    b':,"unit":"g"},"Fat":{"amount":,"unit":"g"},"Sugar":{"amount":,"unit":"g"},"Fiber":{"amount":,'
+    b'"unit":"g"}}'
+    b'{"ingredients":["tomato","onion","potato","paneer","spinach","rice","garlic","ginger","green '
+    b'chilli","carrot","capsicum","peas","cauliflower","egg","chicken","lentils","chickpeas","cucumber"'
+    b',"coriander","lemon"],"dishes":[{"name":"Aloo Gobi","description":"A dry curry of potatoes and '
+    b'cauliflower","justification":"Uses the potatoes and cauliflower you have; low in sugar and '
+    b'suitable for lunch or dinner","image_url":"https://nutriguard-n98n.onrender.com/dish-image/",'
+    b'"steps":["Heat oil in a pan and add ","Add the ","Cook for ","Serve hot"],"ingredients":["1 cup '
+    b'","2 tablespoons ","1 teaspoon ","1/2 teaspoon ","salt to taste"],"nutrition":{"calories":'
+    b'"description":"","justification":"","image_url":null,"steps":null,"ingredients":null,'
+    b'"nutrition":null},{"name":"'
+    b'{"itemName":"","nutrition":{"items":[{"name":"","calories":,"serving_size_g":100.0,'
+    b'"fat_total_g":,"fat_saturated_g":,"protein_g":,"sodium_mg":,"potassium_mg":,"cholesterol_mg":'
+    b',"carbohydrates_total_g":,"fiber_g":,"sugar_g":,"queried_item":""},{"name":"'
+    b'"totals":{"calories":,"protein":,"carbs":,"fat":,"sugar":,"fiber":}}}'
+    b',"serving_size_g":100.0,"fat_total_g":,"fat_saturated_g":,"protein_g":,"sodium_mg":,'
+    b'"potassium_mg":,"cholesterol_mg":,"carbohydrates_total_g":,"fiber_g":,"sugar_g":,"queried_item":"'
+)
+_DICTIONARIES = {1: _DICT_1}
+CURRENT = 1
+
+
+def pack(text: Optional[str]) -> Union[str, bytes, None]:
+    """Value to store for text: a compressed BLOB, or text itself when short or incompressible."""
+    if text is None or len(text) < MIN_BYTES:
+        return text
+    data = text.encode("utf-8")
+    compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, -15, zdict=_DICTIONARIES[CURRENT])
+    packed = bytes((CURRENT,)) + compressor.compress(data) + compressor.flush()
+    return packed if len(packed) < len(data) else text
+
+
+def unpack(value: Union[str, bytes, None]) -> Optional[str]:
+    """Text of a stored value, as written by pack() or before compression."""
+    if not isinstance(value, bytes):
+        return value
+    decompressor = zlib.decompressobj(-15, zdict=_DICTIONARIES[value[0]])
+    return (decompressor.decompress(value[1:]) + decompressor.flush()).decode("utf-8")
+
+
+def _pack_batch(conn: sqlite3.Connection, table: str, column: str, after: int) -> Tuple[Optional[int], List[tuple], int]:
+    # typeof() reads only the record header, so skipping converted rows does not load their blobs
+    rows = conn.execute(
+        f"SELECT rowid, {column} FROM {table} WHERE rowid > ? AND typeof({column}) = 'text' ORDER BY rowid LIMIT ?",
+        (after, MIGRATION_BATCH),
+    ).fetchall()
+    updates = []
+    saved = 0
+    for rowid, text in rows:
+        packed = pack(text)
+        if isinstance(packed, bytes):
+            updates.append((packed, rowid, text))
+            saved += len(text.encode("utf-8")) - len(packed)
+    return (rows[-1][0] if rows else None), updates, saved
+
+
+def _store_batch(conn: sqlite3.Connection, table: str, column: str, updates: List[tuple]) -> int:
+    # Rows rewritten since they were read keep their new value
+    return conn.executemany(f"UPDATE {table} SET {column} = ? WHERE rowid = ? AND {column} = ?", updates).rowcount
+
+
+def _file_bytes(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+def _vacuum(conn: sqlite3.Connection, saved: int) -> Tuple[int, int]:
+    """VACUUM if saved is at least VACUUM_MIN_FREE of the file; (bytes before, after)."""
+    before = _file_bytes(conn)
+    if saved < before * VACUUM_MIN_FREE:
+        return before, before
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return before, _file_bytes(conn)
+
+
+async def compress_existing():
+    """Compress COLUMNS rows still stored as text, a small batch at a time, then VACUUM."""
+    await asyncio.sleep(MIGRATION_DELAY_S)
+    converted = saved = 0
+    try:
+        for table, column in COLUMNS:
+            after = 0
+            while after is not None:
+                after, updates, batch_saved = await db_reader.run(lambda conn: _pack_batch(conn, table, column, after))
+                if updates:
+                    converted += await db_writer.run(lambda conn: _store_batch(conn, table, column, updates))
+                    saved += batch_saved
+                    await asyncio.sleep(MIGRATION_PAUSE_S)
+        if converted:
+            log.info("[blobs] Compressed %s stored values, saving about %s bytes", converted, saved)
+            before, after_vacuum = await db_writer.run(lambda conn: _vacuum(conn, saved), transaction=False)
+            if after_vacuum < before:
+                log.info("[blobs] VACUUM shrank data.db from %s to %s bytes", before, after_vacuum)
+    except Exception:
+        log.exception("[blobs] Compressing stored values failed")
@@ -0,0 +1,208 @@
+"""Ingredient and food name canonicalization.
+
+The vision model and users name the same food many ways ("Tomatoes", "tomato", "tamatar",
+"cherry tomato"). Anything keyed on those strings (suggestion cache, recipe store
+ingredient index, nutrition lookups) should see one name per food, so names are folded to
+a canonical form:
+  - Unicode/case/whitespace folding, punctuation and leading quantities dropped
+  - preparation words removed ("fresh chopped onions" -> onion); words that can be part of a
+    food's name ("baby corn", "whole wheat", "raw mango", "Big Mac") are kept
+  - plurals reduced to the singular ("leaves" -> leaf), except for foods named in the plural
+    ("peas", "french fries")
+  - aliases, synonyms and Hindi names mapped through ALIASES ("aloo" -> potato)
+Unknown names pass through folded, so canonicalization never loses a food. Canonical names are
+keys (caches, dedupe, the recipe index); what the user or model wrote is still what gets shown
+and sent to nutrition lookups.
+"""
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+# alias -> canonical name; keys and values are already folded and singular
+ALIASES: Dict[str, str] = {
+    # Varieties that count as the same ingredient
+    "cherry tomato": "tomato",
+    "roma tomato": "tomato",
+    "plum tomato": "tomato",
+    "red onion": "onion",
+    "white onion": "onion",
+    "yellow onion": "onion",
+    "spring onion": "green onion",
+    "scallion": "green onion",
+    "green pea": "peas",
+    "pea": "peas",
+    "chickpea": "chickpeas",
+    "garbanzo bean": "chickpeas",
+    "kidney bean": "kidney beans",
+    "lentil": "lentils",
+    "capsicum": "bell pepper",
+    "green capsicum": "bell pepper",
+    "red capsicum": "bell pepper",
+    "brinjal": "eggplant",
+    "aubergine": "eggplant",
+    "lady finger": "okra",
+    "ladyfinger": "okra",
+    "curd": "yogurt",
+    "yoghurt": "yogurt",
+    "cilantro": "coriander",
+    "coriander leaf": "coriander",
+    "curry leaf": "curry leaves",
+    "fenugreek leaf": "fenugreek leaves",
+    "methi leaf": "fenugreek leaves",
+    "cottage cheese": "paneer",
+    "green chilli": "green chili",
+    "green chilly": "green chili",
+    "chilli": "chili",
+    "chilly": "chili",
+    "red chilli": "red chili",
+    "red chilly": "red chili",
+    "chili pepper": "chili",
+    "maida": "all purpose flour",
+    "plain flour": "all purpose flour",
+    # Hindi / Hinglish names
+    "tamatar": "tomato",
+    "pyaz": "onion",
+    "pyaaz": "onion",
+    "kanda": "onion",
+    "aloo": "potato",
+    "alu": "potato",
+    "gobi": "cauliflower",
+    "gobhi": "cauliflower",
+    "phool gobi": "cauliflower",
+    "phool gobhi": "cauliflower",
+    "patta gobi": "cabbage",
+    "band gobhi": "cabbage",
+    "bhindi": "okra",
+    "baingan": "eggplant",
+    "palak": "spinach",
+    "methi": "fenugreek leaves",
+    "dhania": "coriander",
+    "hara dhania": "coriander",
+    "pudina": "mint",
+    "adrak": "ginger",
+    "lahsun": "garlic",
+    "lehsun": "garlic",
+    "hari mirch": "green chili",
+    "lal mirch": "red chili",
+    "mirch": "chili",
+    "shimla mirch": "bell pepper",
+    "gajar": "carrot",
+    "mooli": "radish",
+    "matar": "peas",
+    "mattar": "peas",
+    "kheera": "cucumber",
+    "kakdi": "cucumber",
+    "lauki": "bottle gourd",
+    "ghiya": "bottle gourd",
+    "karela": "bitter gourd",
+    "kaddu": "pumpkin",
+    "shakarkandi": "sweet potato",
+    "nimbu": "lemon",
+    "nimboo": "lemon",
+    "kela": "banana",
+    "seb": "apple",
+    "aam": "mango",
+    "anda": "egg",
+    "ande": "egg",
+    "murgh": "chicken",
+    "murg": "chicken",
+    "machli": "fish",
+    "gosht": "mutton",
+    "chawal": "rice",
+    "chaval": "rice",
+    "daal": "dal",
+    "dahi": "yogurt",
+    "doodh": "milk",
+    "makhan": "butter",
+    "atta": "whole wheat flour",
+    "besan": "chickpea flour",
+    "gram flour": "chickpea flour",
+    "suji": "semolina",
+    "sooji": "semolina",
+    "rava": "semolina",
+    "chana": "chickpeas",
+    "chole": "chickpeas",
+    "kabuli chana": "chickpeas",
+    "rajma": "kidney beans",
+    "jeera": "cumin",
+    "haldi": "turmeric",
+    "elaichi": "cardamom",
+    "dalchini": "cinnamon",
+    "laung": "clove",
+    "kaju": "cashew",
+    "badam": "almond",
+    "moongphali": "peanut",
+    "mungfali": "peanut",
+    "narial": "coconut",
+    "nariyal": "coconut",
+    "gud": "jaggery",
+    "gur": "jaggery",
+    "cheeni": "sugar",
+    "namak": "salt",
+}
+
+# Foods whose usual name is plural; never singularized
+PLURAL_NAMES = {
+    "peas", "chickpeas", "lentils", "kidney beans", "oats", "greens", "noodles", "beans",
+    "fenugreek leaves", "curry leaves", "cornflakes", "sprouts", "grits", "molasses",
+    "fries", "french fries",
+}
+
+# Preparation and filler words that do not change what the food is. Size and ripeness words
+# are not here: they name different foods as often as not ("baby corn", "raw mango")
+_MODIFIERS = {
+    "fresh", "chopped", "sliced", "diced", "minced", "grated", "shredded", "peeled", "organic",
+    "finely", "roughly", "some", "few", "a", "an", "of", "piece", "pieces",
+}
+# "-ves" plurals whose singular ends in "f"; other "-ves" words just drop the "s" ("cloves")
+_VES_PLURALS = {"leaves": "leaf", "loaves": "loaf", "halves": "half", "calves": "calf"}
+# Words ending in "s" that are not plurals
+_SINGULAR_S = ("ss", "us", "is", "ys")
+
+# Leading quantity with an optional unit: "2 ", "1/2 cup ", "200 g of "
+_QUANTITY_RE = re.compile(
+    r"^(?:[\d./½¼¾-]+\s+)*[\d./½¼¾-]+(?:\s*(?:x|cups?|tbsps?|tsps?|tablespoons?|teaspoons?|g|kg|grams?|ml|l|oz|lbs?|"
+    r"pinch(?:es)?|handfuls?|bowls?|pieces?|slices?)\b)?\s+(?:of\s+)?"
+)
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+
+
+def _fold(name: str) -> str:
+    text = unicodedata.normalize("NFKC", name).casefold()
+    text = _QUANTITY_RE.sub("", text.strip())
+    text = _NON_WORD_RE.sub(" ", text)
+    return " ".join(w for w in text.split() if w not in _MODIFIERS)
+
+
+def _singular(word: str) -> str:
+    if len(word) <= 3 or not word.endswith("s") or word.endswith(_SINGULAR_S):
+        return word
+    if word in _VES_PLURALS:
+        return _VES_PLURALS[word]
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("oes", "ches", "shes", "xes")):
+        return word[:-2]
+    return word[:-1]
+
+
+def canonical_ingredient(name: Optional[str]) -> str:
+    """Canonical form of one ingredient or food name ("" for empty input)."""
+    folded = _fold(name or "")
+    if not folded or folded in PLURAL_NAMES:
+        return folded
+    if folded in ALIASES:
+        return ALIASES[folded]
+    words = folded.split()
+    words[-1] = _singular(words[-1])
+    singular = " ".join(words)
+    if singular in PLURAL_NAMES:
+        return singular
+    return ALIASES.get(singular, singular)
+
+
+def canonical_ingredients(names: Iterable[Optional[str]]) -> List[str]:
+    """Canonical names in first-seen order, without duplicates or empties."""
+    out = dict.fromkeys(canonical_ingredient(n) for n in names if isinstance(n, str))
+    out.pop("", None)
+    return list(out)
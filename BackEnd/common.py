@@ -0,0 +1,84 @@
+"""Helpers and models shared by several routers."""
+from pathlib import Path
+from typing import Optional
+from urllib.parse import urlparse
+
+import orjson
+from fastapi import Request
+from pydantic import BaseModel
+
+from config import PUBLIC_URL
+
+
+def summarize(obj, max_words=10):
+    """Return a short preview string for logging: first max_words of text or str(obj)."""
+    try:
+        s = str(obj)
+    except Exception:
+        return "<unserializable>"
+    words = s.split()
+    if len(words) <= max_words:
+        return s
+    return " ".join(words[:max_words]) + "..."
+
+
+def compact_json(text: str) -> str:
+    """Validate a client-provided JSON string and return its compact form.
+    Raises ValueError if the text is not valid JSON.
+    """
+    try:
+        return orjson.dumps(orjson.loads(text)).decode("utf-8")
+    except orjson.JSONDecodeError as e:
+        raise ValueError(str(e))
+
+
+def json_fragment(text: Optional[str]) -> Optional[orjson.Fragment]:
+    """Wrap a stored JSON string so orjson embeds it verbatim instead of re-escaping it.
+    Only use for blobs validated on write (see compact_json).
+    """
+    if not text:
+        return None
+    return orjson.Fragment(text)
+
+
+# Uploaded images are stored here and served under /public
+public_dir = Path("public")
+
+
+def public_base_url(request: Request) -> str:
+    """Base URL clients can reach us at: configured PUBLIC_URL unless it points to localhost
+    (unreachable from a device), else the base URL of the request.
+    """
+    base = (PUBLIC_URL or "").rstrip("/")
+    if base and not ("localhost" in base or "127.0.0.1" in base):
+        return base
+    return str(request.base_url).rstrip("/")
+
+
+def public_path_from_url(url: Optional[str]) -> Optional[str]:
+    """Path relative to public/ for one of our /public/... image URLs, or None for other URLs."""
+    if not url:
+        return None
+    path = urlparse(url).path
+    marker = "/public/"
+    idx = path.find(marker)
+    if idx < 0:
+        return None
+    return path[idx + len(marker):] or None
+
+
+class ImageRequest(BaseModel):
+    image_url: str  # Now expects a URL to the image
+
+
+class ImageURLRequest(BaseModel):
+    image_url: str
+
+
+class NutritionTotals(BaseModel):
+    calories: Optional[float] = 0
+    protein: Optional[float] = 0
+    carbs: Optional[float] = 0
+    fat: Optional[float] = 0
+    sugar: Optional[float] = 0
+    fiber: Optional[float] = 0
@@ -0,0 +1,63 @@
+"""Environment configuration. Reading it is cheap; log_summary() reports it once at startup."""
+import os
+
+from logs import get_logger
+
+config_log = get_logger("config")
+
+OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+CALORIENINJAS_API_KEY = os.getenv("CALORIENINJAS_API_KEY")
+SPOONACULAR_API_KEY = os.getenv("SPOONACULAR_API_KEY")  # temporary fallback per user instruction
+PUBLIC_URL = os.getenv("PUBLIC_URL", "http://localhost:8000")
+
+# Image model selection (make configurable via env) - using free Gemma 3 4b vision model
+OPENROUTER_IMAGE_MODEL = os.getenv("OPENROUTER_IMAGE_MODEL", "nvidia/nemotron-nano-12b-v2-vl:free")
+# Interchangeable vision models for hedged scans, primary first (defaults to OPENROUTER_IMAGE_MODEL alone)
+OPENROUTER_IMAGE_MODELS = [m.strip() for m in os.getenv("OPENROUTER_IMAGE_MODELS", "").split(",") if m.strip()] or [OPENROUTER_IMAGE_MODEL]
+# JWT secret for token signing
+JWT_SECRET = os.getenv("JWT_SECRET", "change_this_secret")
+
+# Upstream base URLs (overridable, e.g. to point at the local stubs in bench/)
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1").rstrip("/")
+CALORIENINJAS_BASE_URL = os.getenv("CALORIENINJAS_BASE_URL", "https://api.calorieninjas.com").rstrip("/")
+SPOONACULAR_BASE_URL = os.getenv("SPOONACULAR_BASE_URL", "https://api.spoonacular.com").rstrip("/")
+GOOGLE_CSE_URL = os.getenv("GOOGLE_CSE_URL", "https://www.googleapis.com/customsearch/v1")
+
+# Defensive normalization for the CalorieNinjas key: strip whitespace/newlines which can cause invalid header values
+if CALORIENINJAS_API_KEY:
+    CALORIENINJAS_API_KEY = CALORIENINJAS_API_KEY.strip()
+
+# Dev-only admin bypass: only enable if DEV_ADMIN_BYPASS env var is set to '1'
+DEV_ADMIN_BYPASS = os.getenv('DEV_ADMIN_BYPASS', '0') == '1'
+
+# Optional shared secret for the internal stats endpoint (send as X-Stats-Token)
+INTERNAL_STATS_TOKEN = os.getenv("INTERNAL_STATS_TOKEN")
+
+
+def _retention_days(spec):
+    """Parse UPLOAD_RETENTION_DAYS="default=7,food=7,raw_ingredients=3" (days per scan type)."""
+    out = {"default": 7.0}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        name, value = part.split("=", 1)
+        try:
+            out[name.strip()] = float(value)
+        except ValueError:
+            config_log.warning("Ignoring invalid UPLOAD_RETENTION_DAYS entry %r", part)
+    return out
+
+
+# How long uploaded images are kept, per scan type; files referenced from history are kept
+UPLOAD_RETENTION_DAYS = _retention_days(os.getenv("UPLOAD_RETENTION_DAYS"))
+
+
+def log_summary():
+    config_log.info("OPENROUTER_API_KEY set: %s", bool(OPENROUTER_API_KEY))
+    config_log.info("CALORIENINJAS_API_KEY set: %s", bool(CALORIENINJAS_API_KEY))
+    config_log.info("SPOONACULAR_API_KEY set: %s", bool(SPOONACULAR_API_KEY))
+    config_log.info("PUBLIC_URL set: %s", PUBLIC_URL)
+    config_log.info("OPENROUTER_IMAGE_MODEL set: %s", OPENROUTER_IMAGE_MODEL)
+    config_log.info("OPENROUTER_IMAGE_MODELS: %s", OPENROUTER_IMAGE_MODELS)
+    config_log.info("UPLOAD_RETENTION_DAYS: %s", UPLOAD_RETENTION_DAYS)
+    config_log.info("JWT secret set: %s", bool(JWT_SECRET and JWT_SECRET != 'change_this_secret'))
@@ -0,0 +1,641 @@
+"""SQLite schema, migrations and the small write helpers shared by the routers."""
+import ast
+import json
+import sqlite3
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import orjson
+
+from common import compact_json, public_dir, public_path_from_url
+from config import UPLOAD_RETENTION_DAYS
+from logs import get_logger
+from security import hash_password
+
+db_log = get_logger("db")
+
+# --- Simple SQLite user + metrics storage ---
+DB_PATH = Path("data.db")
+
+# Upper bound for one meal's calories, grams of a macro or serving size; keeps day totals finite
+MAX_MEAL_VALUE = 100_000.0
+
+# CalorieNinjas item field -> meals column
+MEAL_CORE_FIELDS = {
+    "name": "name",
+    "calories": "calories",
+    "protein_g": "protein",
+    "carbohydrates_total_g": "carbs",
+    "fat_total_g": "fat",
+    "sugar_g": "sugar",
+    "fiber_g": "fiber",
+}
+
+
+def split_meal(meal: Dict[str, Any]):
+    """Split a meal item into (core column values, serving_size_g, compact extras JSON or None)."""
+    core = {col: meal.get(field) for field, col in MEAL_CORE_FIELDS.items()}
+    serving_size_g = meal.get("serving_size_g")
+    extras = {
+        k: v for k, v in meal.items()
+        if k not in MEAL_CORE_FIELDS and k != "serving_size_g" and v is not None
+    }
+    extras_json = orjson.dumps(extras).decode("utf-8") if extras else None
+    return core, serving_size_g, extras_json
+
+
+def parse_legacy_meal_blob(raw: str) -> Optional[Dict[str, Any]]:
+    """Parse a legacy meals.raw_json value (a Python dict repr, or JSON) into a dict."""
+    try:
+        val = ast.literal_eval(raw)
+    except Exception:
+        try:
+            val = json.loads(raw)
+        except Exception:
+            return None
+    return val if isinstance(val, dict) else None
+
+
+# result_json keys whose string values name what was scanned (food items, ingredients, dishes)
+_HISTORY_NAME_KEYS = {"itemName", "item_name", "name", "queried_item", "title", "food", "dish"}
+_HISTORY_LIST_KEYS = {"ingredients", "items", "dishes", "foods"}
+
+
+def history_search_terms(result_json: Optional[str]) -> str:
+    """Food, ingredient and dish names from a stored scan result, for the history_fts index.
+    Descriptions, steps and justifications are skipped so searches match what was eaten.
+    """
+    try:
+        data = orjson.loads(result_json) if result_json else None
+    except orjson.JSONDecodeError:
+        return ""
+    terms = []
+
+    def walk(node, depth):
+        if depth > 4:
+            return
+        if isinstance(node, dict):
+            for k, v in node.items():
+                if isinstance(v, str) and k in _HISTORY_NAME_KEYS:
+                    terms.append(v)
+                elif k in _HISTORY_LIST_KEYS and isinstance(v, list):
+                    for it in v:
+                        if isinstance(it, str):
+                            terms.append(it)
+                        else:
+                            walk(it, depth + 1)
+                elif isinstance(v, dict):
+                    walk(v, depth + 1)
+        elif isinstance(node, list):
+            for it in node:
+                walk(it, depth + 1)
+
+    walk(data, 0)
+    seen = dict.fromkeys(t.strip() for t in terms)
+    seen.pop("", None)
+    return "\n".join(seen)
+
+
+def index_history(conn: sqlite3.Connection, history_id: int, user_id: int, result_json: Optional[str]):
+    """Add a history row to history_fts on the caller's connection/transaction.
+    owner holds "u<user_id>" so a search never leaves the user's own rows.
+    """
+    conn.execute(
+        "INSERT OR REPLACE INTO history_fts (rowid, owner, terms) VALUES (?, ?, ?)",
+        (history_id, f"u{user_id}", history_search_terms(result_json)),
+    )
+
+
+# Bump when _create_and_migrate() gains a migration. Databases already at this version
+# skip the whole migration/backfill pass on startup (checked via PRAGMA user_version).
+SCHEMA_VERSION = 7
+
+
+def create_db():
+    """Create tables and run migrations unless the database is already at SCHEMA_VERSION."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+    if version >= SCHEMA_VERSION:
+        return
+    _create_and_migrate(version)
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+    finally:
+        conn.close()
+    db_log.info("Database schema at version %s", SCHEMA_VERSION)
+
+
+def _create_and_migrate(from_version: int = 0):
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    # users: id, email(unique), username(unique), password_hash, name, height, weight, gender, age, is_diabetic
+    # All user profile data is persisted in SQLite and survives server restarts
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        email TEXT UNIQUE NOT NULL,
+        username TEXT UNIQUE,
+        password_hash TEXT NOT NULL,
+        name TEXT
+    )
+    """)
+    # metrics: id, user_id, day (YYYY-MM-DD), calories, protein, carbs, fat, sugar, fiber, goal_achieved
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS metrics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        day TEXT NOT NULL,
+        calories REAL DEFAULT 0,
+        protein REAL DEFAULT 0,
+        carbs REAL DEFAULT 0,
+        fat REAL DEFAULT 0,
+        sugar REAL DEFAULT 0,
+        fiber REAL DEFAULT 0,
+        goal_achieved INTEGER DEFAULT 0,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """)
+    # meals: id, metric_id, name, calories, protein, carbs, fat, sugar, fiber, serving_size_g, extras
+    # extras holds compact JSON of the non-core fields (sodium, cholesterol, queried_item, ...)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS meals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        metric_id INTEGER NOT NULL,
+        name TEXT,
+        calories REAL,
+        protein REAL,
+        carbs REAL,
+        fat REAL,
+        sugar REAL,
+        fiber REAL,
+        serving_size_g REAL,
+        extras TEXT,
+        FOREIGN KEY(metric_id) REFERENCES metrics(id)
+    )
+    """)
+    # history: id, user_id, timestamp, image_url, scan_type (food|raw_ingredients), result_json
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        timestamp TEXT NOT NULL,
+        image_url TEXT,
+        scan_type TEXT NOT NULL,
+        result_json TEXT,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """)
+    # Per-user lookups and the export's (day, id) / (timestamp, id) keyset pages
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_metrics_user_day ON metrics(user_id, day)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_history_user_time ON history(user_id, timestamp)")
+    # history_fts: searchable names per history row (rowid = history.id), see index_history();
+    # the prefix indexes make "bir*" style queries cheap
+    cur.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(owner, terms, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    # suggestion_cache: LLM dish suggestions by canonical request key (see suggestion_cache.py);
+    # times are epoch seconds, last_used drives LRU eviction
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS suggestion_cache (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_used REAL NOT NULL
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_suggestion_cache_last_used ON suggestion_cache(last_used)")
+    # uploads: one row per file under public/, written at upload time; path is relative to public/.
+    # Expiry walks the partial index on expires_at in small batches (see uploads.py); pinned rows are
+    # referenced from history and never expire.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS uploads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        path TEXT UNIQUE NOT NULL,
+        size INTEGER,
+        sha256 TEXT,
+        user_id INTEGER,
+        scan_type TEXT,
+        created_at TEXT NOT NULL,
+        expires_at TEXT NOT NULL,
+        pinned INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_uploads_expiry ON uploads(expires_at) WHERE pinned = 0")
+    # Local recipe store (see recipe_store.py). recipes.id is the Spoonacular id; steps/ingredients/nutrition
+    # are JSON and only set once the full recipe (detailed = 1) was fetched. recipe_names holds titles and
+    # the dish names that found a recipe, indexed by recipe_names_fts; recipe_ingredients maps ingredient -> recipe.
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS recipes (
+        id INTEGER PRIMARY KEY,
+        title TEXT,
+        image_url TEXT,
+        steps TEXT,
+        ingredients TEXT,
+        nutrition TEXT,
+        detailed INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS recipe_names (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        recipe_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        UNIQUE(recipe_id, name),
+        FOREIGN KEY(recipe_id) REFERENCES recipes(id)
+    )
+    """)
+    cur.execute("CREATE VIRTUAL TABLE IF NOT EXISTS recipe_names_fts USING fts5(name, content='recipe_names', content_rowid='id')")
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS recipe_names_ai AFTER INSERT ON recipe_names BEGIN
+        INSERT INTO recipe_names_fts (rowid, name) VALUES (new.id, new.name);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS recipe_names_ad AFTER DELETE ON recipe_names BEGIN
+        INSERT INTO recipe_names_fts (recipe_names_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    END
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS recipe_ingredients (
+        ingredient TEXT NOT NULL,
+        recipe_id INTEGER NOT NULL,
+        PRIMARY KEY (ingredient, recipe_id)
+    ) WITHOUT ROWID
+    """)
+    conn.commit()
+    conn.close()
+
+    # Migration: ensure username column exists and has a UNIQUE index
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(users)")
+        cols = [r[1] for r in cur.fetchall()]
+        if 'username' not in cols:
+            # Add the username column (nullable for existing rows)
+            cur.execute("ALTER TABLE users ADD COLUMN username TEXT")
+            conn.commit()
+        # Create a unique index on username if it doesn't exist
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users(username)")
+        conn.commit()
+
+        # Populate username for existing users if empty: use part before @ from email or email itself
+        cur.execute("SELECT id, email, username FROM users")
+        rows = cur.fetchall()
+        for r in rows:
+            uid, email_val, uname = r
+            if uname:
+                continue
+            base = email_val.split('@')[0] if email_val and '@' in email_val else email_val
+            candidate = base or f'user{uid}'
+            # ensure uniqueness: if candidate exists, append uid
+            cur.execute("SELECT id FROM users WHERE username = ?", (candidate,))
+            if cur.fetchone():
+                candidate = f"{candidate}_{uid}"
+            cur.execute("UPDATE users SET username = ? WHERE id = ?", (candidate, uid))
+        conn.commit()
+
+        # Ensure user profile columns exist (height, weight, gender, age, is_diabetic)
+        cur.execute("PRAGMA table_info(users)")
+        cols_now = [r[1] for r in cur.fetchall()]
+        profile_cols = {
+            'height': 'REAL',
+            'weight': 'REAL',
+            'gender': 'TEXT',
+            'age': 'INTEGER',
+            'is_diabetic': 'INTEGER'  # 0 or 1 (boolean)
+        }
+        for col, coltype in profile_cols.items():
+            if col not in cols_now:
+                try:
+                    cur.execute(f"ALTER TABLE users ADD COLUMN {col} {coltype}")
+                except Exception:
+                    db_log.exception("Failed to add column %s", col)
+        conn.commit()
+
+        # Ensure goal_achieved column exists in metrics table
+        cur.execute("PRAGMA table_info(metrics)")
+        metrics_cols = [r[1] for r in cur.fetchall()]
+        if 'goal_achieved' not in metrics_cols:
+            try:
+                cur.execute("ALTER TABLE metrics ADD COLUMN goal_achieved INTEGER DEFAULT 0")
+                conn.commit()
+                db_log.info("Added goal_achieved column to metrics table")
+            except Exception:
+                db_log.exception("Failed to add goal_achieved column to metrics")
+        conn.commit()
+        # Ensure macro target columns exist (persisted daily plan)
+        target_cols = {
+            'target_calories': 'REAL',
+            'target_protein': 'REAL',
+            'target_carbs': 'REAL',
+            'target_fat': 'REAL',
+            'target_max_sugar': 'REAL',
+            'target_fiber': 'REAL'
+        }
+        cur.execute("PRAGMA table_info(users)")
+        cols_targets = [r[1] for r in cur.fetchall()]
+        for col, coltype in target_cols.items():
+            if col not in cols_targets:
+                try:
+                    cur.execute(f"ALTER TABLE users ADD COLUMN {col} {coltype}")
+                    conn.commit()
+                    db_log.info("Added target column %s to users table", col)
+                except Exception:
+                    db_log.exception("Failed adding target column %s", col)
+    except Exception:
+        db_log.exception('Error migrating/ensuring username column')
+    finally:
+        conn.close()
+
+    _migrate_meals_schema()
+    if from_version < 2:
+        _adopt_existing_uploads()
+    if from_version < 4:
+        _index_existing_history()
+    if from_version < 7:
+        _compact_existing_history()
+
+
+def _migrate_meals_schema():
+    """Move meals from Python-repr raw_json blobs to typed columns + compact extras JSON.
+    Idempotent: converted rows have raw_json cleared, so later runs only touch new legacy rows.
+    """
+    conn = sqlite3.connect(DB_PATH)
+    cur = conn.cursor()
+    try:
+        cur.execute("PRAGMA table_info(meals)")
+        meal_cols = [r[1] for r in cur.fetchall()]
+        for col, coltype in (('serving_size_g', 'REAL'), ('extras', 'TEXT')):
+            if col not in meal_cols:
+                cur.execute(f"ALTER TABLE meals ADD COLUMN {col} {coltype}")
+                db_log.info("Added %s column to meals table", col)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_meals_metric_id ON meals(metric_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_meals_name ON meals(name)")
+        conn.commit()
+
+        if 'raw_json' not in meal_cols:
+            return
+        cur.execute("SELECT id, raw_json FROM meals WHERE raw_json IS NOT NULL")
+        rows = cur.fetchall()
+        converted = 0
+        for meal_id, raw in rows:
+            meal = parse_legacy_meal_blob(raw)
+            if meal is None:
+                db_log.warning("[migrate] Could not parse legacy raw_json for meal id=%s; keeping blob", meal_id)
+                continue
+            _, serving_size_g, extras = split_meal(meal)
+            cur.execute(
+                "UPDATE meals SET serving_size_g = ?, extras = ?, raw_json = NULL WHERE id = ?",
+                (serving_size_g, extras, meal_id),
+            )
+            converted += 1
+        conn.commit()
+        if converted:
+            db_log.info("[migrate] Converted %s legacy meal blobs to structured columns", converted)
+    except Exception:
+        db_log.exception('Error migrating meals schema')
+    finally:
+        conn.close()
+
+
+def _adopt_existing_uploads():
+    """Record files already in public/ (from before the uploads table) so they expire like new ones.
+    Their expiry counts from the file mtime with the default retention; files referenced from
+    history are pinned. One pass over the directory, only when migrating to schema version 2.
+    """
+    if not public_dir.is_dir():
+        return
+    retention = timedelta(days=UPLOAD_RETENTION_DAYS["default"])
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = []
+        for p in public_dir.iterdir():
+            try:
+                if not p.is_file():
+                    continue
+                st = p.stat()
+            except OSError:
+                continue
+            created = datetime.utcfromtimestamp(st.st_mtime)
+            rows.append((p.name, st.st_size, created.isoformat(timespec="seconds"), (created + retention).isoformat(timespec="seconds")))
+        conn.executemany(
+            "INSERT OR IGNORE INTO uploads (path, size, created_at, expires_at) VALUES (?, ?, ?, ?)",
+            rows,
+        )
+        referenced = {public_path_from_url(url) for (url,) in conn.execute("SELECT image_url FROM history WHERE image_url IS NOT NULL")}
+        referenced.discard(None)
+        conn.executemany("UPDATE uploads SET pinned = 1 WHERE path = ?", [(path,) for path in referenced])
+        conn.commit()
+        if rows:
+            db_log.info("[migrate] Recorded %s existing uploads (%s referenced from history)", len(rows), len(referenced))
+    except Exception:
+        db_log.exception("Error recording existing uploads")
+    finally:
+        conn.close()
+
+
+def _index_existing_history():
+    """Fill history_fts for history rows saved before the index existed (schema version 4)."""
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        rows = conn.execute(
+            "SELECT id, user_id, result_json FROM history WHERE id NOT IN (SELECT rowid FROM history_fts)"
+        ).fetchall()
+        for history_id, user_id, result_json in rows:
+            index_history(conn, history_id, user_id, result_json)
+        conn.commit()
+        if rows:
+            db_log.info("[migrate] Indexed %s history rows for search", len(rows))
+    except Exception:
+        db_log.exception("Error indexing existing history")
+    finally:
+        conn.close()
+
+
+def _compact_existing_history():
+    """Make every history.result_json valid compact JSON (schema version 7).
+    Reads embed it verbatim (common.json_fragment), but before /history/save validated its input
+    any string was stored; text that does not parse is kept as a JSON string literal.
+    """
+    import blobs  # blobs -> db_reader -> db
+
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        updates = []
+        for history_id, stored in conn.execute("SELECT id, result_json FROM history WHERE result_json IS NOT NULL"):
+            text = blobs.unpack(stored)
+            if not text:
+                continue
+            try:
+                compact = compact_json(text)
+            except ValueError:
+                compact = orjson.dumps(text).decode("utf-8")
+            if compact != text:
+                updates.append((blobs.pack(compact), history_id))
+        conn.executemany("UPDATE history SET result_json = ? WHERE id = ?", updates)
+        conn.commit()
+        if updates:
+            db_log.info("[migrate] Rewrote %s history rows as compact JSON", len(updates))
+    except Exception:
+        db_log.exception("Error compacting existing history")
+    finally:
+        conn.close()
+
+
+def insert_user(conn: sqlite3.Connection, email: str, password: str, name: Optional[str] = None, username: Optional[str] = None, height: Optional[float] = None, weight: Optional[float] = None, gender: Optional[str] = None, age: Optional[int] = None, is_diabetic: Optional[bool] = None) -> Dict[str, Any]:
+    """Insert a user on the caller's connection/transaction (no commit)."""
+    cur = conn.cursor()
+    pwd = hash_password(password)
+    # Derive a username from email if not explicitly provided in the caller
+    if not username:
+        try:
+            username = email.split('@')[0] if email and '@' in email else email
+        except Exception:
+            username = email
+    # Convert is_diabetic boolean to integer (0 or 1) for SQLite
+    diabetic_val = None if is_diabetic is None else (1 if is_diabetic else 0)
+    cur.execute("INSERT INTO users (email, username, password_hash, name, height, weight, gender, age, is_diabetic) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", (email, username, pwd, name, height, weight, gender, age, diabetic_val))
+    user_id = cur.lastrowid
+    return {"id": user_id, "email": email, "username": username, "name": name, "height": height, "weight": weight, "gender": gender, "age": age, "is_diabetic": is_diabetic}
+
+
+def metric_id_for_day(conn: sqlite3.Connection, user_id: int, day: str) -> int:
+    """The user's metrics row for day, created if missing, on the caller's connection/transaction."""
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM metrics WHERE user_id = ? AND day = ?", (user_id, day))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    cur.execute("INSERT INTO metrics (user_id, day) VALUES (?, ?)", (user_id, day))
+    return cur.lastrowid
+
+
+_INSERT_MEAL = (
+    "INSERT INTO meals (metric_id, name, calories, protein, carbs, fat, sugar, fiber, serving_size_g, extras) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+def meal_params(metric_id: int, meal: Dict[str, Any]) -> tuple:
+    """_INSERT_MEAL parameters for a CalorieNinjas-style item."""
+    core, serving_size_g, extras = split_meal(meal)
+    return (
+        metric_id,
+        core["name"],
+        core["calories"],
+        core["protein"],
+        core["carbs"],
+        core["fat"],
+        core["sugar"],
+        core["fiber"],
+        serving_size_g,
+        extras,
+    )
+
+
+def insert_meal(cur: sqlite3.Cursor, metric_id: int, meal: Dict[str, Any]) -> int:
+    cur.execute(_INSERT_MEAL, meal_params(metric_id, meal))
+    return cur.lastrowid
+
+
+# Daily calorie goal: a day counts as achieved within +/-20% of it (same rule as /metrics/save)
+CALORIE_GOAL = 2500
+CALORIE_GOAL_TOLERANCE = 0.2
+TOTAL_COLUMNS = ("calories", "protein", "carbs", "fat", "sugar", "fiber")
+
+
+def goal_achieved_for(calories: Optional[float]) -> bool:
+    return CALORIE_GOAL * (1 - CALORIE_GOAL_TOLERANCE) <= (calories or 0) <= CALORIE_GOAL * (1 + CALORIE_GOAL_TOLERANCE)
+
+
+def meal_totals(meals: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Sum of the core values of CalorieNinjas-style items, keyed by TOTAL_COLUMNS."""
+    totals = {col: 0.0 for col in TOTAL_COLUMNS}
+    for meal in meals:
+        core, _, _ = split_meal(meal)
+        for col in TOTAL_COLUMNS:
+            totals[col] += float(core[col] or 0)
+    return totals
+
+
+def _apply_totals_delta(cur: sqlite3.Cursor, metric_id: int, delta: Dict[str, float]) -> Dict[str, Any]:
+    """Add delta to a day's totals and re-evaluate its goal in one UPDATE; returns the new totals.
+    Not clamped at 0: meal values are non-negative, so removing a meal exactly undoes adding it.
+    """
+    sets = ", ".join(f"{col} = COALESCE({col}, 0) + ?" for col in TOTAL_COLUMNS)
+    cur.execute(
+        f"UPDATE metrics SET {sets}, goal_achieved = (COALESCE(calories, 0) + ? BETWEEN ? AND ?) "
+        f"WHERE id = ? RETURNING {', '.join(TOTAL_COLUMNS)}, goal_achieved",
+        (
+            *(delta[col] for col in TOTAL_COLUMNS),
+            delta["calories"],
+            CALORIE_GOAL * (1 - CALORIE_GOAL_TOLERANCE),
+            CALORIE_GOAL * (1 + CALORIE_GOAL_TOLERANCE),
+            metric_id,
+        ),
+    )
+    row = cur.fetchone()
+    return {"totals": dict(zip(TOTAL_COLUMNS, row[:-1])), "goal_achieved": bool(row[-1])}
+
+
+def add_meals(conn: sqlite3.Connection, user_id: int, day: str, meals: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Append meals to a user's day and add them to the day's totals, on the caller's
+    connection/transaction. Returns {"metric_id", "meal_ids", "totals", "goal_achieved"}.
+    """
+    cur = conn.cursor()
+    metric_id = metric_id_for_day(conn, user_id, day)
+    meal_ids = [insert_meal(cur, metric_id, meal) for meal in meals]
+    return {"metric_id": metric_id, "meal_ids": meal_ids, **_apply_totals_delta(cur, metric_id, meal_totals(meals))}
+
+
+def remove_meal(conn: sqlite3.Connection, user_id: int, meal_id: int) -> Optional[Dict[str, Any]]:
+    """Delete one of the user's meals and subtract it from its day's totals, on the caller's
+    connection/transaction. Returns {"day", "totals", "goal_achieved"}, or None if the meal
+    does not exist or is not theirs.
+    """
+    cur = conn.cursor()
+    cur.execute(
+        f"SELECT m.metric_id, d.day, {', '.join('m.' + col for col in TOTAL_COLUMNS)} "
+        "FROM meals m JOIN metrics d ON d.id = m.metric_id WHERE m.id = ? AND d.user_id = ?",
+        (meal_id, user_id),
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    cur.execute("DELETE FROM meals WHERE id = ?", (meal_id,))
+    result = _apply_totals_delta(cur, row[0], {col: -float(v or 0) for col, v in zip(TOTAL_COLUMNS, row[2:])})
+    return {"day": row[1], **result}
+
+
+def import_days(conn: sqlite3.Connection, user_id: int, days: List[Dict[str, Any]]) -> int:
+    """Write a batch of imported days on the caller's connection/transaction; returns the number
+    of meals inserted. Each entry is {"day", "meals", "replace", "totals"}: replace drops the
+    day's stored meals first; totals (when not None) overwrite the day's totals and goal,
+    otherwise the meals are added to them.
+    """
+    cur = conn.cursor()
+    inserted = 0
+    for entry in days:
+        metric_id = metric_id_for_day(conn, user_id, entry["day"])
+        if entry["replace"]:
+            cur.execute("DELETE FROM meals WHERE metric_id = ?", (metric_id,))
+        cur.executemany(_INSERT_MEAL, [meal_params(metric_id, meal) for meal in entry["meals"]])
+        inserted += len(entry["meals"])
+        totals = entry["totals"]
+        if totals is None:
+            _apply_totals_delta(cur, metric_id, meal_totals(entry["meals"]))
+        else:
+            cur.execute(
+                f"UPDATE metrics SET {', '.join(f'{col} = ?' for col in TOTAL_COLUMNS)}, goal_achieved = ? WHERE id = ?",
+                (*(totals[col] for col in TOTAL_COLUMNS), 1 if goal_achieved_for(totals["calories"]) else 0, metric_id),
+            )
+    return inserted
@@ -0,0 +1,120 @@
+"""Bounded thread pool for SQLite reads.
+
+Async handlers used to call sqlite3 on the event loop, so every query (a long history list,
+an FTS search) stalled all other requests, including in-flight model calls. Reads now run
+on DB_READ_THREADS dedicated threads, each with its own long-lived connection (WAL lets them
+read while db_writer commits), and handlers await the result:
+
+    rows = await db_reader.run(lambda conn: conn.execute("SELECT ...", params).fetchall())
+
+At most DB_READ_THREADS queries run at once; the rest queue here instead of taking threads
+from asyncio's default executor, which also serves image and file work. Read functions must
+not write; writes go through db_writer.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from db import DB_PATH
+from telemetry import observe, register_gauge
+
+THREADS = int(os.getenv("DB_READ_THREADS", "4"))
+
+ReadFn = Callable[[sqlite3.Connection], Any]
+
+
+class Reader:
+    """A fixed set of reader threads, one connection per thread, opened on first use."""
+
+    def __init__(self, path, threads: int):
+        self.path = path
+        self.threads = max(1, threads)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.reads = 0
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="db-reader")
+            return self._executor
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Only this thread uses it; check_same_thread=False lets stop() close it
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._local.conn = conn
+            with self._lock:
+                self._conns.append(conn)
+        return conn
+
+    def _call(self, fn: ReadFn, submitted: float) -> Any:
+        started = time.perf_counter()
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        observe("db.read_wait", started - submitted)
+        failed = False
+        conn = self._connection()
+        try:
+            return fn(conn)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            # A read never leaves a transaction open (it would pin an old snapshot)
+            if conn.in_transaction:
+                conn.rollback()
+            with self._lock:
+                self.active -= 1
+                self.reads += 1
+            observe("db.read", time.perf_counter() - started, error=failed)
+
+    def _dequeue_cancelled(self, future: "Future[Any]"):
+        # A read cancelled before it started never reaches _call
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    async def run(self, fn: ReadFn) -> Any:
+        with self._lock:
+            self.queued += 1
+        future = self._pool().submit(self._call, fn, time.perf_counter())
+        future.add_done_callback(self._dequeue_cancelled)
+        return await asyncio.wrap_future(future)
+
+    def stop(self):
+        """Wait for running reads, then close the threads' connections."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+reader = Reader(DB_PATH, THREADS)
+
+register_gauge(
+    "nutriguard_db_reads",
+    "Reads on the SQLite reader pool: queued, running, and completed since start.",
+    lambda: [({"stat": "queued"}, reader.queued), ({"stat": "active"}, reader.active),
+             ({"stat": "reads"}, reader.reads)],
+)
+
+
+async def run(fn: ReadFn) -> Any:
+    """Run fn(conn) on a reader thread and return its result."""
+    return await reader.run(fn)
@@ -0,0 +1,174 @@
+"""Single SQLite writer with group commit.
+
+Request handlers used to open a connection and commit per write, so a burst meant lock
+contention ("database is locked") and one fsync per request. Writes now go through one
+writer thread: handlers submit a function that takes the writer's connection, the thread
+collects everything that arrives within DB_WRITE_BATCH_WINDOW_MS (up to
+DB_WRITE_BATCH_MAX operations) and runs it as one transaction with one commit, and each
+caller's future is resolved with its function's return value (lastrowid etc.) once the
+batch is durable.
+
+Each operation runs inside its own SAVEPOINT: one that raises (e.g. a UNIQUE violation)
+is rolled back alone and its caller gets the exception; the rest of the batch commits.
+Write functions must not call commit()/rollback() themselves. Statements that cannot run in a
+transaction (VACUUM) go through run(fn, transaction=False): fn runs alone between batches.
+
+    history_id = await db_writer.run(lambda conn: conn.execute("INSERT ...", params).lastrowid)
+"""
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional, Tuple
+
+from db import DB_PATH
+from logs import get_logger
+from telemetry import observe, register_gauge
+
+log = get_logger("db")
+
+BATCH_WINDOW_S = float(os.getenv("DB_WRITE_BATCH_WINDOW_MS", "2")) / 1000
+BATCH_MAX = int(os.getenv("DB_WRITE_BATCH_MAX", "256"))
+
+WriteFn = Callable[[sqlite3.Connection], Any]
+Item = Tuple[WriteFn, Future, bool]  # fn, caller's future, run inside the batch transaction
+
+_STOP = object()
+
+
+class Writer:
+    """Owns the only write connection; operations are queued from any thread or the event loop."""
+
+    def __init__(self, path):
+        self.path = path
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.ops = 0
+        self.batches = 0
+        self.failed_batches = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Flush queued writes and stop the thread."""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+
+    def submit(self, fn: WriteFn, transaction: bool = True) -> "Future[Any]":
+        self.start()
+        future: "Future[Any]" = Future()
+        self._queue.put((fn, future, transaction))
+        return future
+
+    async def run(self, fn: WriteFn, transaction: bool = True) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, transaction))
+
+    def _run(self):
+        conn = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+        # WAL lets the per-request read connections keep reading while a batch commits
+        conn.execute("PRAGMA journal_mode=WAL")
+        try:
+            stopping = False
+            held = None
+            while not stopping:
+                item, held = held or self._queue.get(), None
+                if item is _STOP:
+                    break
+                if not item[2]:
+                    self._run_alone(conn, item)
+                    continue
+                batch = [item]
+                deadline = time.monotonic() + BATCH_WINDOW_S
+                while len(batch) < BATCH_MAX:
+                    remaining = deadline - time.monotonic()
+                    try:
+                        item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    if not item[2]:
+                        held = item  # runs after this batch commits
+                        break
+                    batch.append(item)
+                self._commit(conn, batch)
+        finally:
+            conn.close()
+
+    def _run_alone(self, conn: sqlite3.Connection, item: Item):
+        fn, future, _ = item
+        started = time.perf_counter()
+        try:
+            result = fn(conn)
+        except BaseException as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        self.ops += 1
+        observe("db.write_alone", time.perf_counter() - started, error=future.exception() is not None)
+
+    def _commit(self, conn: sqlite3.Connection, batch: List[Item]):
+        started = time.perf_counter()
+        outcomes = []
+        failed = False
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for fn, future, _ in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = fn(conn)
+                except BaseException as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE op")
+                    outcomes.append((future, result, None))
+            conn.execute("COMMIT")
+        except Exception as e:
+            # The transaction itself failed (lock timeout, I/O error): nothing in the batch was written
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            failed = True
+            self.failed_batches += 1
+            log.exception("[db-writer] Batch of %s writes failed", len(batch))
+            outcomes = [(future, None, e) for _, future, _ in batch]
+        self.ops += len(batch)
+        self.batches += 1
+        observe("db.write_batch", time.perf_counter() - started, error=failed)
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+writer = Writer(DB_PATH)
+
+register_gauge(
+    "nutriguard_db_writes",
+    "Writes through the group-commit writer: operations and committed batches since start.",
+    lambda: [({"stat": "ops"}, writer.ops), ({"stat": "batches"}, writer.batches),
+             ({"stat": "failed_batches"}, writer.failed_batches)],
+)
+
+
+async def run(fn: WriteFn, transaction: bool = True) -> Any:
+    """Run fn(conn) in the next write batch and return its result once committed
+    (transaction=False: alone and outside any transaction, between batches).
+    """
+    return await writer.run(fn, transaction)
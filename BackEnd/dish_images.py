@@ -0,0 +1,242 @@
+"""Caching proxy for third-party dish images (Spoonacular and Google CSE results).
+
+Recipe enrichment rewrites each external dish image_url to /dish-image/<digest>?u=<url>.
+The digest is an HMAC of the URL (keyed with JWT_SECRET), so only URLs we handed out
+can be fetched through us, and it doubles as the cache key. The first request fetches
+the image once (DISH_IMAGE_TIMEOUT_S, DISH_IMAGE_MAX_BYTES), checks that it decodes as
+an image, fits it into DISH_IMAGE_PX and stores it under DISH_IMAGE_CACHE_DIR; later
+requests are served from disk. The cache is LRU-evicted down to DISH_IMAGE_CACHE_MB;
+recency is the file mtime (touched on hits), so it survives restarts. A failed fetch
+is remembered for DISH_IMAGE_NEGATIVE_TTL_S so dead links fail fast instead of
+stalling every device that shows them.
+
+DISH_IMAGE_PROXY=0 leaves dish image URLs untouched.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+
+import upstream
+import variants
+from config import JWT_SECRET
+from logs import get_logger
+from telemetry import register_gauge, span
+
+log = get_logger("dish_images")
+
+ENABLED = os.getenv("DISH_IMAGE_PROXY", "1") == "1"
+CACHE_DIR = Path(os.getenv("DISH_IMAGE_CACHE_DIR", "cache/dish_images"))
+CACHE_MAX_BYTES = int(float(os.getenv("DISH_IMAGE_CACHE_MB", "200")) * 1024 * 1024)
+IMAGE_PX = int(os.getenv("DISH_IMAGE_PX", "512"))
+FETCH_TIMEOUT_S = float(os.getenv("DISH_IMAGE_TIMEOUT_S", "5"))
+MAX_SOURCE_BYTES = int(os.getenv("DISH_IMAGE_MAX_BYTES", str(8 * 1024 * 1024)))
+NEGATIVE_TTL_S = float(os.getenv("DISH_IMAGE_NEGATIVE_TTL_S", "3600"))
+
+_DIGEST_LEN = 40
+
+# Magic bytes of the formats we pass through when Pillow is not installed
+_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def _sniff(data: bytes) -> Optional[str]:
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, media_type in _SIGNATURES:
+        if data.startswith(magic):
+            return media_type
+    return None
+
+
+def sign(url: str) -> str:
+    return hmac.new(JWT_SECRET.encode(), url.encode(), hashlib.sha256).hexdigest()[:_DIGEST_LEN]
+
+
+def proxy_url(url: Optional[str], base: str) -> Optional[str]:
+    """Rewrite an external http(s) image URL to our caching proxy; other values pass through."""
+    if not ENABLED or not url or not url.startswith(("http://", "https://")) or url.startswith(base + "/"):
+        return url
+    return f"{base}/dish-image/{sign(url)}?u={quote(url, safe='')}"
+
+
+class DiskLRU:
+    """Size-bounded directory of cached images; recency is kept in memory and in file mtimes."""
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # digest -> size, oldest first
+        self._total = 0
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def _load(self):
+        # Called with the lock held, once: rebuild the index from the files left by earlier runs
+        found = []
+        if self.root.is_dir():
+            for p in self.root.glob("*/*"):
+                if p.name.startswith("."):
+                    continue  # partial write from a crash
+                try:
+                    st = p.stat()
+                except OSError:
+                    continue
+                found.append((st.st_mtime, p.name, st.st_size))
+        for _, digest, size in sorted(found):
+            self._entries[digest] = size
+            self._total += size
+        self._loaded = True
+
+    def get(self, digest: str) -> Optional[bytes]:
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if digest not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+        path = self._path(digest)
+        try:
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._total -= self._entries.pop(digest, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, digest: str, data: bytes):
+        path = self._path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{digest}.{threading.get_ident()}")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        evict = []
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._total += len(data) - self._entries.pop(digest, 0)
+            self._entries[digest] = len(data)
+            while self._total > self.max_bytes and len(self._entries) > 1:
+                old, size = self._entries.popitem(last=False)
+                self._total -= size
+                self.evictions += 1
+                evict.append(old)
+        for old in evict:
+            self._path(old).unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"bytes": self._total, "entries": len(self._entries), "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions}
+
+
+cache = DiskLRU(CACHE_DIR, CACHE_MAX_BYTES)
+_failed: Dict[str, float] = {}  # digest -> monotonic time until which we do not retry
+_in_flight: Dict[str, "asyncio.Future[Optional[Tuple[bytes, str]]]"] = {}
+
+register_gauge(
+    "nutriguard_dish_image_cache",
+    "Dish image proxy cache: bytes/entries held and hits/misses/evictions since start.",
+    lambda: [({"stat": k}, v) for k, v in cache.stats().items()],
+)
+
+
+def _prepare(raw: bytes) -> Optional[bytes]:
+    """Validate and shrink a fetched image; None if it is not an image we can serve."""
+    if variants.AVAILABLE:
+        try:
+            return variants.downscale(raw, IMAGE_PX, 75)
+        except Exception:
+            return None
+    return raw if _sniff(raw) else None
+
+
+async def _download(url: str) -> Optional[bytes]:
+    client = upstream.get_http_client()
+    async with client.stream("GET", url, timeout=FETCH_TIMEOUT_S, follow_redirects=True) as resp:
+        if resp.status_code != 200:
+            log.info("[dish-image] %s answered %s", url, resp.status_code, sample=True)
+            return None
+        if int(resp.headers.get("content-length") or 0) > MAX_SOURCE_BYTES:
+            return None
+        chunks, size = [], 0
+        async for chunk in resp.aiter_bytes():
+            size += len(chunk)
+            if size > MAX_SOURCE_BYTES:
+                return None
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+
+async def _fetch_and_store(digest: str, url: str) -> Optional[Tuple[bytes, str]]:
+    try:
+        with span("dish_image.fetch", provider="dish_image_host"):
+            raw = await _download(url)
+    except httpx.HTTPError as e:
+        log.info("[dish-image] fetch failed for %s: %s", url, e, sample=True)
+        raw = None
+    data = await asyncio.to_thread(_prepare, raw) if raw else None
+    if data is None:
+        now = time.monotonic()
+        if len(_failed) > 10000:
+            for d in [d for d, until in _failed.items() if until <= now]:
+                del _failed[d]
+        _failed[digest] = now + NEGATIVE_TTL_S
+        return None
+    await asyncio.to_thread(cache.put, digest, data)
+    return data, _sniff(data) or "application/octet-stream"
+
+
+async def get(digest: str, url: str) -> Optional[Tuple[bytes, str]]:
+    """(bytes, media type) of the proxied image, or None for a bad signature or an unusable source."""
+    if len(digest) != _DIGEST_LEN or not hmac.compare_digest(digest, sign(url)):
+        return None
+    data = await asyncio.to_thread(cache.get, digest)
+    if data is not None:
+        return data, _sniff(data) or "application/octet-stream"
+    until = _failed.get(digest)
+    if until is not None:
+        if until > time.monotonic():
+            return None
+        _failed.pop(digest, None)
+    existing = _in_flight.get(digest)
+    if existing is not None:
+        return await asyncio.shield(existing)
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[digest] = future
+    try:
+        result = await _fetch_and_store(digest, url)
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved when nobody else was waiting
+        raise
+    finally:
+        _in_flight.pop(digest, None)
@@ -0,0 +1,152 @@
+"""Hedged calls across interchangeable vision models.
+
+hedged(models, attempt, is_valid) starts attempt(models[0]). If it has not produced a
+valid result by that model's hedge threshold, the next model is started as well; the
+first valid result wins and the other in-flight attempts are cancelled. An attempt
+that fails or returns something invalid fails over to the next model immediately.
+
+Thresholds adapt per model: the VISION_HEDGE_QUANTILE (default p90) of its recent
+successful latencies, clamped to [VISION_HEDGE_MIN_S, VISION_HEDGE_MAX_S]. Until a
+model has VISION_HEDGE_MIN_SAMPLES samples, VISION_HEDGE_DEFAULT_S is used.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Sequence, Tuple, TypeVar
+
+from logs import get_logger
+from telemetry import observe, register_gauge
+
+log = get_logger("hedging")
+
+T = TypeVar("T")
+
+HEDGE_QUANTILE = float(os.getenv("VISION_HEDGE_QUANTILE", "0.9"))
+HEDGE_DEFAULT_S = float(os.getenv("VISION_HEDGE_DEFAULT_S", "8"))
+HEDGE_MIN_S = float(os.getenv("VISION_HEDGE_MIN_S", "1"))
+HEDGE_MAX_S = float(os.getenv("VISION_HEDGE_MAX_S", "30"))
+HEDGE_MIN_SAMPLES = int(os.getenv("VISION_HEDGE_MIN_SAMPLES", "10"))
+# Attempts allowed in flight at once (primary + hedges)
+HEDGE_MAX_IN_FLIGHT = int(os.getenv("VISION_HEDGE_MAX_IN_FLIGHT", "2"))
+
+
+class ModelLatency:
+    """Sliding window of successful latencies for one model plus hedge outcome counters."""
+
+    def __init__(self, window: int = 200):
+        self._lock = threading.Lock()
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.hedges = 0  # times a hedge was fired because this model was slow
+        self.wins = 0  # times this model produced the result
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def threshold(self) -> float:
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return HEDGE_DEFAULT_S
+            ordered = sorted(self._samples)
+        value = ordered[min(len(ordered) - 1, int(HEDGE_QUANTILE * (len(ordered) - 1)))]
+        return min(HEDGE_MAX_S, max(HEDGE_MIN_S, value))
+
+
+_models: Dict[str, ModelLatency] = {}
+_models_lock = threading.Lock()
+
+
+def stats_for(model: str) -> ModelLatency:
+    with _models_lock:
+        if model not in _models:
+            _models[model] = ModelLatency()
+        return _models[model]
+
+
+def _snapshot() -> List[Tuple[str, ModelLatency]]:
+    with _models_lock:
+        return list(_models.items())
+
+
+register_gauge(
+    "nutriguard_vision_hedge_threshold_seconds",
+    "Current hedge threshold per vision model.",
+    lambda: [({"model": m}, s.threshold()) for m, s in _snapshot()],
+)
+register_gauge(
+    "nutriguard_vision_hedges",
+    "Hedges fired because the model was slower than its threshold (since start).",
+    lambda: [({"model": m}, s.hedges) for m, s in _snapshot()],
+)
+register_gauge(
+    "nutriguard_vision_wins",
+    "Requests answered by each model (since start).",
+    lambda: [({"model": m}, s.wins) for m, s in _snapshot()],
+)
+
+
+async def hedged(models: Sequence[str], attempt: Callable[[str, bool], Awaitable[T]],
+                 is_valid: Callable[[T], bool], stage: str) -> Tuple[T, str]:
+    """Run attempt(model, is_hedge) across models as described in the module docstring.
+    is_hedge is True only for speculative launches (the earlier attempt is still running).
+
+    Returns (result, model) for the first valid result. If none is valid, returns the
+    first result that was produced (so callers keep their existing error handling), or
+    re-raises the first exception when every attempt raised.
+    """
+    pending = list(models)
+    in_flight: Dict["asyncio.Task[T]", Tuple[str, float]] = {}
+    last_launch: Optional[Tuple[str, float]] = None
+    fallback: Optional[Tuple[T, str]] = None
+    first_error: Optional[BaseException] = None
+
+    def launch(is_hedge: bool):
+        nonlocal last_launch
+        model = pending.pop(0)
+        started = time.perf_counter()
+        in_flight[asyncio.ensure_future(attempt(model, is_hedge))] = (model, started)
+        last_launch = (model, started)
+
+    launch(False)
+    try:
+        while in_flight:
+            timeout = None
+            if pending and len(in_flight) < HEDGE_MAX_IN_FLIGHT and last_launch is not None:
+                model, started = last_launch
+                timeout = max(0.0, stats_for(model).threshold() - (time.perf_counter() - started))
+            done, _ = await asyncio.wait(list(in_flight), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                slow_model = last_launch[0]
+                stats_for(slow_model).hedges += 1
+                log.info("[hedge] %s slower than %.1fs; hedging with %s", slow_model, stats_for(slow_model).threshold(), pending[0], sample=True)
+                launch(True)
+                continue
+            for task in done:
+                model, started = in_flight.pop(task)
+                elapsed = time.perf_counter() - started
+                error = task.exception()
+                if error is None and is_valid(task.result()):
+                    stats_for(model).record(elapsed)
+                    stats_for(model).wins += 1
+                    observe(stage, elapsed, provider=model, metric="vision")
+                    return task.result(), model
+                observe(stage, elapsed, provider=model, error=True, metric="vision")
+                if error is not None:
+                    log.warning("[hedge] %s failed after %.2fs: %s", model, elapsed, error)
+                    first_error = first_error or error
+                elif fallback is None:
+                    fallback = (task.result(), model)
+            # Fail over right away instead of waiting for a threshold
+            while pending and len(in_flight) < HEDGE_MAX_IN_FLIGHT:
+                launch(False)
+    finally:
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+    if fallback is not None:
+        return fallback
+    assert first_error is not None
+    raise first_error
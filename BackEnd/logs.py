@@ -0,0 +1,156 @@
+"""Low-overhead structured logging for NutriGuard.
+
+- get_logger("scan") returns a subsystem logger ("nutriguard.scan"). Calls take
+  %-style args plus keyword fields; nothing is formatted unless the level is enabled.
+- lazy(fn, *args) defers expensive previews (e.g. summarize(completion)) until a
+  line is actually emitted.
+- Every record carries the current request id (set by the request-id middleware).
+- Levels per subsystem via LOG_LEVELS="scan=DEBUG,cleanup=WARNING"; base level via LOG_LEVEL.
+- sample=True lines are emitted with the subsystem's sample rate
+  (LOG_SAMPLING="scan=0.05", default LOG_SAMPLE_RATE=0.1).
+- LOG_FORMAT=json emits one JSON object per line; the default is text with logfmt fields.
+"""
+import contextvars
+import logging
+import os
+import random
+import sys
+from typing import Any, Callable, Dict, Optional
+
+import orjson
+
+ROOT = "nutriguard"
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+_sample_rates: Dict[str, float] = {}
+_default_sample_rate = 0.1
+
+
+class lazy:
+    """Defer a computation until the log record is formatted."""
+    __slots__ = ("fn", "args", "kwargs")
+
+    def __init__(self, fn: Callable[..., Any], *args, **kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+    def __str__(self) -> str:
+        try:
+            return str(self.fn(*self.args, **self.kwargs))
+        except Exception:
+            return "<unavailable>"
+
+    __repr__ = __str__
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+def _fmt_value(v: Any) -> str:
+    s = str(v)
+    if not s or any(c in s for c in ' "='):
+        return '"' + s.replace('"', '\\"') + '"'
+    return s
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"{record.levelname}:{record.name}:[{getattr(record, 'request_id', '-')}] {record.getMessage()}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={_fmt_value(v)}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out: Dict[str, Any] = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            out.update(fields)
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(out, default=str).decode("utf-8")
+
+
+class StructLogger:
+    """Thin wrapper over a stdlib logger that checks the level before doing any work."""
+    __slots__ = ("_logger", "subsystem")
+
+    def __init__(self, subsystem: str):
+        self.subsystem = subsystem
+        self._logger = logging.getLogger(f"{ROOT}.{subsystem}")
+
+    def isEnabledFor(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, msg: str, args, fields: Dict[str, Any], exc_info=None, sample: bool = False):
+        if not self._logger.isEnabledFor(level):
+            return
+        if sample and random.random() >= _sample_rates.get(self.subsystem, _default_sample_rate):
+            return
+        self._logger.log(level, msg, *args, exc_info=exc_info, extra={"fields": fields} if fields else None, stacklevel=3)
+
+    def debug(self, msg: str, *args, sample: bool = False, **fields):
+        self._log(logging.DEBUG, msg, args, fields, sample=sample)
+
+    def info(self, msg: str, *args, sample: bool = False, **fields):
+        self._log(logging.INFO, msg, args, fields, sample=sample)
+
+    def warning(self, msg: str, *args, sample: bool = False, **fields):
+        self._log(logging.WARNING, msg, args, fields, sample=sample)
+
+    def error(self, msg: str, *args, **fields):
+        self._log(logging.ERROR, msg, args, fields)
+
+    def exception(self, msg: str, *args, **fields):
+        self._log(logging.ERROR, msg, args, fields, exc_info=True)
+
+
+def get_logger(subsystem: str) -> StructLogger:
+    return StructLogger(subsystem)
+
+
+def _parse_pairs(spec: Optional[str]) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            out[k.strip()] = v.strip()
+    return out
+
+
+def configure():
+    """Install the request-id aware handler on the nutriguard logger tree from env settings."""
+    global _default_sample_rate
+    root = logging.getLogger(ROOT)
+    if getattr(root, "_nutriguard_configured", False):
+        return
+    handler = logging.StreamHandler(sys.stderr)
+    handler.addFilter(_RequestIdFilter())
+    handler.setFormatter(JSONFormatter() if os.getenv("LOG_FORMAT", "text").lower() == "json" else TextFormatter())
+    root.addHandler(handler)
+    root.propagate = False
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    for subsystem, level in _parse_pairs(os.getenv("LOG_LEVELS")).items():
+        logging.getLogger(f"{ROOT}.{subsystem}").setLevel(level.upper())
+    try:
+        _default_sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "0.1"))
+        for subsystem, rate in _parse_pairs(os.getenv("LOG_SAMPLING")).items():
+            _sample_rates[subsystem] = float(rate)
+    except ValueError:
+        root.warning("Invalid LOG_SAMPLE_RATE/LOG_SAMPLING; using defaults")
+    root._nutriguard_configured = True
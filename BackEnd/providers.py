@@ -0,0 +1,223 @@
+"""Calls to the third-party providers (OpenRouter, CalorieNinjas, Spoonacular, Google CSE).
+The OpenAI SDK client is built on first use: importing the SDK is the most expensive part of a cold start.
+"""
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+import httpx
+from fastapi import HTTPException
+
+import startup
+import upstream
+from config import (
+    CALORIENINJAS_API_KEY,
+    CALORIENINJAS_BASE_URL,
+    GOOGLE_CSE_URL,
+    OPENROUTER_API_KEY,
+    OPENROUTER_BASE_URL,
+    OPENROUTER_IMAGE_MODELS,
+    SPOONACULAR_API_KEY,
+    SPOONACULAR_BASE_URL,
+)
+from hedging import hedged
+from common import summarize
+from logs import get_logger, lazy
+from telemetry import span
+from upstream import BACKGROUND, QuotaExceededError, UpstreamUnavailable
+
+scan_log = get_logger("scan")
+recipes_log = get_logger("recipes")
+
+_openai_client = None
+
+
+def get_openai_client():
+    """OpenAI SDK client pointed at OpenRouter, constructed on first use."""
+    global _openai_client
+    if _openai_client is None:
+        with startup.phase("openai_client"):
+            from openai import OpenAI
+            _openai_client = OpenAI(base_url=OPENROUTER_BASE_URL, api_key=OPENROUTER_API_KEY)
+    return _openai_client
+
+
+def llm_json_model() -> str:
+    return os.getenv('OPENROUTER_MODEL', 'tngtech/deepseek-r1t2-chimera:free')
+
+
+def llm_json(prompt: str) -> Optional[Dict[str, Any]]:
+    try:
+        with span("llm_json.completion", provider="openrouter"):
+            resp = upstream.call_sync("openrouter", lambda: get_openai_client().chat.completions.create(
+                model=llm_json_model(),
+                messages=[
+                    {"role": "system", "content": "You return only valid minified JSON."},
+                    {"role": "user", "content": prompt},
+                ],
+                temperature=0.5,
+            ))
+        content = resp.choices[0].message.content if resp and resp.choices else None
+        if not content:
+            return None
+        c = content.strip()
+        if c.startswith('```'):
+            c = c.strip('`')
+            c = re.sub(r'^json\n', '', c, flags=re.I)
+        return json.loads(c)
+    except UpstreamUnavailable:
+        raise
+    except Exception:
+        recipes_log.exception('LLM JSON generation failed')
+        return None
+
+
+# --- Upstream availability ---
+def upstream_unavailable(e: UpstreamUnavailable, what: str) -> HTTPException:
+    """429 when a provider's quota is exhausted, 503 while its breaker is open; both carry Retry-After."""
+    headers = {"Retry-After": str(max(1, int(e.retry_after + 0.999)))} if e.retry_after else None
+    status = 429 if isinstance(e, QuotaExceededError) else 503
+    return HTTPException(status_code=status, detail=f"{what} is temporarily unavailable, please retry shortly", headers=headers)
+
+
+def provider_rate_limited(resp: httpx.Response, what: str) -> HTTPException:
+    """Map a provider 429 that survived our retries to a 429 for the client instead of a 500."""
+    retry_after = resp.headers.get("retry-after")
+    return HTTPException(status_code=429, detail=f"{what} is rate limited, please retry shortly",
+                         headers={"Retry-After": retry_after} if retry_after else None)
+
+
+# --- Hedged vision calls ---
+def vision_response_is_valid(resp: httpx.Response) -> bool:
+    """A usable vision answer: 200 with message content that contains a JSON object."""
+    if resp.status_code != 200:
+        return False
+    try:
+        content = resp.json()["choices"][0]["message"]["content"] or ""
+        start, end = content.index("{"), content.rindex("}")
+        json.loads(content[start:end + 1])
+        return True
+    except Exception:
+        return False
+
+
+async def vision_completion(payload: Dict[str, Any], headers: Dict[str, str], stage: str) -> httpx.Response:
+    """POST a chat completion to OPENROUTER_IMAGE_MODELS with hedging (see hedging.py).
+    Hedges only run if an OpenRouter quota token is free right away, so they never queue ahead of scans."""
+    async def attempt(model: str, is_hedge: bool) -> httpx.Response:
+        return await upstream.request(
+            "openrouter", "POST", f"{OPENROUTER_BASE_URL}/chat/completions",
+            stage=stage, timeout=60.0, retries=0, max_wait=0.0 if is_hedge else None,
+            headers=headers, json={**payload, "model": model},
+        )
+
+    resp, model = await hedged(OPENROUTER_IMAGE_MODELS, attempt, vision_response_is_valid, stage)
+    scan_log.info("%s answered by %s", stage, model)
+    return resp
+
+
+# --- Spoonacular helpers ---
+# Enrichment is background work: both helpers use BACKGROUND priority, return None on failure
+# and let UpstreamUnavailable (breaker open / quota shed) through so callers can degrade fast.
+async def spoonacular_search_recipe(dish_name: str, include_ingredients: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+    """Search Spoonacular for a dish by name. Returns top result dict or None."""
+    try:
+        params = {
+            "query": dish_name,
+            "number": 1,
+            "apiKey": SPOONACULAR_API_KEY,
+        }
+        # Optionally bias by available ingredients
+        if include_ingredients:
+            try:
+                params["includeIngredients"] = ",".join(include_ingredients[:5])  # limit to first 5
+            except Exception:
+                pass
+        url = f"{SPOONACULAR_BASE_URL}/recipes/complexSearch"
+        resp = await upstream.request("spoonacular", "GET", url, stage="spoonacular.search", params=params, timeout=10.0, priority=BACKGROUND)
+        resp.raise_for_status()
+        data = resp.json() or {}
+        results = data.get("results") or []
+        if results:
+            return results[0]
+    except UpstreamUnavailable:
+        raise
+    except Exception:
+        recipes_log.exception("[spoonacular] search failed for '%s'", dish_name)
+    return None
+
+
+async def spoonacular_get_recipe_info(recipe_id: int) -> Optional[Dict[str, Any]]:
+    """Get detailed recipe info including image and instructions."""
+    try:
+        params = {"includeNutrition": "false", "apiKey": SPOONACULAR_API_KEY}
+        url = f"{SPOONACULAR_BASE_URL}/recipes/{recipe_id}/information"
+        resp = await upstream.request("spoonacular", "GET", url, stage="spoonacular.information", params=params, timeout=10.0, priority=BACKGROUND)
+        resp.raise_for_status()
+        return resp.json()
+    except UpstreamUnavailable:
+        raise
+    except Exception:
+        recipes_log.exception("[spoonacular] information failed for id=%s", recipe_id)
+        return None
+
+
+# --- CalorieNinjas helper ---
+async def calorieninjas_lookup(query_str: str, item_name: str, priority: int = upstream.INTERACTIVE,
+                               stage: str = "identify_food.nutrition_lookup") -> List[Dict[str, Any]]:
+    """Return CalorieNinjas items for query_str (tagged with queried_item), [] on failure.
+    Raises UpstreamUnavailable while the provider's breaker is open or its quota is exhausted.
+    """
+    scan_log.debug("Querying CalorieNinjas for: '%s'", query_str)
+    try:
+        resp = await upstream.request(
+            "calorieninjas", "GET", f"{CALORIENINJAS_BASE_URL}/v1/nutrition",
+            stage=stage, timeout=15.0, priority=priority,
+            params={"query": query_str}, headers={"X-Api-Key": CALORIENINJAS_API_KEY},
+        )
+    except httpx.TransportError as e:
+        scan_log.warning("CalorieNinjas request failed for '%s': %s", query_str, e)
+        return []
+    scan_log.info("CalorieNinjas status for '%s': %s", query_str, resp.status_code, sample=True)
+    if resp.status_code != 200:
+        scan_log.warning("CalorieNinjas non-200 for '%s': %s", query_str, lazy(summarize, resp.text, max_words=20))
+        return []
+    try:
+        cn_json = resp.json()
+    except ValueError:
+        scan_log.warning("CalorieNinjas returned invalid JSON for '%s': %s", query_str, lazy(summarize, resp.text, max_words=20))
+        return []
+    scan_log.debug("CalorieNinjas preview for '%s': %s", query_str, lazy(summarize, cn_json, max_words=20))
+    found = cn_json.get("items") if isinstance(cn_json, dict) else None
+    found = [f for f in found if isinstance(f, dict)] if isinstance(found, list) else []
+    for f in found:
+        f.setdefault("queried_item", item_name)
+    return found
+
+
+async def google_image_search(query: str) -> Optional[str]:
+    """Return the first Google CSE image link for query, or None. Lets UpstreamUnavailable through."""
+    google_api_key = os.getenv("GOOGLE_API_KEY")
+    google_cx = os.getenv("GOOGLE_CX")
+    if not (google_api_key and google_cx):
+        return None
+    params = {
+        "key": google_api_key,
+        "cx": google_cx,
+        "q": query,
+        "searchType": "image",
+        "num": 1,
+        "imgSize": "medium"
+    }
+    try:
+        resp = await upstream.request("google_cse", "GET", GOOGLE_CSE_URL, stage="google_cse.image_search", params=params, timeout=5.0, retries=0, priority=BACKGROUND)
+        if resp.status_code == 200:
+            data = resp.json()
+            if data.get("items"):
+                return data["items"][0].get("link")
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        recipes_log.warning("[google] image lookup failed for '%s': %s", query, e)
+    return None
@@ -0,0 +1,190 @@
+"""Local recipe store built from Spoonacular enrichment results.
+
+Every recipe Spoonacular returns during enrichment (title, image, steps, extendedIngredients)
+is kept in SQLite, together with the dish name we searched for. Dish names are matched
+through an FTS5 index over recipe titles and those searched names (recipe_names_fts), and
+candidates are ranked by how many of the scanned ingredients they use (recipe_ingredients,
+an ingredient -> recipe inverted index). identify_raw_ingredients and
+suggest_dishes_with_filters look here first and only call Spoonacular on a miss, so
+repeated dishes are enriched locally in a few milliseconds.
+
+RECIPE_STORE=0 disables the store; rows older than RECIPE_STORE_MAX_AGE_DAYS are ignored
+and refreshed from Spoonacular on the next miss.
+"""
+import os
+import re
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+import orjson
+
+import blobs
+import db_reader
+import db_writer
+from canonical import canonical_ingredient
+from logs import get_logger
+from telemetry import register_gauge, span
+
+log = get_logger("recipes")
+
+ENABLED = os.getenv("RECIPE_STORE", "1") == "1"
+MAX_AGE = timedelta(days=float(os.getenv("RECIPE_STORE_MAX_AGE_DAYS", "30")))
+# FTS candidates considered per dish name before ranking by ingredient overlap
+CANDIDATES = 20
+
+_TOKEN_RE = re.compile(r"\w+")
+_NUTRIENTS = {"Calories", "Protein", "Fat", "Carbohydrates", "Sugar", "Fiber"}
+
+_stats = {"hits": 0, "misses": 0, "saved": 0}
+
+register_gauge(
+    "nutriguard_recipe_store",
+    "Local recipe store lookups (hits/misses) and recipes saved since start.",
+    lambda: [({"stat": k}, v) for k, v in _stats.items()],
+)
+
+
+def _match_query(name: str) -> Optional[str]:
+    # Every word of the dish name must match; quoting keeps FTS5 syntax in names inert
+    tokens = _TOKEN_RE.findall(name.lower())[:8]
+    return " ".join(f'"{t}"' for t in tokens) or None
+
+
+def dish_fields(info: Dict[str, Any]) -> Dict[str, Any]:
+    """Image, steps, ingredient lines and macros of a Spoonacular recipe (search result or information)."""
+    steps: List[str] = []
+    for block in (info.get("analyzedInstructions") or [])[:1]:
+        for st in (block or {}).get("steps", []) or []:
+            if st.get("step"):
+                steps.append(str(st["step"]))
+    # Nutrition is only present when requested (includeNutrition=true)
+    nutrition = {
+        n["name"].lower(): n.get("amount")
+        for n in (info.get("nutrition") or {}).get("nutrients", []) or []
+        if n.get("name") in _NUTRIENTS
+    }
+    ingredients = [
+        str(ing.get("original") or ing.get("name"))
+        for ing in info.get("extendedIngredients", []) or []
+        if ing.get("original") or ing.get("name")
+    ]
+    return {
+        "image_url": info.get("image"),
+        "steps": steps or None,
+        "ingredients": ingredients or None,
+        "nutrition": nutrition or None,
+    }
+
+
+def remember(conn: sqlite3.Connection, dish_name: str, info: Dict[str, Any], detailed: bool):
+    """Store a Spoonacular recipe and the dish name that found it, on the caller's
+    connection/transaction. detailed marks /information payloads (steps and ingredients);
+    a search result only updates title and image.
+    """
+    try:
+        recipe_id = int(info["id"])
+    except (KeyError, TypeError, ValueError):
+        return
+    fields = dish_fields(info)
+    now = datetime.utcnow().isoformat(timespec="seconds")
+    if detailed:
+        conn.execute(
+            "INSERT INTO recipes (id, title, image_url, steps, ingredients, nutrition, detailed, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, 1, ?) "
+            "ON CONFLICT(id) DO UPDATE SET title = excluded.title, image_url = COALESCE(excluded.image_url, image_url), "
+            "steps = excluded.steps, ingredients = excluded.ingredients, nutrition = excluded.nutrition, "
+            "detailed = 1, updated_at = excluded.updated_at",
+            (
+                recipe_id,
+                info.get("title"),
+                fields["image_url"],
+                blobs.pack(orjson.dumps(fields["steps"]).decode()) if fields["steps"] else None,
+                blobs.pack(orjson.dumps(fields["ingredients"]).decode()) if fields["ingredients"] else None,
+                blobs.pack(orjson.dumps(fields["nutrition"]).decode()) if fields["nutrition"] else None,
+                now,
+            ),
+        )
+        conn.execute("DELETE FROM recipe_ingredients WHERE recipe_id = ?", (recipe_id,))
+        names = {canonical_ingredient(ing.get("name")) for ing in info.get("extendedIngredients", []) or []}
+        names.discard("")
+        conn.executemany(
+            "INSERT OR IGNORE INTO recipe_ingredients (ingredient, recipe_id) VALUES (?, ?)",
+            [(n, recipe_id) for n in names],
+        )
+    else:
+        conn.execute(
+            "INSERT INTO recipes (id, title, image_url, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET title = COALESCE(excluded.title, title), "
+            "image_url = COALESCE(excluded.image_url, image_url)",
+            (recipe_id, info.get("title"), fields["image_url"], now),
+        )
+    names = {n.strip() for n in (info.get("title"), dish_name) if n and n.strip()}
+    conn.executemany(
+        "INSERT OR IGNORE INTO recipe_names (recipe_id, name) VALUES (?, ?)",
+        [(recipe_id, n) for n in names],
+    )
+    _stats["saved"] += 1
+
+
+def find(conn: sqlite3.Connection, dish_name: str, ingredients: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    """Best fresh local recipe for a dish name, preferring the one that uses most of the given
+    ingredients; None on a miss.
+    """
+    query = _match_query(dish_name)
+    if not query:
+        return None
+    cutoff = (datetime.utcnow() - MAX_AGE).isoformat(timespec="seconds")
+    rows = conn.execute(
+        "SELECT r.id, r.title, r.image_url, r.steps, r.ingredients, r.nutrition, r.detailed, MIN(f.rank) "
+        "FROM recipe_names_fts f JOIN recipe_names n ON n.id = f.rowid JOIN recipes r ON r.id = n.recipe_id "
+        "WHERE recipe_names_fts MATCH ? AND r.updated_at >= ? "
+        "GROUP BY r.id ORDER BY MIN(f.rank) LIMIT ?",
+        (query, cutoff, CANDIDATES),
+    ).fetchall()
+    if not rows:
+        return None
+    wanted = sorted({canonical_ingredient(i) for i in ingredients} - {""})
+    overlap: Dict[int, int] = {}
+    if wanted and len(rows) > 1:
+        marks = ",".join("?" * len(wanted))
+        ids = [r[0] for r in rows]
+        overlap = dict(conn.execute(
+            f"SELECT recipe_id, COUNT(*) FROM recipe_ingredients WHERE ingredient IN ({marks}) "
+            f"AND recipe_id IN ({','.join('?' * len(ids))}) GROUP BY recipe_id",
+            (*wanted, *ids),
+        ).fetchall())
+    # Most shared ingredients first, then detailed rows, then FTS rank (bm25, lower is better)
+    best = min(rows, key=lambda r: (-overlap.get(r[0], 0), -r[6], r[7]))
+    return {
+        "id": best[0],
+        "title": best[1],
+        "image_url": best[2],
+        "steps": orjson.loads(blobs.unpack(best[3])) if best[3] else None,
+        "ingredients": orjson.loads(blobs.unpack(best[4])) if best[4] else None,
+        "nutrition": orjson.loads(blobs.unpack(best[5])) if best[5] else None,
+        "detailed": bool(best[6]),
+    }
+
+
+async def lookup(dish_name: str, ingredients: Iterable[str] = ()) -> Optional[Dict[str, Any]]:
+    if not ENABLED or not dish_name:
+        return None
+    try:
+        with span("recipe_store.lookup"):
+            wanted = list(ingredients or ())
+            found = await db_reader.run(lambda conn: find(conn, dish_name, wanted))
+    except sqlite3.Error:
+        log.exception("[recipe-store] lookup failed for '%s'", dish_name)
+        return None
+    _stats["hits" if found else "misses"] += 1
+    return found
+
+
+async def save(dish_name: str, info: Optional[Dict[str, Any]], detailed: bool):
+    if not ENABLED or not info:
+        return
+    try:
+        await db_writer.run(lambda conn: remember(conn, dish_name, info, detailed))
+    except sqlite3.Error:
+        log.exception("[recipe-store] could not save recipe %s", info.get("id"))
@@ -0,0 +1,26 @@
+"""Row shapes shared by the repository backends."""
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from db import MEAL_CORE_FIELDS, TOTAL_COLUMNS
+
+USER_FIELDS = ("id", "email", "username", "password_hash", "name")
+PROFILE_FIELDS = ("id", "email", "username", "name", "height", "weight", "gender", "age", "is_diabetic")
+TARGET_COLUMNS = ("target_calories", "target_protein", "target_carbs", "target_fat", "target_max_sugar", "target_fiber")
+MEAL_FIELDS = ("id", *MEAL_CORE_FIELDS.values(), "serving_size_g", "extras")
+# Column order of the history rows returned by list_history/search_history
+HISTORY_FIELDS = ("id", "timestamp", "image_url", "scan_type", "result_json")
+# Rows from export_days: the day's metrics columns followed by one meal's MEAL_FIELDS
+# (all None for a day without meals)
+EXPORT_DAY_FIELDS = ("id", "day", *TOTAL_COLUMNS, "goal_achieved")
+
+
+def profile_from_row(row: Sequence[Any]) -> Dict[str, Any]:
+    profile = dict(zip(PROFILE_FIELDS, row))
+    if profile["is_diabetic"] is not None:
+        profile["is_diabetic"] = bool(profile["is_diabetic"])
+    return profile
+
+
+def placeholder_identity(user_id: int, username: Optional[str], email: Optional[str]) -> Tuple[str, str]:
+    """(email, username) for the row created when a valid token has no user row yet."""
+    return email or (f"{username}@local" if username else f"user{user_id}@local"), username or f"user{user_id}"
@@ -0,0 +1,418 @@
+"""PostgreSQL repository (asyncpg), so several app instances can share users, metrics and history.
+
+Queries run on an asyncpg pool (DB_POOL_MIN..DB_POOL_MAX connections per instance). asyncpg
+prepares each statement once per connection and reuses it from its statement cache
+(DB_STATEMENT_CACHE_SIZE; set 0 behind PgBouncer in transaction mode), so the hot queries
+are parsed and planned once. The schema is created on start() under an advisory lock, so
+instances starting together do not race.
+
+Tables and row shapes mirror the SQLite schema in db.py, with two differences: metrics has
+UNIQUE (user_id, day) so a day's row is found or created with one upsert, and history search
+uses a generated tsvector with a GIN index in place of FTS5. Text timestamps use the "C"
+collation so they compare and sort as ISO strings, as they do in SQLite.
+"""
+import re
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import db_writer
+import uploads
+from db import CALORIE_GOAL, CALORIE_GOAL_TOLERANCE, TOTAL_COLUMNS, goal_achieved_for, history_search_terms, meal_totals, split_meal
+from logs import get_logger
+from repository.base import (
+    EXPORT_DAY_FIELDS,
+    HISTORY_FIELDS,
+    MEAL_FIELDS,
+    PROFILE_FIELDS,
+    TARGET_COLUMNS,
+    USER_FIELDS,
+    placeholder_identity,
+    profile_from_row,
+)
+from security import hash_password
+from telemetry import register_gauge
+
+log = get_logger("db")
+
+# pg_advisory_xact_lock key held while creating the schema
+_SCHEMA_LOCK = 0x6E677264
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    email TEXT UNIQUE NOT NULL,
+    username TEXT UNIQUE,
+    password_hash TEXT NOT NULL,
+    name TEXT,
+    height DOUBLE PRECISION,
+    weight DOUBLE PRECISION,
+    gender TEXT,
+    age INTEGER,
+    is_diabetic BOOLEAN,
+    target_calories DOUBLE PRECISION,
+    target_protein DOUBLE PRECISION,
+    target_carbs DOUBLE PRECISION,
+    target_fat DOUBLE PRECISION,
+    target_max_sugar DOUBLE PRECISION,
+    target_fiber DOUBLE PRECISION
+);
+-- user_id is not a foreign key: as in SQLite, a valid token may predate its users row
+CREATE TABLE IF NOT EXISTS metrics (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    day TEXT COLLATE "C" NOT NULL,
+    calories DOUBLE PRECISION NOT NULL DEFAULT 0,
+    protein DOUBLE PRECISION NOT NULL DEFAULT 0,
+    carbs DOUBLE PRECISION NOT NULL DEFAULT 0,
+    fat DOUBLE PRECISION NOT NULL DEFAULT 0,
+    sugar DOUBLE PRECISION NOT NULL DEFAULT 0,
+    fiber DOUBLE PRECISION NOT NULL DEFAULT 0,
+    goal_achieved BOOLEAN NOT NULL DEFAULT FALSE,
+    UNIQUE (user_id, day)
+);
+CREATE TABLE IF NOT EXISTS meals (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    metric_id BIGINT NOT NULL REFERENCES metrics(id),
+    name TEXT,
+    calories DOUBLE PRECISION,
+    protein DOUBLE PRECISION,
+    carbs DOUBLE PRECISION,
+    fat DOUBLE PRECISION,
+    sugar DOUBLE PRECISION,
+    fiber DOUBLE PRECISION,
+    serving_size_g DOUBLE PRECISION,
+    extras TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_meals_metric_id ON meals(metric_id);
+-- terms: names from result_json (db.history_search_terms), indexed through the generated tsvector
+CREATE TABLE IF NOT EXISTS history (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    "timestamp" TEXT COLLATE "C" NOT NULL,
+    image_url TEXT,
+    scan_type TEXT NOT NULL,
+    result_json TEXT,
+    terms TEXT NOT NULL DEFAULT '',
+    search TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', terms)) STORED
+);
+CREATE INDEX IF NOT EXISTS idx_history_user_time ON history(user_id, "timestamp" DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_history_search ON history USING GIN (search);
+"""
+
+_HISTORY_SELECT = ", ".join('"timestamp"' if c == "timestamp" else c for c in HISTORY_FIELDS)
+_INSERT_MEAL = (
+    f"INSERT INTO meals (metric_id, {', '.join(MEAL_FIELDS[1:])}) "
+    f"VALUES ({', '.join(f'${i}' for i in range(1, len(MEAL_FIELDS) + 1))}) RETURNING id"
+)
+# Find or create a day's row in one statement (the no-op update makes RETURNING see existing rows)
+_METRIC_FOR_DAY = (
+    "INSERT INTO metrics (user_id, day) VALUES ($1, $2) "
+    "ON CONFLICT (user_id, day) DO UPDATE SET day = EXCLUDED.day RETURNING id"
+)
+# The same for a batch of days; returns (id, day) per day
+_METRICS_FOR_DAYS = (
+    "INSERT INTO metrics (user_id, day) SELECT $1, unnest($2::text[]) "
+    "ON CONFLICT (user_id, day) DO UPDATE SET day = EXCLUDED.day RETURNING id, day"
+)
+_SET_TOTALS = (
+    f"UPDATE metrics SET {', '.join(f'{c} = ${i}' for i, c in enumerate(TOTAL_COLUMNS, 1))}, "
+    f"goal_achieved = ${len(TOTAL_COLUMNS) + 1} WHERE id = ${len(TOTAL_COLUMNS) + 2}"
+)
+# Same rule as db._apply_totals_delta: $1..$6 are the deltas in TOTAL_COLUMNS order (calories first)
+_APPLY_DELTA = (
+    f"UPDATE metrics SET {', '.join(f'{c} = COALESCE({c}, 0) + ${i}' for i, c in enumerate(TOTAL_COLUMNS, 1))}, "
+    "goal_achieved = COALESCE(calories, 0) + $1 BETWEEN $7 AND $8 "
+    f"WHERE id = $9 RETURNING {', '.join(TOTAL_COLUMNS)}, goal_achieved"
+)
+_EXPORT_DAYS = (
+    f"SELECT {', '.join(f'd.{c}' for c in EXPORT_DAY_FIELDS)}, {', '.join(f'ml.{c}' for c in MEAL_FIELDS)} "
+    "FROM metrics d LEFT JOIN meals ml ON ml.metric_id = d.id "
+    "WHERE d.user_id = $1 AND d.day >= $2 AND d.day <= $3 ORDER BY d.day, d.id, ml.id"
+)
+_EXPORT_HISTORY = (
+    f'SELECT {_HISTORY_SELECT} FROM history WHERE user_id = $1 AND "timestamp" >= $2 AND "timestamp" < $3 '
+    'ORDER BY "timestamp", id'
+)
+_GOAL_RANGE = (CALORIE_GOAL * (1 - CALORIE_GOAL_TOLERANCE), CALORIE_GOAL * (1 + CALORIE_GOAL_TOLERANCE))
+
+_TSQUERY_WORD_RE = re.compile(r"[^\w]")
+
+
+def _float(value: Any) -> Optional[float]:
+    # SQLite stores whatever the client sent; PostgreSQL columns are typed
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _meal_params(metric_id: int, meal: Dict[str, Any]) -> tuple:
+    core, serving_size_g, extras = split_meal(meal)
+    name = core.pop("name")
+    return (metric_id, None if name is None else str(name), *(_float(v) for v in core.values()), _float(serving_size_g), extras)
+
+
+def _tsquery(words: Sequence[str]) -> str:
+    # Every word must match as a prefix ("biry" finds biryani)
+    return " & ".join(f"{_TSQUERY_WORD_RE.sub('', w)}:*" for w in words if _TSQUERY_WORD_RE.sub("", w))
+
+
+class PostgresRepository:
+    """Users, metrics, meals and history in PostgreSQL."""
+
+    name = "postgres"
+
+    def __init__(self, dsn: str, min_size: int = 2, max_size: int = 10, statement_cache_size: int = 100):
+        try:
+            import asyncpg
+        except ImportError as e:
+            raise RuntimeError("DB_BACKEND=postgres requires asyncpg (pip install asyncpg)") from e
+        self._asyncpg = asyncpg
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.statement_cache_size = statement_cache_size
+        self.pool = None
+        register_gauge(
+            "nutriguard_db_pool",
+            "PostgreSQL pool connections: open and idle.",
+            lambda: [({"stat": "size"}, self.pool.get_size() if self.pool else 0),
+                     ({"stat": "idle"}, self.pool.get_idle_size() if self.pool else 0)],
+        )
+
+    async def start(self):
+        self.pool = await self._asyncpg.create_pool(
+            self.dsn, min_size=self.min_size, max_size=self.max_size, statement_cache_size=self.statement_cache_size,
+        )
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", _SCHEMA_LOCK)
+                await conn.execute(_SCHEMA)
+        log.info("PostgreSQL repository ready (pool %s-%s)", self.min_size, self.max_size)
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    # --- users ---
+    async def user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        row = await self.pool.fetchrow(f"SELECT {', '.join(USER_FIELDS)} FROM users WHERE username = $1", username)
+        return dict(row) if row else None
+
+    async def create_user(self, email: str, password: str, username: str, name: Optional[str] = None, height: Optional[float] = None, weight: Optional[float] = None, gender: Optional[str] = None, age: Optional[int] = None, is_diabetic: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+        """Insert a user; None when the username or email is taken."""
+        user_id = await self.pool.fetchval(
+            "INSERT INTO users (email, username, password_hash, name, height, weight, gender, age, is_diabetic) "
+            "VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9) ON CONFLICT DO NOTHING RETURNING id",
+            email, username, hash_password(password), name, _float(height), _float(weight), gender, age, is_diabetic,
+        )
+        if user_id is None:
+            return None
+        return {"id": user_id, "email": email, "username": username, "name": name, "height": height, "weight": weight, "gender": gender, "age": age, "is_diabetic": is_diabetic}
+
+    async def get_profile(self, user_id: int) -> Optional[Dict[str, Any]]:
+        row = await self.pool.fetchrow(f"SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE id = $1", user_id)
+        return profile_from_row(row.values()) if row else None
+
+    async def update_profile(self, user_id: int, fields: Dict[str, Any], username: Optional[str] = None, email: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Set profile columns and return the profile. A token user without a row is matched by
+        username/email, or gets a placeholder row so the profile can be saved.
+        """
+        fields = {c: _float(v) if c in ("height", "weight") else v for c, v in fields.items()}
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                target_id = await conn.fetchval("SELECT id FROM users WHERE id = $1", user_id)
+                if target_id is None and username:
+                    target_id = await conn.fetchval("SELECT id FROM users WHERE username = $1", username)
+                if target_id is None and email:
+                    target_id = await conn.fetchval("SELECT id FROM users WHERE email = $1", email)
+                if target_id is None:
+                    placeholder_email, placeholder_username = placeholder_identity(user_id, username, email)
+                    target_id = await conn.fetchval(
+                        "INSERT INTO users (id, email, username, password_hash, name) VALUES ($1, $2, $3, $4, $5) "
+                        "ON CONFLICT DO NOTHING RETURNING id",
+                        user_id, placeholder_email, placeholder_username, hash_password(""), fields.get("name"),
+                    )
+                    if target_id is not None:
+                        # Explicit ids bypass the identity sequence; move it past them
+                        await conn.execute("SELECT setval(pg_get_serial_sequence('users', 'id'), (SELECT MAX(id) FROM users))")
+                    else:
+                        target_id = await conn.fetchval(
+                            "INSERT INTO users (email, username, password_hash, name) VALUES ($1, $2, $3, $4) RETURNING id",
+                            placeholder_email, placeholder_username, hash_password(""), fields.get("name"),
+                        )
+                if fields:
+                    sets = ", ".join(f"{c} = ${i}" for i, c in enumerate(fields, 2))
+                    await conn.execute(f"UPDATE users SET {sets} WHERE id = $1", target_id, *fields.values())
+                row = await conn.fetchrow(f"SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE id = $1", target_id)
+        return profile_from_row(row.values()) if row else None
+
+    async def get_targets(self, user_id: int) -> Optional[Dict[str, Optional[float]]]:
+        row = await self.pool.fetchrow(f"SELECT {', '.join(TARGET_COLUMNS)} FROM users WHERE id = $1", user_id)
+        return dict(row) if row else None
+
+    async def save_targets(self, user_id: int, targets: Dict[str, Optional[float]]):
+        sets = ", ".join(f"{c} = ${i}" for i, c in enumerate(TARGET_COLUMNS, 2))
+        await self.pool.execute(f"UPDATE users SET {sets} WHERE id = $1", user_id, *(_float(targets.get(c)) for c in TARGET_COLUMNS))
+
+    # --- metrics and meals ---
+    async def save_day(self, user_id: int, day: str, totals: Dict[str, Any], goal_achieved: bool, items: List[Dict[str, Any]]) -> int:
+        """Overwrite a day's totals and append items as meals; returns the metrics row id."""
+        cols = ", ".join(TOTAL_COLUMNS)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                metric_id = await conn.fetchval(
+                    f"INSERT INTO metrics (user_id, day, {cols}, goal_achieved) "
+                    f"VALUES ($1, $2, {', '.join(f'${i}' for i in range(3, len(TOTAL_COLUMNS) + 3))}, ${len(TOTAL_COLUMNS) + 3}) "
+                    f"ON CONFLICT (user_id, day) DO UPDATE SET {', '.join(f'{c} = EXCLUDED.{c}' for c in TOTAL_COLUMNS)}, "
+                    "goal_achieved = EXCLUDED.goal_achieved RETURNING id",
+                    user_id, day, *(_float(totals.get(c, 0)) or 0.0 for c in TOTAL_COLUMNS), bool(goal_achieved),
+                )
+                if items:
+                    await conn.executemany(_INSERT_MEAL, [_meal_params(metric_id, item) for item in items])
+        return metric_id
+
+    async def get_day(self, user_id: int, day: str) -> Optional[Dict[str, Any]]:
+        """{"totals", "items"} for a day (meal extras as stored JSON text), or None."""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(f"SELECT id, {', '.join(TOTAL_COLUMNS)} FROM metrics WHERE user_id = $1 AND day = $2", user_id, day)
+            if not row:
+                return None
+            meals = await conn.fetch(f"SELECT {', '.join(MEAL_FIELDS)} FROM meals WHERE metric_id = $1 ORDER BY id", row["id"])
+        return {"totals": {c: row[c] for c in TOTAL_COLUMNS}, "items": [dict(m) for m in meals]}
+
+    async def goal_statuses(self, user_id: int, days: Sequence[str]) -> Dict[str, bool]:
+        """Goal flag per day that has a metrics row."""
+        rows = await self.pool.fetch(
+            "SELECT day, goal_achieved FROM metrics WHERE user_id = $1 AND day = ANY($2::text[])", user_id, list(days),
+        )
+        return {r["day"]: r["goal_achieved"] for r in rows}
+
+    async def _apply_totals_delta(self, conn, metric_id: int, delta: Sequence[float]) -> Dict[str, Any]:
+        row = await conn.fetchrow(_APPLY_DELTA, *delta, *_GOAL_RANGE, metric_id)
+        return {"totals": {c: row[c] for c in TOTAL_COLUMNS}, "goal_achieved": row["goal_achieved"]}
+
+    async def add_meals(self, user_id: int, day: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Append meals to a day and add them to its totals in one transaction."""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                metric_id = await conn.fetchval(_METRIC_FOR_DAY, user_id, day)
+                insert = await conn.prepare(_INSERT_MEAL)
+                meal_ids = []
+                delta = [0.0] * len(TOTAL_COLUMNS)
+                for item in items:
+                    params = _meal_params(metric_id, item)
+                    meal_ids.append(await insert.fetchval(*params))
+                    # params: metric_id, name, then the totals columns in TOTAL_COLUMNS order
+                    for i, v in enumerate(params[2:2 + len(TOTAL_COLUMNS)]):
+                        delta[i] += v or 0.0
+                result = await self._apply_totals_delta(conn, metric_id, delta)
+        return {"metric_id": metric_id, "meal_ids": meal_ids, **result}
+
+    async def remove_meal(self, user_id: int, meal_id: int) -> Optional[Dict[str, Any]]:
+        """Delete one of the user's meals and subtract it from its day's totals; None if not theirs."""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow(
+                    f"DELETE FROM meals m USING metrics d WHERE m.id = $1 AND d.id = m.metric_id AND d.user_id = $2 "
+                    f"RETURNING m.metric_id, d.day, {', '.join('m.' + c for c in TOTAL_COLUMNS)}",
+                    meal_id, user_id,
+                )
+                if row is None:
+                    return None
+                result = await self._apply_totals_delta(conn, row["metric_id"], [-(row[c] or 0.0) for c in TOTAL_COLUMNS])
+        return {"day": row["day"], **result}
+
+    async def import_days(self, user_id: int, days: List[Dict[str, Any]]) -> int:
+        """Write a batch of imported days in one transaction (same entries as db.import_days);
+        returns meals inserted. Meals are bulk-loaded with COPY.
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(_METRICS_FOR_DAYS, user_id, [entry["day"] for entry in days])
+                metric_ids = {r["day"]: r["id"] for r in rows}
+                replaced = [metric_ids[entry["day"]] for entry in days if entry["replace"]]
+                if replaced:
+                    await conn.execute("DELETE FROM meals WHERE metric_id = ANY($1::bigint[])", replaced)
+                records = [_meal_params(metric_ids[entry["day"]], meal) for entry in days for meal in entry["meals"]]
+                if records:
+                    await conn.copy_records_to_table("meals", records=records, columns=["metric_id", *MEAL_FIELDS[1:]])
+                totals, deltas = [], []
+                for entry in days:
+                    metric_id = metric_ids[entry["day"]]
+                    if entry["totals"] is None:
+                        delta = meal_totals(entry["meals"])
+                        deltas.append((*(delta[c] for c in TOTAL_COLUMNS), *_GOAL_RANGE, metric_id))
+                    else:
+                        values = [_float(entry["totals"][c]) or 0.0 for c in TOTAL_COLUMNS]
+                        totals.append((*values, goal_achieved_for(values[0]), metric_id))
+                if totals:
+                    await conn.executemany(_SET_TOTALS, totals)
+                if deltas:
+                    await conn.executemany(_APPLY_DELTA, deltas)
+        return len(records)
+
+    # --- history ---
+    async def save_history(self, user_id: int, timestamp: str, image_url: Optional[str], scan_type: str, result_json: str) -> int:
+        history_id = await self.pool.fetchval(
+            'INSERT INTO history (user_id, "timestamp", image_url, scan_type, result_json, terms) '
+            "VALUES ($1, $2, $3, $4, $5, $6) RETURNING id",
+            user_id, timestamp, image_url, scan_type, result_json, history_search_terms(result_json),
+        )
+        if image_url:
+            # Uploads are tracked per instance in SQLite; keep the scanned image for as long as the entry exists
+            await db_writer.run(lambda conn: uploads.pin(conn, image_url))
+        return history_id
+
+    async def list_history(self, user_id: int) -> List[tuple]:
+        rows = await self.pool.fetch(
+            f'SELECT {_HISTORY_SELECT} FROM history WHERE user_id = $1 ORDER BY "timestamp" DESC', user_id,
+        )
+        return [tuple(r) for r in rows]
+
+    async def search_history(self, user_id: int, words: Sequence[str], date_from: Optional[str] = None, date_to: Optional[str] = None,
+                             scan_type: Optional[str] = None, limit: int = 20, offset: int = 0) -> List[tuple]:
+        """History rows whose names match every word as a prefix, newest first."""
+        query = _tsquery(words)
+        if not query:
+            return []
+        sql = f"SELECT {_HISTORY_SELECT} FROM history WHERE user_id = $1 AND search @@ to_tsquery('simple', $2)"
+        params: List[Any] = [user_id, query]
+        if date_from:
+            params.append(date_from)
+            sql += f' AND "timestamp" >= ${len(params)}'
+        if date_to:
+            params.append(date_to + "\uffff")  # timestamps are ISO strings: include the whole day
+            sql += f' AND "timestamp" < ${len(params)}'
+        if scan_type:
+            params.append(scan_type)
+            sql += f" AND scan_type = ${len(params)}"
+        params += [limit, offset]
+        sql += f' ORDER BY "timestamp" DESC, id DESC LIMIT ${len(params) - 1} OFFSET ${len(params)}'
+        return [tuple(r) for r in await self.pool.fetch(sql, *params)]
+
+    # --- export ---
+    async def _stream(self, sql: str, args: Sequence[Any], batch: int) -> AsyncIterator[List[tuple]]:
+        # A server-side cursor: rows arrive `batch` at a time, holding one pool connection until done
+        async with self.pool.acquire() as conn:
+            async with conn.transaction(readonly=True):
+                cursor = await conn.cursor(sql, *args)
+                while True:
+                    rows = await cursor.fetch(batch)
+                    if not rows:
+                        return
+                    yield [tuple(r) for r in rows]
+
+    def export_days(self, user_id: int, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                    batch: int = 500) -> AsyncIterator[List[tuple]]:
+        """The user's days in order, each followed by its meals (EXPORT_DAY_FIELDS + MEAL_FIELDS rows),
+        in lists of up to `batch` rows.
+        """
+        return self._stream(_EXPORT_DAYS, (user_id, date_from or "", date_to or "\uffff"), batch)
+
+    def export_history(self, user_id: int, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                       batch: int = 200) -> AsyncIterator[List[tuple]]:
+        """The user's history rows (HISTORY_FIELDS), oldest first, in lists of up to `batch`."""
+        return self._stream(_EXPORT_HISTORY, (user_id, date_from or "", (date_to or "") + "\uffff"), batch)
@@ -0,0 +1,235 @@
+"""SQLite repository: data.db, read on the db_reader pool and written through db_writer."""
+import sqlite3
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import blobs
+import db_reader
+import db_writer
+import uploads
+from db import TOTAL_COLUMNS, add_meals, import_days, index_history, insert_meal, insert_user, metric_id_for_day, remove_meal
+from repository.base import (
+    EXPORT_DAY_FIELDS,
+    HISTORY_FIELDS,
+    MEAL_FIELDS,
+    PROFILE_FIELDS,
+    TARGET_COLUMNS,
+    USER_FIELDS,
+    placeholder_identity,
+    profile_from_row,
+)
+from security import hash_password
+
+_HISTORY_SELECT = ", ".join(f"h.{c}" for c in HISTORY_FIELDS)
+# One page of days (keyset on day, id) with their meals; a day without meals gets one NULL-meal row
+_EXPORT_DAYS = (
+    f"SELECT {', '.join(f'd.{c}' for c in EXPORT_DAY_FIELDS)}, {', '.join(f'ml.{c}' for c in MEAL_FIELDS)} "
+    f"FROM (SELECT {', '.join(EXPORT_DAY_FIELDS)} FROM metrics WHERE user_id = ? AND day >= ? AND day <= ? "
+    "AND (day, id) > (?, ?) ORDER BY day, id LIMIT ?) d "
+    "LEFT JOIN meals ml ON ml.metric_id = d.id ORDER BY d.day, d.id, ml.id"
+)
+_EXPORT_HISTORY = (
+    f"SELECT {', '.join(HISTORY_FIELDS)} FROM history WHERE user_id = ? AND timestamp >= ? AND timestamp < ? "
+    "AND (timestamp, id) > (?, ?) ORDER BY timestamp, id LIMIT ?"
+)
+
+
+def _search_match(user_id: int, words: Sequence[str]) -> str:
+    # Every word must match as a prefix ("biry" finds biryani); quoting keeps FTS5 syntax inert.
+    # The owner column keeps the match inside the user's own rows.
+    terms = " ".join(f'terms : "{w}"*' for w in words)
+    return f'owner : "u{user_id}" AND ({terms})'
+
+
+class SQLiteRepository:
+    """The local data.db. Schema and migrations stay in db.create_db()."""
+
+    name = "sqlite"
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def _fetchall(self, sql: str, params: Sequence[Any] = ()) -> List[tuple]:
+        return await db_reader.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def _fetchone(self, sql: str, params: Sequence[Any] = ()) -> Optional[tuple]:
+        return await db_reader.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def _fetch_history(self, sql: str, params: Sequence[Any]) -> List[tuple]:
+        # result_json (last of HISTORY_FIELDS) may be compressed; inflate on the reader thread
+        return await db_reader.run(lambda conn: [(*r[:-1], blobs.unpack(r[-1])) for r in conn.execute(sql, params)])
+
+    # --- users ---
+    async def user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        row = await self._fetchone(f"SELECT {', '.join(USER_FIELDS)} FROM users WHERE username = ?", (username,))
+        return dict(zip(USER_FIELDS, row)) if row else None
+
+    async def create_user(self, email: str, password: str, username: str, name: Optional[str] = None, height: Optional[float] = None, weight: Optional[float] = None, gender: Optional[str] = None, age: Optional[int] = None, is_diabetic: Optional[bool] = None) -> Optional[Dict[str, Any]]:
+        """Insert a user; None when the username or email is taken."""
+        def write(conn):
+            # check-and-insert in one write so concurrent registrations cannot both pass the check
+            if conn.execute("SELECT id FROM users WHERE username = ? OR email = ?", (username, email)).fetchone():
+                return None
+            return insert_user(conn, email, password, name, username=username, height=height, weight=weight, gender=gender, age=age, is_diabetic=is_diabetic)
+
+        return await db_writer.run(write)
+
+    async def get_profile(self, user_id: int) -> Optional[Dict[str, Any]]:
+        row = await self._fetchone(f"SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE id = ?", (user_id,))
+        return profile_from_row(row) if row else None
+
+    async def update_profile(self, user_id: int, fields: Dict[str, Any], username: Optional[str] = None, email: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Set profile columns and return the profile. A token user without a row is matched by
+        username/email, or gets a placeholder row so the profile can be saved.
+        """
+        def write(conn):
+            cur = conn.cursor()
+            target_id = user_id
+            if not cur.execute("SELECT id FROM users WHERE id = ?", (user_id,)).fetchone():
+                found = None
+                if username:
+                    found = cur.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+                if not found and email:
+                    found = cur.execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone()
+                if found:
+                    target_id = found[0]
+                else:
+                    # password_hash is NOT NULL in schema, so use an empty-hash placeholder
+                    placeholder_email, placeholder_username = placeholder_identity(user_id, username, email)
+                    try:
+                        cur.execute("INSERT INTO users (id, email, username, password_hash, name) VALUES (?, ?, ?, ?, ?)",
+                                    (user_id, placeholder_email, placeholder_username, hash_password(""), fields.get("name")))
+                        target_id = user_id
+                    except sqlite3.IntegrityError:
+                        # As a fallback, insert without specifying id (let sqlite choose) and use that id
+                        cur.execute("INSERT INTO users (email, username, password_hash, name) VALUES (?, ?, ?, ?)",
+                                    (placeholder_email, placeholder_username, hash_password(""), fields.get("name")))
+                        target_id = cur.lastrowid
+            if fields:
+                cur.execute(f"UPDATE users SET {', '.join(f'{c} = ?' for c in fields)} WHERE id = ?", (*fields.values(), target_id))
+            row = cur.execute(f"SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE id = ?", (target_id,)).fetchone()
+            return profile_from_row(row) if row else None
+
+        return await db_writer.run(write)
+
+    async def get_targets(self, user_id: int) -> Optional[Dict[str, Optional[float]]]:
+        row = await self._fetchone(f"SELECT {', '.join(TARGET_COLUMNS)} FROM users WHERE id = ?", (user_id,))
+        return dict(zip(TARGET_COLUMNS, row)) if row else None
+
+    async def save_targets(self, user_id: int, targets: Dict[str, Optional[float]]):
+        await db_writer.run(lambda conn: conn.execute(
+            f"UPDATE users SET {', '.join(f'{c} = ?' for c in TARGET_COLUMNS)} WHERE id = ?",
+            (*(targets.get(c) for c in TARGET_COLUMNS), user_id),
+        ))
+
+    # --- metrics and meals ---
+    async def save_day(self, user_id: int, day: str, totals: Dict[str, Any], goal_achieved: bool, items: List[Dict[str, Any]]) -> int:
+        """Overwrite a day's totals and append items as meals; returns the metrics row id."""
+        def write(conn):
+            metric_id = metric_id_for_day(conn, user_id, day)
+            cur = conn.cursor()
+            cur.execute(
+                f"UPDATE metrics SET {', '.join(f'{c} = ?' for c in TOTAL_COLUMNS)}, goal_achieved = ? WHERE id = ?",
+                (*(totals.get(c, 0) for c in TOTAL_COLUMNS), 1 if goal_achieved else 0, metric_id),
+            )
+            for item in items:
+                insert_meal(cur, metric_id, item)
+            return metric_id
+
+        return await db_writer.run(write)
+
+    async def get_day(self, user_id: int, day: str) -> Optional[Dict[str, Any]]:
+        """{"totals", "items"} for a day (meal extras as stored JSON text), or None."""
+        def read(conn):
+            row = conn.execute(f"SELECT id, {', '.join(TOTAL_COLUMNS)} FROM metrics WHERE user_id = ? AND day = ?", (user_id, day)).fetchone()
+            if not row:
+                return None
+            meals = conn.execute(f"SELECT {', '.join(MEAL_FIELDS)} FROM meals WHERE metric_id = ? ORDER BY id", (row[0],)).fetchall()
+            return {"totals": dict(zip(TOTAL_COLUMNS, row[1:])), "items": [dict(zip(MEAL_FIELDS, m)) for m in meals]}
+
+        return await db_reader.run(read)
+
+    async def goal_statuses(self, user_id: int, days: Sequence[str]) -> Dict[str, bool]:
+        """Goal flag per day that has a metrics row."""
+        rows = await self._fetchall(
+            f"SELECT day, goal_achieved FROM metrics WHERE user_id = ? AND day IN ({','.join('?' * len(days))}) ORDER BY id DESC",
+            (user_id, *days),
+        )
+        return {day: achieved == 1 for day, achieved in rows}
+
+    async def add_meals(self, user_id: int, day: str, items: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return await db_writer.run(lambda conn: add_meals(conn, user_id, day, items))
+
+    async def remove_meal(self, user_id: int, meal_id: int) -> Optional[Dict[str, Any]]:
+        return await db_writer.run(lambda conn: remove_meal(conn, user_id, meal_id))
+
+    async def import_days(self, user_id: int, days: List[Dict[str, Any]]) -> int:
+        """Write a batch of imported days in one transaction (see db.import_days); returns meals inserted."""
+        return await db_writer.run(lambda conn: import_days(conn, user_id, days))
+
+    # --- history ---
+    async def save_history(self, user_id: int, timestamp: str, image_url: Optional[str], scan_type: str, result_json: str) -> int:
+        def write(conn):
+            history_id = conn.execute(
+                "INSERT INTO history (user_id, timestamp, image_url, scan_type, result_json) VALUES (?, ?, ?, ?, ?)",
+                (user_id, timestamp, image_url, scan_type, blobs.pack(result_json)),
+            ).lastrowid
+            index_history(conn, history_id, user_id, result_json)
+            # Keep the scanned image for as long as the history entry exists
+            uploads.pin(conn, image_url)
+            return history_id
+
+        return await db_writer.run(write)
+
+    async def list_history(self, user_id: int) -> List[tuple]:
+        return await self._fetch_history(
+            f"SELECT {', '.join(HISTORY_FIELDS)} FROM history WHERE user_id = ? ORDER BY timestamp DESC",
+            (user_id,),
+        )
+
+    async def search_history(self, user_id: int, words: Sequence[str], date_from: Optional[str] = None, date_to: Optional[str] = None,
+                             scan_type: Optional[str] = None, limit: int = 20, offset: int = 0) -> List[tuple]:
+        """History rows whose names match every word as a prefix, newest first."""
+        sql = f"SELECT {_HISTORY_SELECT} FROM history_fts f JOIN history h ON h.id = f.rowid WHERE history_fts MATCH ?"
+        params: List[Any] = [_search_match(user_id, words)]
+        if date_from:
+            sql += " AND h.timestamp >= ?"
+            params.append(date_from)
+        if date_to:
+            sql += " AND h.timestamp < ?"
+            params.append(date_to + "\uffff")  # timestamps are ISO strings: include the whole day
+        if scan_type:
+            sql += " AND h.scan_type = ?"
+            params.append(scan_type)
+        sql += " ORDER BY h.timestamp DESC, h.id DESC LIMIT ? OFFSET ?"
+        params += [limit, offset]
+        return await self._fetch_history(sql, params)
+
+    # --- export ---
+    # Paged by keyset in short reads rather than one open cursor: a slow download must not
+    # pin a read snapshot (and hold back WAL checkpoints) for its whole length.
+    async def export_days(self, user_id: int, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                          batch: int = 200) -> AsyncIterator[List[tuple]]:
+        """The user's days in order, each followed by its meals (EXPORT_DAY_FIELDS + MEAL_FIELDS rows),
+        in lists of up to `batch` days.
+        """
+        last = ("", 0)
+        while True:
+            rows = await self._fetchall(_EXPORT_DAYS, (user_id, date_from or "", date_to or "\uffff", *last, batch))
+            if not rows:
+                return
+            yield rows
+            last = (rows[-1][1], rows[-1][0])
+
+    async def export_history(self, user_id: int, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                             batch: int = 200) -> AsyncIterator[List[tuple]]:
+        """The user's history rows (HISTORY_FIELDS), oldest first, in lists of up to `batch`."""
+        last = ("", 0)
+        while True:
+            rows = await self._fetch_history(_EXPORT_HISTORY, (user_id, date_from or "", (date_to or "") + "\uffff", *last, batch))
+            if not rows:
+                return
+            yield rows
+            last = (rows[-1][1], rows[-1][0])
@@ -0,0 +1 @@
+"""API routers, one module per area; Main.py includes them."""
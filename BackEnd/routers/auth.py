@@ -0,0 +1,140 @@
+"""Registration, login and user profile endpoints."""
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException
+from pydantic import BaseModel
+
+from config import DEV_ADMIN_BYPASS
+from logs import get_logger
+from repository import repo
+from security import create_token, get_user_from_auth_header, hash_password
+
+auth_log = get_logger("auth")
+users_log = get_logger("users")
+
+router = APIRouter()
+
+
+@router.post('/admin/bypass')
+async def admin_bypass():
+    if not DEV_ADMIN_BYPASS:
+        raise HTTPException(status_code=403, detail='Admin bypass not enabled')
+    # create admin user if missing and return token
+    admin = await repo.user_by_username('admin')
+    if not admin:
+        # create admin with default password 'admin' (dev only)
+        admin = await repo.create_user('admin@local', 'admin', 'admin', name='Administrator') or await repo.user_by_username('admin')
+    user_id = admin['id']
+    email = admin['email']
+    token = create_token(user_id, email, 'admin')
+    return {'token': token, 'user': {'id': user_id, 'username': 'admin', 'email': email}}
+
+
+# --- Auth endpoints ---
+class RegisterRequest(BaseModel):
+    username: str
+    password: str
+    name: Optional[str] = None
+    age: Optional[int] = None
+    height: Optional[float] = None
+    weight: Optional[float] = None
+    gender: Optional[str] = None
+    is_diabetic: Optional[bool] = None
+
+
+@router.post("/register")
+async def register(req: RegisterRequest):
+    auth_log.info("[auth] Register attempt for username=%s", req.username)
+    try:
+        # create a synthetic email to preserve existing schema, store provided profile fields
+        synthetic_email = f"{req.username}@local"
+        user = await repo.create_user(synthetic_email, req.password, req.username, name=req.name, height=req.height, weight=req.weight, gender=req.gender, age=req.age, is_diabetic=req.is_diabetic)
+        if user is None:
+            raise HTTPException(status_code=400, detail="User already exists")
+        token = create_token(user["id"], user.get("email", synthetic_email), req.username)
+        auth_log.info("[auth] Registered user id=%s username=%s", user['id'], req.username)
+        auth_log.debug("[auth] Issued token for user id=%s", user['id'])
+        return {"user": user, "token": token}
+    except HTTPException:
+        raise
+    except Exception as e:
+        auth_log.exception("Error in register: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+class LoginRequest(BaseModel):
+    username: str
+    password: str
+
+
+@router.post("/login")
+async def login(req: LoginRequest):
+    auth_log.info("[auth] Login attempt for username=%s", req.username)
+    try:
+        # lookup by username
+        user = await repo.user_by_username(req.username)
+        if not user:
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        if user["password_hash"] != hash_password(req.password):
+            raise HTTPException(status_code=401, detail="Invalid credentials")
+        token = create_token(user["id"], user.get("email"), user.get("username"))
+        auth_log.info("[auth] Login success for user id=%s username=%s", user['id'], user.get('username'))
+        auth_log.debug("[auth] Issued token for user id=%s", user['id'])
+        return {"user": {"id": user["id"], "email": user["email"], "username": user.get("username"), "name": user.get("name")}, "token": token}
+    except HTTPException:
+        raise
+    except Exception as e:
+        auth_log.exception("Error in login: %s", e)
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+
+class UserProfileRequest(BaseModel):
+    name: Optional[str] = None
+    height: Optional[float] = None
+    weight: Optional[float] = None
+    gender: Optional[str] = None
+    age: Optional[int] = None
+    is_diabetic: Optional[bool] = None
+
+
+@router.get('/user/profile')
+async def get_user_profile(authorization: Optional[str] = Header(None)):
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail='Missing or invalid token')
+    user_id = int(payload.get('user_id'))
+    profile = await repo.get_profile(user_id)
+    # If no DB row exists for this user id, return a default/empty profile
+    # so the client can show editable fields (None -> empty) and allow the user to save.
+    if not profile:
+        users_log.warning("User id=%s not found in DB; returning empty profile based on token payload", user_id)
+        return {
+            'id': user_id,
+            'email': payload.get('email'),
+            'username': payload.get('username'),
+            'name': payload.get('name') or None,
+            'height': None,
+            'weight': None,
+            'gender': None,
+            'age': None,
+            'is_diabetic': None,
+        }
+    return profile
+
+
+@router.post('/user/profile')
+async def update_user_profile(req: UserProfileRequest, authorization: Optional[str] = Header(None)):
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail='Missing or invalid token')
+    user_id = int(payload.get('user_id'))
+    # Only the fields present in the request are updated
+    fields = req.model_dump(exclude_none=True)
+    try:
+        profile = await repo.update_profile(user_id, fields, username=payload.get('username'), email=payload.get('email'))
+    except Exception:
+        users_log.exception('Error updating profile')
+        raise HTTPException(status_code=500, detail='Failed to update profile')
+    if profile is None:
+        profile = {'id': user_id, 'email': payload.get('email'), 'username': payload.get('username'), 'name': req.name or None, 'height': None, 'weight': None, 'gender': None, 'age': None, 'is_diabetic': None}
+    return {'status': 'ok', 'profile': profile}
@@ -0,0 +1,345 @@
+"""Bulk import of days and meals from NDJSON or CSV (logs from another tracker, or our /export).
+
+POST /import streams the request body: rows are parsed and validated as they arrive, grouped
+by day, and written in batches of up to _BATCH_DAYS days, one transaction per batch. Rows:
+    meal  day, name, calories, protein, carbs, fat, sugar, fiber, serving_size_g, extras
+          (CalorieNinjas keys such as protein_g work too; other columns are kept as extras)
+    day   day, calories..fiber: the day's totals, instead of the sum of its meals
+Rows without a "record" field are meals; "scan" records are skipped. Days are upserted: a day
+in the import replaces that day's stored meals and totals, so running an import twice does
+not duplicate anything. Invalid rows are skipped and reported with their row number.
+
+With resolve=true, meals missing macros are looked up on CalorieNinjas at background
+priority, once per food and serving within an import.
+GET /import/progress returns the counters of the user's running (or last) import on this instance.
+"""
+import asyncio
+import codecs
+import csv
+import math
+import re
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import orjson
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from starlette.requests import ClientDisconnect
+
+from canonical import canonical_ingredient
+from config import CALORIENINJAS_API_KEY
+from db import MAX_MEAL_VALUE, MEAL_CORE_FIELDS, TOTAL_COLUMNS, meal_totals
+from logs import get_logger
+from providers import calorieninjas_lookup
+from repository import repo
+from security import get_user_from_auth_header
+from upstream import BACKGROUND, UpstreamUnavailable
+
+import_log = get_logger("import")
+
+router = APIRouter()
+
+_BATCH_DAYS = 500
+_BATCH_MEALS = 5000
+_MAX_MEALS_PER_DAY = 500
+_MAX_LINE = 1 << 20
+_MAX_ERROR_SAMPLES = 20
+_LOOKUP_CONCURRENCY = 4
+
+_DAY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_MACRO_FIELDS = tuple(field for field in MEAL_CORE_FIELDS if field != "name")
+# Export columns that are not meal data
+_NOT_EXTRAS = {"record", "id", "day", "name", "serving_size_g", "extras", "goal_achieved",
+               "timestamp", "scan_type", "image_url", "result_json", *MEAL_CORE_FIELDS.values()}
+
+# user_id -> progress of the user's running or last import (per instance)
+_imports: Dict[int, Dict[str, Any]] = {}
+
+
+class _BadInput(Exception):
+    """The body cannot be read further (not a bad row, which is skipped)."""
+
+
+def _number(value: Any, name: str) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a number")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number")
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"{name} must be a non-negative number")
+    if number > MAX_MEAL_VALUE:
+        raise ValueError(f"{name} must be at most {MAX_MEAL_VALUE:g}")
+    return number
+
+
+def _day(value: Any) -> str:
+    if not isinstance(value, str) or not _DAY_RE.match(value):
+        raise ValueError("day must be YYYY-MM-DD")
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise ValueError("day must be a valid date")
+    return value
+
+
+def _extras(row: Dict[str, Any]) -> Dict[str, Any]:
+    extras = row.get("extras")
+    if isinstance(extras, str) and extras:
+        try:
+            extras = orjson.loads(extras)
+        except orjson.JSONDecodeError:
+            raise ValueError("extras must be a JSON object")
+    if extras in (None, ""):
+        extras = {}
+    if not isinstance(extras, dict):
+        raise ValueError("extras must be a JSON object")
+    for key, value in row.items():
+        if key not in _NOT_EXTRAS and key not in MEAL_CORE_FIELDS and value not in (None, ""):
+            extras[key] = value
+    return extras
+
+
+def _parse_row(row: Dict[str, Any]) -> Tuple[str, str, Dict[str, Any]]:
+    """(record, day, values): a meal item in CalorieNinjas form, or a day's totals. Raises ValueError."""
+    record = row.get("record") or "meal"
+    if record == "scan":
+        return record, "", {}
+    day = _day(row.get("day"))
+    if record == "day":
+        return record, day, {col: _number(row.get(col), col) or 0.0 for col in TOTAL_COLUMNS}
+    if record != "meal":
+        raise ValueError(f"unknown record type {record!r}")
+    name = row.get("name")
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError("name is required")
+    meal = _extras(row)
+    meal["name"] = name.strip()
+    for field, col in MEAL_CORE_FIELDS.items():
+        if field != "name":
+            value = row.get(field)
+            meal[field] = _number(row.get(col) if value in (None, "") else value, col)
+    meal["serving_size_g"] = _number(row.get("serving_size_g"), "serving_size_g")
+    return record, day, meal
+
+
+async def _lines(request: Request) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+    pending = ""
+    async for chunk in request.stream():
+        *lines, pending = (pending + decoder.decode(chunk)).split("\n")
+        if len(pending) > _MAX_LINE:
+            raise _BadInput("line longer than 1 MiB")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def _ndjson_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    number = 0
+    async for line in lines:
+        number += 1
+        if not line.strip():
+            continue
+        try:
+            row = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            row = ValueError("invalid JSON")
+        yield number, row if isinstance(row, (dict, ValueError)) else ValueError("row must be a JSON object")
+
+
+async def _csv_rows(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, Any]]:
+    header = None
+    number = 0
+    record = ""
+    async for line in lines:
+        record = f"{record}\n{line}" if record else line
+        if record.count('"') % 2:
+            # A quoted field continues on the next line
+            if len(record) > _MAX_LINE:
+                raise _BadInput("unterminated quoted field")
+            continue
+        text, record = record, ""
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [h.strip().lower() for h in values]
+            continue
+        number += 1
+        yield number, dict(zip(header, values))
+
+
+class _Import:
+    def __init__(self, user_id: int, resolve: bool):
+        self.user_id = user_id
+        self.resolve = resolve and bool(CALORIENINJAS_API_KEY)
+        self.pending: Dict[str, Dict[str, Any]] = {}  # day -> {"day", "meals", "totals", "replace"}
+        self.pending_meals = 0
+        self.written: Set[str] = set()
+        self.nutrition: Dict[tuple, Optional[Dict[str, float]]] = {}  # (serving, canonical food) -> macros
+        self.lookups_open = True
+        self.started = time.perf_counter()
+        self.progress: Dict[str, Any] = {
+            "state": "running", "rows": 0, "days": 0, "meals": 0, "skipped": 0, "invalid": 0,
+            "resolved": 0, "unresolved": 0, "errors": [],
+        }
+
+    def invalid(self, number: int, error: str):
+        self.progress["invalid"] += 1
+        if len(self.progress["errors"]) < _MAX_ERROR_SAMPLES:
+            self.progress["errors"].append({"row": number, "error": error})
+
+    def finish(self, state: str, error: Optional[str] = None):
+        self.progress["state"] = state
+        self.progress["seconds"] = round(time.perf_counter() - self.started, 3)
+        if error:
+            self.progress["error"] = error
+
+    async def add(self, number: int, row: Any):
+        self.progress["rows"] += 1
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            record, day, values = _parse_row(row)
+        except ValueError as e:
+            self.invalid(number, str(e))
+            return
+        if record == "scan":
+            self.progress["skipped"] += 1
+            return
+        if day not in self.pending:
+            # Batches end on a day boundary, so a day's rows are written together
+            if len(self.pending) >= _BATCH_DAYS or self.pending_meals >= _BATCH_MEALS:
+                await self.flush()
+            self.pending[day] = {"day": day, "meals": [], "totals": None, "replace": day not in self.written}
+        entry = self.pending[day]
+        if record == "day":
+            entry["totals"] = values
+        elif len(entry["meals"]) >= _MAX_MEALS_PER_DAY:
+            self.invalid(number, f"more than {_MAX_MEALS_PER_DAY} meals on {day}")
+        else:
+            entry["meals"].append(values)
+            self.pending_meals += 1
+
+    async def flush(self):
+        if not self.pending:
+            return
+        days = list(self.pending.values())
+        self.pending, self.pending_meals = {}, 0
+        if self.resolve:
+            await self._resolve(days)
+        for entry in days:
+            # A replaced day without a day record gets the sum of its meals
+            if entry["totals"] is None and entry["replace"]:
+                entry["totals"] = meal_totals(entry["meals"])
+        inserted = await repo.import_days(self.user_id, days)
+        self.written.update(entry["day"] for entry in days)
+        self.progress["days"] = len(self.written)
+        self.progress["meals"] += inserted
+        import_log.info("[import] User %s: %s days, %s meals so far", self.user_id, self.progress["days"], self.progress["meals"], sample=True)
+
+    async def _resolve(self, days: List[Dict[str, Any]]):
+        # Meals naming the same food ("Tomatoes", "tamatar"; see canonical.py) share one lookup,
+        # queried with the first name as written
+        by_key: Dict[tuple, List[Dict[str, Any]]] = {}
+        queries: Dict[tuple, str] = {}
+        for entry in days:
+            for meal in entry["meals"]:
+                if any(meal[field] is None for field in _MACRO_FIELDS):
+                    serving = f"{meal['serving_size_g']:g}g " if meal["serving_size_g"] else ""
+                    key = (serving, canonical_ingredient(meal["name"]))
+                    queries.setdefault(key, serving + meal["name"].strip())
+                    by_key.setdefault(key, []).append(meal)
+        limit = asyncio.Semaphore(_LOOKUP_CONCURRENCY)
+
+        async def lookup(key: tuple):
+            async with limit:
+                self.nutrition[key] = await self._lookup(queries[key])
+
+        await asyncio.gather(*(lookup(k) for k in by_key if k not in self.nutrition))
+        for key, meals in by_key.items():
+            found = self.nutrition.get(key)
+            for meal in meals:
+                if not found:
+                    self.progress["unresolved"] += 1
+                    continue
+                for field in _MACRO_FIELDS:
+                    if meal[field] is None:
+                        meal[field] = found[field]
+                self.progress["resolved"] += 1
+
+    async def _lookup(self, query: str) -> Optional[Dict[str, float]]:
+        if not self.lookups_open:
+            return None
+        try:
+            items = await calorieninjas_lookup(query, query, priority=BACKGROUND, stage="import.nutrition_lookup")
+        except UpstreamUnavailable:
+            # Breaker open or quota shed: leave the rest of this import's gaps as they are
+            self.lookups_open = False
+            return None
+        if not items:
+            return None
+        try:
+            return {field: sum(_number(item.get(field), field) or 0.0 for item in items) for field in _MACRO_FIELDS}
+        except (AttributeError, ValueError) as e:
+            # A malformed upstream item leaves the meal unresolved rather than failing the import
+            import_log.warning("[import] Unusable CalorieNinjas result for '%s': %s", query, e)
+            return None
+
+
+@router.post("/import")
+async def import_logs(
+    request: Request,
+    authorization: Optional[str] = Header(None),
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    resolve: bool = False,
+):
+    """Import days and meals from a streamed NDJSON or CSV body; returns the final counters."""
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = int(payload.get("user_id"))
+    if _imports.get(user_id, {}).get("state") == "running":
+        raise HTTPException(status_code=409, detail="An import is already running")
+    job = _Import(user_id, resolve)
+    _imports[user_id] = job.progress
+    rows = _ndjson_rows if fmt == "ndjson" else _csv_rows
+    try:
+        async for number, row in rows(_lines(request)):
+            await job.add(number, row)
+        await job.flush()
+        job.finish("done")
+    except _BadInput as e:
+        job.finish("failed", str(e))
+        raise HTTPException(status_code=400, detail=job.progress)
+    except ClientDisconnect:
+        job.finish("failed", "client disconnected")
+        raise
+    except Exception as e:
+        job.finish("failed", "import failed")
+        import_log.exception("[import] Failed for user %s: %s", user_id, e)
+        raise HTTPException(status_code=500, detail=job.progress)
+    finally:
+        if job.progress["state"] == "running":
+            job.finish("failed", "interrupted")  # cancelled, e.g. the client went away
+    import_log.info("[import] User %s imported %s days, %s meals from %s rows (%s invalid) in %.2fs", user_id,
+                    job.progress["days"], job.progress["meals"], job.progress["rows"], job.progress["invalid"], job.progress["seconds"])
+    return job.progress
+
+
+@router.get("/import/progress")
+async def import_progress(authorization: Optional[str] = Header(None)):
+    """Counters of the user's running or last import on this instance."""
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    progress = _imports.get(int(payload.get("user_id")))
+    if progress is None:
+        raise HTTPException(status_code=404, detail="No import")
+    return progress
@@ -0,0 +1,136 @@
+"""Streaming export of a user's days, meals and scans as NDJSON or CSV.
+
+Records are read in batches from the repository (keyset pages on SQLite, a server-side cursor
+on PostgreSQL) and written to the response as they arrive, so memory use stays flat however
+many years the export covers. Every record has a "record" type:
+    day   id, day, calories..fiber (the day's totals), goal_achieved
+    meal  id, day, name, calories..fiber, serving_size_g, extras
+    scan  id, day, timestamp, scan_type, image_url, result_json
+Days come first in date order, each followed by its meals, then scans oldest first. In CSV
+every row has all columns (EXPORT_FIELDS); extras and result_json are JSON text.
+"""
+import csv
+import io
+import re
+import time
+import zlib
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import orjson
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from common import json_fragment
+from db import TOTAL_COLUMNS
+from logs import get_logger
+from repository import repo
+from repository.base import EXPORT_DAY_FIELDS, HISTORY_FIELDS, MEAL_FIELDS
+from security import get_user_from_auth_header
+
+export_log = get_logger("export")
+
+router = APIRouter()
+
+EXPORT_FIELDS = ("record", "day", "id", "name", *TOTAL_COLUMNS, "serving_size_g", "goal_achieved", "extras",
+                 "timestamp", "scan_type", "image_url", "result_json")
+# Fields stored as JSON text: embedded as objects in NDJSON, kept as text in CSV
+_JSON_FIELDS = ("extras", "result_json")
+
+_DAY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+async def _records(user_id: int, date_from: Optional[str], date_to: Optional[str]) -> AsyncIterator[List[Dict[str, Any]]]:
+    width = len(EXPORT_DAY_FIELDS)
+    last_day_id = None
+    async for rows in repo.export_days(user_id, date_from, date_to):
+        batch = []
+        for row in rows:
+            day = dict(zip(EXPORT_DAY_FIELDS, row[:width]))
+            # A day's meals can span two batches; emit its day record once
+            if day["id"] != last_day_id:
+                last_day_id = day["id"]
+                batch.append({"record": "day", **day, "goal_achieved": bool(day["goal_achieved"])})
+            meal = dict(zip(MEAL_FIELDS, row[width:]))
+            if meal["id"] is not None:
+                batch.append({"record": "meal", "day": day["day"], **meal})
+        yield batch
+    async for rows in repo.export_history(user_id, date_from, date_to):
+        batch = []
+        for row in rows:
+            scan = dict(zip(HISTORY_FIELDS, row))
+            batch.append({"record": "scan", "day": scan["timestamp"][:10], **scan})
+        yield batch
+
+
+async def _ndjson(records: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    async for batch in records:
+        for record in batch:
+            for field in _JSON_FIELDS:
+                if field in record:
+                    record[field] = json_fragment(record[field])
+        yield b"".join(orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE) for record in batch)
+
+
+async def _csv(records: AsyncIterator[List[Dict[str, Any]]]) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_FIELDS, restval="")
+    writer.writeheader()
+    yield buf.getvalue().encode()
+    async for batch in records:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(batch)
+        yield buf.getvalue().encode()
+
+
+async def _gzip(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    async for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+async def _logged(chunks: AsyncIterator[bytes], user_id: int, fmt: str) -> AsyncIterator[bytes]:
+    started = time.perf_counter()
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    export_log.info("[export] %s export for user %s: %s bytes in %.2fs", fmt, user_id, size, time.perf_counter() - started)
+
+
+@router.get("/export")
+async def export_data(
+    authorization: Optional[str] = Header(None),
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    date_from: Optional[str] = Query(None, alias="from", description="YYYY-MM-DD, inclusive"),
+    date_to: Optional[str] = Query(None, alias="to", description="YYYY-MM-DD, inclusive"),
+    gzip: bool = False,
+):
+    """Stream all of the user's days, meals and scans in [from, to] as NDJSON or CSV.
+    With gzip=true the body is a .gz file of the same content.
+    """
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = int(payload.get("user_id"))
+    for day in (date_from, date_to):
+        if day is not None and not _DAY_RE.match(day):
+            raise HTTPException(status_code=400, detail="from/to must be YYYY-MM-DD")
+
+    encode = _ndjson if fmt == "ndjson" else _csv
+    body = encode(_records(user_id, date_from, date_to))
+    filename = f"nutriguard-export.{fmt}"
+    media_type = _MEDIA_TYPES[fmt]
+    if gzip:
+        body = _gzip(body)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        _logged(body, user_id, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
@@ -0,0 +1,136 @@
+"""Scan history endpoints."""
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+import variants
+from common import compact_json, json_fragment
+from logs import get_logger
+from repository import repo
+from security import get_user_from_auth_header
+
+history_log = get_logger("history")
+
+router = APIRouter()
+
+
+# --- History endpoints ---
+class SaveHistoryRequest(BaseModel):
+    image_url: Optional[str] = None
+    scan_type: str  # "food" or "raw_ingredients"
+    result_json: str  # JSON string of the scan result
+
+
+class HistoryItem(BaseModel):
+    id: int
+    timestamp: str
+    image_url: Optional[str] = None
+    scan_type: str
+    result_json: Any = None  # stored JSON (an object, or a string for legacy non-JSON rows), embedded as is
+    variants: Optional[Dict[str, str]] = None  # e.g. {"thumb": url, "medium": url} for our own images
+
+
+class HistoryResponse(BaseModel):
+    history: List[HistoryItem]
+
+
+class HistorySearchResponse(BaseModel):
+    history: List[HistoryItem]
+    next_offset: Optional[int] = None  # pass as offset for the next page; absent on the last page
+
+
+_SEARCH_TOKEN_RE = re.compile(r"\w+")
+_DAY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def _history_item(row) -> Dict[str, Any]:
+    return {
+        "id": row[0],
+        "timestamp": row[1],
+        "image_url": row[2],
+        "scan_type": row[3],
+        "result_json": json_fragment(row[4]),
+        "variants": variants.variant_urls(row[2]),
+    }
+
+
+@router.post("/history/save")
+async def save_history(req: SaveHistoryRequest, authorization: Optional[str] = Header(None)):
+    """Save a scan session to history for the authenticated user."""
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = int(payload.get("user_id"))
+    # Store compact, validated JSON so reads can embed it as a raw fragment
+    try:
+        result_json = compact_json(req.result_json)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="result_json must be a valid JSON string")
+    timestamp = datetime.utcnow().isoformat()
+
+    try:
+        # Also indexes the entry for search and pins its image upload
+        history_id = await repo.save_history(user_id, timestamp, req.image_url, req.scan_type, result_json)
+    except Exception as e:
+        history_log.exception("[history] Failed to save: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to save history")
+    history_log.info("[history] Saved scan for user %s, id=%s, type=%s", user_id, history_id, req.scan_type)
+    return {"status": "ok", "history_id": history_id}
+
+
+@router.get("/history", response_model=HistoryResponse)
+async def get_history(authorization: Optional[str] = Header(None)):
+    """Fetch all scan history for the authenticated user, newest first.
+    result_json is returned as a JSON object (stored text embedded verbatim), not an escaped string.
+    """
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = int(payload.get("user_id"))
+    try:
+        history_items = [_history_item(row) for row in await repo.list_history(user_id)]
+        history_log.info("[history] Fetched %s items for user %s", len(history_items), user_id)
+        # Bypass response_model validation: fragments are serialized by orjson as-is
+        return ORJSONResponse({"history": history_items})
+    except Exception as e:
+        history_log.exception("[history] Failed to fetch: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to fetch history")
+
+
+@router.get("/history/search", response_model=HistorySearchResponse)
+async def search_history(
+    q: str,
+    authorization: Optional[str] = Header(None),
+    date_from: Optional[str] = Query(None, alias="from", description="YYYY-MM-DD, inclusive"),
+    date_to: Optional[str] = Query(None, alias="to", description="YYYY-MM-DD, inclusive"),
+    scan_type: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
+    """Search the user's history by food, ingredient and dish names, newest first.
+    Words match as prefixes and all must match; items have the same shape as /history.
+    """
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = int(payload.get("user_id"))
+    words = _SEARCH_TOKEN_RE.findall(q.lower())[:8]
+    if not words:
+        raise HTTPException(status_code=400, detail="q must contain at least one word")
+    for day in (date_from, date_to):
+        if day is not None and not _DAY_RE.match(day):
+            raise HTTPException(status_code=400, detail="from/to must be YYYY-MM-DD")
+    try:
+        # One extra row tells whether there is a next page
+        rows = await repo.search_history(user_id, words, date_from, date_to, scan_type, limit + 1, offset)
+        history_items = [_history_item(row) for row in rows]
+    except Exception as e:
+        history_log.exception("[history] Search failed: %s", e)
+        raise HTTPException(status_code=500, detail="Failed to search history")
+    next_offset = offset + limit if len(history_items) > limit else None
+    history_log.info("[history] Search for user %s matched %s items", user_id, len(history_items[:limit]), sample=True)
+    return ORJSONResponse({"history": history_items[:limit], "next_offset": next_offset})
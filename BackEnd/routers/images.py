@@ -0,0 +1,120 @@
+"""Serves stored images under /public/<key> with cache validators.
+
+Content-addressed keys (ab/cd/<sha256>.jpg) never change, so they get the hash as a
+strong ETag and a year-long immutable Cache-Control; legacy flat names get an ETag
+from size/mtime and a short max-age. Conditional GETs answer 304 and Range requests
+206 (both backends). Missing image variants are rendered on first request (variants.py).
+Third-party dish images are served from the caching proxy under /dish-image/<digest>.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import re
+import stat
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+import dish_images
+import storage
+import variants
+
+router = APIRouter()
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+LEGACY_CACHE = "public, max-age=3600"
+# Proxied dish images: keyed by source URL, refetched only after eviction
+DISH_IMAGE_CACHE = "public, max-age=604800"
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _etag(key: str, fallback: str) -> str:
+    return f'"{storage.immutable_tag(key) or fallback}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    return "*" in tags or any(t.removeprefix("W/") == etag for t in tags)
+
+
+def _byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single "bytes=a-b" range into inclusive offsets; None means the whole body.
+    Raises 416 for ranges that cannot be satisfied. Multi-range requests get the whole body.
+    """
+    m = _RANGE_RE.match((header or "").strip())
+    if not m or m.group(1) == m.group(2) == "":
+        return None
+    first, last = m.group(1), m.group(2)
+    if first == "":
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(size - 1, int(last)) if last else size - 1
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+async def _stat(path) -> Optional[os.stat_result]:
+    try:
+        st = await asyncio.to_thread(os.stat, path)
+    except OSError:
+        return None
+    return st if stat.S_ISREG(st.st_mode) else None
+
+
+@router.api_route("/public/{key:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def get_stored_image(key: str, request: Request):
+    if not storage.safe_key(key):
+        raise HTTPException(status_code=404, detail="Not found")
+    headers = {"Cache-Control": IMMUTABLE_CACHE if storage.immutable_tag(key) else LEGACY_CACHE}
+    media_type = storage.content_type_for(key)
+
+    path = storage.backend.local_path(key)
+    if path is not None:
+        st = await _stat(path)
+        if st is None and await variants.ensure(key) is not None:
+            st = await _stat(path)  # variant rendered on first request
+        if st is None:
+            raise HTTPException(status_code=404, detail="Not found")
+        headers["ETag"] = _etag(key, f"{st.st_size:x}-{st.st_mtime_ns:x}")
+        if _not_modified(request, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+        # FileResponse streams from disk and handles Range/If-Range itself
+        return FileResponse(path, media_type=media_type, headers=headers, stat_result=st)
+
+    data = await storage.read(key)
+    if data is None:
+        data = await variants.ensure(key)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    headers["ETag"] = _etag(key, hashlib.sha256(data).hexdigest())
+    headers["Accept-Ranges"] = "bytes"
+    if _not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    if_range = request.headers.get("if-range")
+    span = None if if_range and if_range != headers["ETag"] else _byte_range(request.headers.get("range"), len(data))
+    if span is None:
+        return Response(data, media_type=media_type, headers=headers)
+    start, end = span
+    headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+    return Response(data[start:end + 1], status_code=206, media_type=media_type, headers=headers)
+
+
+@router.get("/dish-image/{digest}", include_in_schema=False)
+async def get_dish_image(digest: str, u: str, request: Request):
+    """Third-party dish image through the caching proxy (see dish_images.py)."""
+    headers = {"Cache-Control": DISH_IMAGE_CACHE, "ETag": f'"{digest}"'}
+    if _not_modified(request, headers["ETag"]) and hmac.compare_digest(dish_images.sign(u), digest):
+        return Response(status_code=304, headers=headers)
+    result = await dish_images.get(digest, u)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Image unavailable")
+    data, media_type = result
+    return Response(data, media_type=media_type, headers=headers)
@@ -0,0 +1,318 @@
+"""Daily nutrition metrics, macro plans and saved targets."""
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
+
+from common import NutritionTotals, json_fragment
+from db import MAX_MEAL_VALUE, TOTAL_COLUMNS, goal_achieved_for
+from logs import get_logger
+from repository import repo
+from security import get_user_from_auth_header
+
+users_log = get_logger("users")
+
+router = APIRouter()
+
+
+class SaveMetricsRequest(BaseModel):
+    day: str  # YYYY-MM-DD
+    nutrition: Dict[str, Any]  # { items: [...], totals: {...} }
+
+
+
+@router.post("/metrics/save")
+async def save_metrics(req: SaveMetricsRequest, authorization: Optional[str] = Header(None)):
+    # Expect Authorization header 'Bearer <token>'
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = int(payload.get("user_id"))
+    # ensure day format
+    try:
+        datetime.strptime(req.day, "%Y-%m-%d")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid day format. Use YYYY-MM-DD")
+
+    # Calculate goal achievement (simple: within 20% of CALORIE_GOAL, can be customized)
+    totals = req.nutrition.get("totals", {})
+    calories = totals.get("calories", 0)
+    goal_achieved = 1 if goal_achieved_for(calories) else 0
+
+    # save totals to metrics table and add items as meals, in one transaction
+    metric_id = await repo.save_day(user_id, req.day, {col: totals.get(col, 0) for col in TOTAL_COLUMNS}, bool(goal_achieved), req.nutrition.get("items", []))
+    return {"status": "ok", "metric_id": metric_id, "goal_achieved": bool(goal_achieved)}
+
+
+class MealItem(BaseModel):
+    id: Optional[int] = None
+    name: Optional[str] = None
+    calories: Optional[float] = None
+    protein: Optional[float] = None
+    carbs: Optional[float] = None
+    fat: Optional[float] = None
+    sugar: Optional[float] = None
+    fiber: Optional[float] = None
+    serving_size_g: Optional[float] = None
+    extras: Optional[Dict[str, Any]] = None  # non-core CalorieNinjas fields
+
+
+class CalorieNinjasItem(BaseModel):
+    """A CalorieNinjas-style item; other fields (sodium_mg, queried_item, ...) are kept as extras."""
+    model_config = ConfigDict(extra="allow", allow_inf_nan=False)
+
+    name: Optional[str] = None
+    calories: Optional[float] = Field(None, ge=0, le=MAX_MEAL_VALUE)
+    protein_g: Optional[float] = Field(None, ge=0, le=MAX_MEAL_VALUE)
+    carbohydrates_total_g: Optional[float] = Field(None, ge=0, le=MAX_MEAL_VALUE)
+    fat_total_g: Optional[float] = Field(None, ge=0, le=MAX_MEAL_VALUE)
+    sugar_g: Optional[float] = Field(None, ge=0, le=MAX_MEAL_VALUE)
+    fiber_g: Optional[float] = Field(None, ge=0, le=MAX_MEAL_VALUE)
+    serving_size_g: Optional[float] = Field(None, ge=0, le=MAX_MEAL_VALUE)
+
+
+class AddMealsRequest(BaseModel):
+    day: str  # YYYY-MM-DD
+    items: List[CalorieNinjasItem]  # usually one
+
+
+class MealChangeResponse(BaseModel):
+    day: str
+    meal_ids: Optional[List[int]] = None
+    totals: NutritionTotals
+    goal_achieved: bool
+
+
+@router.post("/metrics/meals", response_model=MealChangeResponse, response_model_exclude_none=True)
+async def add_meals_to_day(req: AddMealsRequest, authorization: Optional[str] = Header(None)):
+    """Add meals to a day without resending it: totals and the goal are updated server-side
+    in the same transaction, and the new totals are returned.
+    """
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = int(payload.get("user_id"))
+    try:
+        datetime.strptime(req.day, "%Y-%m-%d")
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid day format. Use YYYY-MM-DD")
+    if not req.items:
+        raise HTTPException(status_code=400, detail="items must not be empty")
+    items = [item.model_dump(exclude_none=True) for item in req.items]
+    result = await repo.add_meals(user_id, req.day, items)
+    return {"day": req.day, "meal_ids": result["meal_ids"], "totals": result["totals"], "goal_achieved": result["goal_achieved"]}
+
+
+@router.delete("/metrics/meals/{meal_id}", response_model=MealChangeResponse, response_model_exclude_none=True)
+async def delete_meal(meal_id: int, authorization: Optional[str] = Header(None)):
+    """Remove one meal; its values are subtracted from the day's totals and the goal re-evaluated."""
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = int(payload.get("user_id"))
+    result = await repo.remove_meal(user_id, meal_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Meal not found")
+    return {"day": result["day"], "totals": result["totals"], "goal_achieved": result["goal_achieved"]}
+
+
+class MetricsDayResponse(BaseModel):
+    day: str
+    items: List[MealItem]
+    totals: NutritionTotals
+
+
+@router.get("/metrics/get", response_model=MetricsDayResponse)
+async def get_metrics(day: str, authorization: Optional[str] = Header(None)):
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = int(payload.get("user_id"))
+    found = await repo.get_day(user_id, day)
+    if not found:
+        return {"day": day, "items": [], "totals": {"calories": 0, "protein": 0, "carbs": 0, "fat": 0, "sugar": 0, "fiber": 0}}
+    # extras are stored as compact JSON; embed them as fragments rather than re-parsing
+    meals = [{**m, "extras": json_fragment(m["extras"])} for m in found["items"]]
+    return ORJSONResponse({"day": day, "items": meals, "totals": found["totals"]})
+
+
+@router.get("/metrics/weekly-status")
+async def get_weekly_status(authorization: Optional[str] = Header(None)):
+    """Get goal achievement status for the current week (Mon-Sun)"""
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail="Missing or invalid token")
+    user_id = int(payload.get("user_id"))
+    
+    # Get current week's Monday
+    today = date.today()
+    days_since_monday = today.weekday()  # 0=Monday, 6=Sunday
+    monday = today - timedelta(days=days_since_monday)
+    
+    # Generate all 7 days of the week
+    week_days = [(monday + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
+    
+    # One query for the whole week
+    goals = await repo.goal_statuses(user_id, week_days)
+    
+    weekly_status = []
+    for day_str in week_days:
+        if day_str not in goals:
+            status = "no_data"  # Grey dot
+        elif goals[day_str]:
+            status = "achieved"  # Green dot
+        else:
+            status = "not_achieved"  # Red dot
+        
+        # Get day name (Mon, Tue, etc.)
+        day_obj = datetime.strptime(day_str, "%Y-%m-%d")
+        day_name = day_obj.strftime("%a")  # Mon, Tue, Wed, etc.
+        
+        weekly_status.append({
+            "day": day_str,
+            "day_name": day_name,
+            "status": status
+        })
+    
+    return {"weekly_status": weekly_status}
+
+
+# --- Macro plan calculation (BMR/TDEE/macros) ---
+class MacroPlanInput(BaseModel):
+    weightKg: float
+    heightCm: float
+    age: int
+    sex: str  # 'male' | 'female'
+    goal: str  # 'lose' | 'maintain' | 'gain'
+    activityLevel: str  # 'sedentary' | 'light' | 'moderate' | 'very_active' | 'athlete'
+    isDiabetic: Optional[bool] = False  # diabetic mode changes carb/sugar/fiber targets
+
+
+def _activity_factor(level: str) -> float:
+    m = {
+        'sedentary': 1.2,
+        'light': 1.375,
+        'moderate': 1.55,
+        'very_active': 1.725,
+        'athlete': 1.9,
+    }
+    return m.get((level or '').lower(), 1.2)
+
+
+def _calc_bmr(weight: float, height: float, age: int, sex: str) -> float:
+    is_male = (sex or '').lower().startswith('m')
+    if is_male:
+        return 10 * weight + 6.25 * height - 5 * age + 5
+    return 10 * weight + 6.25 * height - 5 * age - 161
+
+
+def _adjust_for_goal(tdee: float, goal: str) -> float:
+    g = (goal or 'maintain').lower()
+    if g == 'lose':
+        return max(0, tdee - 400)
+    if g == 'gain':
+        return tdee + 250
+    return tdee
+
+
+@router.post('/macro-plan')
+def macro_plan(input: MacroPlanInput):
+    try:
+        # Basic input sanity
+        if input.weightKg <= 0 or input.heightCm <= 0 or input.age <= 0:
+            raise HTTPException(status_code=400, detail='Invalid anthropometrics')
+
+        bmr = _calc_bmr(input.weightKg, input.heightCm, input.age, input.sex)
+        tdee = bmr * _activity_factor(input.activityLevel)
+        target_cal = _adjust_for_goal(tdee, input.goal)
+
+        # Protein: same for diabetic and non-diabetic (1.6 g/kg)
+        protein_grams = max(0.0, input.weightKg * 1.6)
+        protein_cals = protein_grams * 4
+
+        diabetic = bool(input.isDiabetic)
+
+        if diabetic:
+            # Diabetic mode: carbs capped at 40% of calories, fat ~30%, sugar max 20g, fiber 30g
+            carb_cals = target_cal * 0.40
+            carb_grams = carb_cals / 4
+            fat_cals = target_cal * 0.30
+            fat_grams = fat_cals / 9
+            max_sugar_grams = 20  # strict limit for diabetics
+            fiber_target = 30
+        else:
+            # Normal mode: fat 25%, carbs = remainder, sugar <10% of cals
+            fat_cals = target_cal * 0.25
+            fat_grams = fat_cals / 9
+            carb_cals = max(0.0, target_cal - (protein_cals + fat_cals))
+            carb_grams = carb_cals / 4
+            max_sugar_grams = (target_cal * 0.10) / 4
+            fiber_target = 25
+
+        return {
+            'calories': int(round(target_cal)),
+            'protein': int(round(protein_grams)),
+            'fat': int(round(fat_grams)),
+            'carbs': int(round(carb_grams)),
+            'maxSugar': int(round(max_sugar_grams)),
+            'fiberTarget': fiber_target,
+            'bmr': int(round(bmr)),
+            'tdee': int(round(tdee)),
+            'isDiabetic': diabetic,
+        }
+    except HTTPException:
+        raise
+    except Exception:
+        users_log.exception('Failed to compute macro plan')
+        raise HTTPException(status_code=500, detail='Macro plan failed')
+
+
+class UserTargetsPayload(BaseModel):
+    calories: float
+    protein: float
+    carbs: float
+    fat: float
+    maxSugar: float
+    fiberTarget: Optional[float] = 25.0
+
+
+@router.get('/user/targets')
+async def get_user_targets(authorization: Optional[str] = Header(None)):
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail='Missing or invalid token')
+    user_id = int(payload.get('user_id'))
+    targets = await repo.get_targets(user_id)
+    if not targets or all(targets[col] is None for col in ('target_calories', 'target_protein', 'target_carbs', 'target_fat', 'target_max_sugar')):
+        raise HTTPException(status_code=404, detail='Targets not set')
+    return {
+        'calories': targets['target_calories'],
+        'protein': targets['target_protein'],
+        'carbs': targets['target_carbs'],
+        'fat': targets['target_fat'],
+        'maxSugar': targets['target_max_sugar'],
+        'fiberTarget': targets['target_fiber'] if targets['target_fiber'] is not None else 25.0,
+    }
+
+
+@router.post('/user/targets')
+async def save_user_targets(req: UserTargetsPayload, authorization: Optional[str] = Header(None)):
+    payload = get_user_from_auth_header(authorization)
+    if not payload:
+        raise HTTPException(status_code=401, detail='Missing or invalid token')
+    user_id = int(payload.get('user_id'))
+    try:
+        await repo.save_targets(user_id, {
+            'target_calories': req.calories,
+            'target_protein': req.protein,
+            'target_carbs': req.carbs,
+            'target_fat': req.fat,
+            'target_max_sugar': req.maxSugar,
+            'target_fiber': req.fiberTarget,
+        })
+    except Exception:
+        users_log.exception('Failed saving user targets')
+        raise HTTPException(status_code=500, detail='Failed to save targets')
+    return {'status': 'ok'}
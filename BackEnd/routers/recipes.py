@@ -0,0 +1,526 @@
+"""Raw-ingredient scans and dish suggestions."""
+import asyncio
+import base64
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+from fastapi import APIRouter, Header, HTTPException, Request
+from pydantic import BaseModel
+
+import dish_images
+import recipe_store
+import storage
+import suggestion_cache
+from common import ImageRequest, public_base_url, summarize
+from config import OPENROUTER_API_KEY, OPENROUTER_IMAGE_MODELS, SPOONACULAR_API_KEY
+from logs import get_logger, lazy
+from providers import (
+    google_image_search,
+    llm_json,
+    llm_json_model,
+    provider_rate_limited,
+    spoonacular_get_recipe_info,
+    spoonacular_search_recipe,
+    upstream_unavailable,
+    vision_completion,
+)
+from repository import repo
+from security import get_user_from_auth_header
+from telemetry import observe, span
+from upstream import UpstreamUnavailable
+
+users_log = get_logger("users")
+scan_log = get_logger("scan")
+recipes_log = get_logger("recipes")
+
+router = APIRouter()
+
+
+# --- Filter defaults and prompt helpers ---
+def _age_bucket(age: Optional[int]) -> Optional[str]:
+    try:
+        if age is None:
+            return None
+        a = int(age)
+        if a < 13:
+            return 'child'
+        if a >= 60:
+            return 'old'
+        return 'adult'
+    except Exception:
+        return None
+
+
+async def _get_user_profile_row(user_id: int) -> Optional[Dict[str, Any]]:
+    try:
+        return await repo.get_profile(user_id)
+    except Exception:
+        users_log.exception('Failed to fetch user profile for defaults')
+        return None
+
+
+async def _default_filters_for_user(payload: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    defaults = {
+        'times': ['breakfast', 'lunch', 'snacks', 'dinner'],
+        'age': 'adult',
+        'diabetic': False,
+    }
+    try:
+        if not payload:
+            return defaults
+        user_id = int(payload.get('user_id'))
+        profile = await _get_user_profile_row(user_id)
+        if not profile:
+            return defaults
+        age_b = _age_bucket(profile.get('age')) or defaults['age']
+        diabetic = defaults['diabetic'] if profile.get('is_diabetic') is None else bool(profile.get('is_diabetic'))
+        return {
+            'times': defaults['times'],
+            'age': age_b,
+            'diabetic': diabetic,
+        }
+    except Exception:
+        users_log.exception('Failed to derive default filters; using base defaults')
+        return defaults
+
+
+def _merge_filters(base: Dict[str, Any], override: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not override:
+        return base
+    out = dict(base)
+    for k in ('times', 'age', 'diabetic'):
+        if k in override and override[k] not in (None, [], ''):
+            out[k] = override[k]
+    # sanitize times
+    if out.get('times'):
+        allowed = {'breakfast', 'lunch', 'snacks', 'dinner'}
+        out['times'] = [t for t in out['times'] if t in allowed]
+        if not out['times']:
+            out['times'] = base['times']
+    return out
+
+
+# Bump when _build_recipe_prompt changes meaningfully, so cached suggestions are not reused
+RECIPE_PROMPT_VERSION = 1
+
+
+def _build_recipe_prompt(ingredients: List[str], filters: Dict[str, Any]) -> str:
+    times = ", ".join(filters.get('times', [])) or 'any mealtime'
+    age = filters.get('age') or 'adult'
+    diabetic = bool(filters.get('diabetic'))
+    dietary_line = 'Prioritize low glycemic, diabetic-friendly choices.' if diabetic else 'Avoid excessive sugar and saturated fats.'
+    return (
+        "You are a culinary assistant focused on Indian cuisine. Based on these raw ingredients: "
+        f"{', '.join(ingredients)}. "
+        "Suggest 5 Indian dishes (traditional or popular regional) that can realistically be made with them. Prefer Indian preparations and naming; adapt non-Indian ideas into Indian-style where needed. "
+        f"Target mealtimes: {times}. Target age group: {age}. {dietary_line} "
+        "For each dish provide: name, a concise description, and a short justification referencing the ingredients and filters. "
+        "Return JSON with shape {\"dishes\": [{\"name\": str, \"description\": str, \"justification\": str}]}. No prose, JSON only."
+    )
+
+
+# --- Parsing helpers for robust outputs ---
+# Matches lines like "1. Pasta: tomato-based sauce" or "Pasta - with tomato"
+DISH_LINE_RE = re.compile(r'^\s*(?:\d+[.)]\s*)?(?P<name>[^:•\-]+?)(?:\s*[:\-]\s*(?P<desc>.+))?\s*$')
+
+def _normalize_dishes(dishes_raw: Any) -> List[Dict[str, Any]]:
+    """Normalize various dish formats (list of dicts/strings or a single string) into a list of dicts.
+    Each dict contains at least { name, description?, image_url? }.
+    """
+    out: List[Dict[str, Any]] = []
+    try:
+        if isinstance(dishes_raw, list):
+            for it in dishes_raw:
+                if isinstance(it, dict):
+                    out.append({
+                        "name": str(it.get("name", "")).strip(),
+                        "description": str(it.get("description", "")).strip() if it.get("description") is not None else None,
+                        "image_url": it.get("image_url"),
+                    })
+                elif isinstance(it, str):
+                    m = DISH_LINE_RE.match(it)
+                    if m:
+                        out.append({
+                            "name": (m.group("name") or "").strip(),
+                            "description": (m.group("desc") or "").strip() or None,
+                            "image_url": None,
+                        })
+        elif isinstance(dishes_raw, str):
+            for line in dishes_raw.splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                # skip obvious section headers
+                if line.lower().startswith(("ingredients", "suggested dishes")):
+                    continue
+                m = DISH_LINE_RE.match(line)
+                if m and m.group("name"):
+                    out.append({
+                        "name": (m.group("name") or "").strip(),
+                        "description": (m.group("desc") or "").strip() or None,
+                        "image_url": None,
+                    })
+    except Exception:
+        recipes_log.exception("Failed to normalize dishes")
+    # filter empties
+    return [d for d in out if d.get("name")]
+
+
+class Dish(BaseModel):
+    name: str
+    description: Optional[str] = None
+    justification: Optional[str] = None
+    image_url: Optional[str] = None
+    steps: Optional[List[str]] = None
+    ingredients: Optional[List[str]] = None
+    nutrition: Optional[Dict[str, Any]] = None
+
+
+class AppliedFilters(BaseModel):
+    times: List[str]
+    age: str
+    diabetic: bool
+
+
+class IdentifyRawIngredientsResponse(BaseModel):
+    ingredients: List[str]
+    dishes: List[Dish]
+    filters_applied: AppliedFilters
+    raw_response: Optional[str] = None
+    degraded: Optional[List[str]] = None
+
+
+@router.post("/identify-raw-ingredients", response_model=IdentifyRawIngredientsResponse, response_model_exclude_none=True)
+async def identify_raw_ingredients(request: ImageRequest, http_request: Request, authorization: Optional[str] = Header(None), include_raw: bool = False):
+    """Endpoint for analyzing raw ingredients and suggesting dishes that can be made.
+    The model's raw text is only echoed back when include_raw=true (debugging aid).
+    """
+    scan_log.info("[identify-raw-ingredients] Received request for URL: %s", request.image_url)
+    
+    # Fetch user profile for personalized recommendations
+    user_profile = None
+    payload = get_user_from_auth_header(authorization)
+    if payload:
+        user_id = int(payload.get("user_id"))
+        try:
+            profile = await repo.get_profile(user_id)
+            if profile:
+                user_profile = {
+                    'age': profile['age'],
+                    'gender': profile['gender'],
+                    'is_diabetic': bool(profile['is_diabetic'])
+                }
+                scan_log.info("[identify-raw-ingredients] User profile: %s", user_profile)
+        except Exception as e:
+            scan_log.exception("[identify-raw-ingredients] Failed to fetch user profile: %s", e)
+    
+    try:
+        # Load image bytes (same logic as identify-food)
+        image_url = request.image_url
+        key = storage.key_for_url(image_url)
+        image_bytes = None
+        if key:
+            with span("identify_raw_ingredients.image_load"):
+                image_bytes = await storage.read(key)
+
+        if image_bytes is not None:
+            scan_log.info("[identify-raw-ingredients] Loaded stored image %s", key)
+        elif storage.is_own_url(image_url):
+            raise HTTPException(status_code=404, detail="Image not found (expired or never uploaded)")
+        else:
+            scan_log.info("[identify-raw-ingredients] Fetching remote URL: %s", image_url)
+            try:
+                with span("identify_raw_ingredients.image_fetch", provider="remote_image"):
+                    async with httpx.AsyncClient(timeout=10.0) as client_http:
+                        resp = await client_http.get(image_url)
+                        resp.raise_for_status()
+                        image_bytes = resp.content
+                scan_log.info("[identify-raw-ingredients] Fetched remote image, size=%s", len(image_bytes))
+            except Exception as e:
+                scan_log.exception("[identify-raw-ingredients] Failed to fetch image: %s", e)
+                raise HTTPException(status_code=400, detail=f"Could not retrieve image: {e}")
+
+        if not image_bytes:
+            raise HTTPException(status_code=400, detail="No image bytes available")
+
+        # Convert to base64 data URI
+        with span("identify_raw_ingredients.base64_encode"):
+            b64 = base64.b64encode(image_bytes).decode("utf-8")
+        data_uri = f"data:image/jpeg;base64,{b64}"
+
+        # Build personalized context for AI
+        from datetime import datetime
+        current_time = datetime.utcnow()
+        time_of_day = "breakfast" if current_time.hour < 11 else "lunch" if current_time.hour < 15 else "dinner"
+        
+        context_parts = [f"Current time context: {time_of_day}"]
+        if user_profile:
+            if user_profile.get('age'):
+                context_parts.append(f"User age: {user_profile['age']}")
+            if user_profile.get('gender'):
+                context_parts.append(f"User gender: {user_profile['gender']}")
+            if user_profile.get('is_diabetic'):
+                context_parts.append("User is diabetic (prioritize low-sugar, low-carb recipes)")
+        
+        context_str = ". ".join(context_parts) + "."
+        
+        # Call AI with specialized prompt including default filters - requesting JSON with ranking and justification
+        scan_log.info("[identify-raw-ingredients] Calling AI model with personalized raw ingredients prompt")
+        # Compute defaults for filters (times, age bucket, diabetic)
+        defaults = await _default_filters_for_user(payload)
+        filters_line = f"Default filters to respect: times={defaults['times']}, age={defaults['age']}, diabetic={defaults['diabetic']}."
+        ai_prompt = f"{context_str}\n{filters_line}\n\nAnalyze this image and identify all raw ingredients visible. Then suggest 3-5 delicious INDIAN dishes that can be made using these ingredients, prioritizing traditional and popular Indian cuisine recipes that match the filters. Order them by relevance to the user's needs (considering time of day and health requirements). For EACH dish, explain WHY it's a good choice for this user and why it's ranked in this position. Respond ONLY with valid JSON in this exact format:\n{{\n  \"ingredients\": [\"ingredient1\", \"ingredient2\", ...],\n  \"dishes\": [\n    {{\"name\": \"Dish Name\", \"description\": \"Brief description of the dish\", \"justification\": \"Explain why this dish is ranked here for this user - consider their health needs (diabetic status), time of day appropriateness, and nutritional benefits over other options\"}},\n    ...\n  ]\n}}\n\nIf no ingredients are visible, return: {{\"ingredients\": [], \"dishes\": []}}"
+        
+        # For raw-ingredients use the configurable OpenRouter image model via direct HTTP
+        image_model = OPENROUTER_IMAGE_MODELS[0]  # vision_completion sets the model per attempt
+        scan_log.info("Calling image models for raw-ingredients: %s", OPENROUTER_IMAGE_MODELS)
+        
+        openrouter_payload = {
+            "model": image_model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": f"You are an image recognition assistant. Respond ONLY with valid JSON and NOTHING else. Required JSON shape: {{\"ingredients\": [\"ing1\", ...], \"dishes\": [{{\"name\": \"Dish\", \"description\": \"...\", \"justification\": \"...\"}}]}}. If no ingredients, return {{\"ingredients\": [], \"dishes\": []}}. {ai_prompt}"
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": data_uri
+                            }
+                        }
+                    ]
+                }
+            ]
+        }
+        
+        openrouter_headers = {
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "HTTP-Referer": "http://localhost:8081",
+            "X-Title": "NutriGuard",
+            "Content-Type": "application/json"
+        }
+        
+        try:
+            ai_response = await vision_completion(openrouter_payload, openrouter_headers, stage="identify_raw_ingredients.vision")
+        except UpstreamUnavailable as e:
+            raise upstream_unavailable(e, "Ingredient recognition")
+
+        scan_log.info("[identify-raw-ingredients] OpenRouter response status: %s", ai_response.status_code)
+        
+        if ai_response.status_code == 429:
+            raise provider_rate_limited(ai_response, "Ingredient recognition")
+        if ai_response.status_code != 200:
+            scan_log.error("[identify-raw-ingredients] OpenRouter API error: %s", ai_response.text)
+            raise HTTPException(status_code=500, detail=f"AI error: {ai_response.text}")
+        
+        ai_result = ai_response.json()
+        scan_log.debug("[identify-raw-ingredients] AI completion preview: %s", lazy(summarize, ai_result))
+        
+        if "error" in ai_result:
+            scan_log.error("[identify-raw-ingredients] AI error: %s", ai_result['error'])
+            raise HTTPException(status_code=500, detail=f"AI error: {ai_result['error']}")
+        
+        if not ai_result.get("choices") or not ai_result["choices"][0].get("message"):
+            scan_log.error("[identify-raw-ingredients] AI response missing choices/message")
+            raise HTTPException(status_code=500, detail="Invalid response from AI model")
+        
+        response_text = ai_result["choices"][0]["message"].get("content", "")
+        if not response_text:
+            response_text = '{"ingredients": [], "dishes": []}'
+
+        scan_log.debug("[identify-raw-ingredients] Raw response: %s", lazy(summarize, response_text, max_words=50))
+
+        # Parse JSON response
+        parse_started = time.perf_counter()
+        parse_failed = False
+        try:
+            # Try to extract JSON if wrapped in markdown code blocks
+            raw_text = response_text
+            if "```json" in raw_text:
+                raw_text = raw_text.split("```json")[1].split("```")[0].strip()
+            elif "```" in raw_text:
+                raw_text = raw_text.split("```")[1].split("```")[0].strip()
+
+            parsed_data = json.loads(raw_text)
+            ingredients = parsed_data.get("ingredients", []) or []
+            if not isinstance(ingredients, list):
+                ingredients = []
+            dishes = _normalize_dishes(parsed_data.get("dishes"))
+        except Exception as e:
+            scan_log.exception("[identify-raw-ingredients] Failed to parse JSON: %s", e)
+            parse_failed = True
+            # Fallback: try to extract info from the free-form text
+            ingredients = []
+            dishes = _normalize_dishes(response_text)
+            for line in response_text.split('\n'):
+                s = line.strip()
+                if s.startswith(('-','•')):
+                    ingredients.append(s[1:].strip())
+        observe("identify_raw_ingredients.parse", time.perf_counter() - parse_started, error=parse_failed)
+        # Ingredients are returned as the model named them; the recipe store matches on canonical names
+        ingredient_names = [i for i in ingredients if isinstance(i, str) and i.strip()]
+
+        # Enrich each dish with Spoonacular information (image + steps). Fall back to Google image if needed.
+        # Providers that are unavailable (breaker open, quota shed) are skipped for the remaining dishes and reported as degraded.
+        degraded: List[str] = []
+
+        for dish in dishes:
+            dish_name = dish.get("name", "").strip()
+            dish.setdefault("image_url", None)
+
+            # Local recipe store first; Spoonacular only for dishes it has not seen (or only seen in a search)
+            local = await recipe_store.lookup(dish_name, ingredient_names)
+            fields = local if local and local["detailed"] else None
+            if fields is None and dish_name and SPOONACULAR_API_KEY and "spoonacular" not in degraded:
+                try:
+                    recipe_id = local["id"] if local else None
+                    if recipe_id is None:
+                        result = await spoonacular_search_recipe(dish_name, include_ingredients=ingredient_names or None)
+                        recipe_id = int(result["id"]) if result and result.get("id") else None
+                    info = await spoonacular_get_recipe_info(recipe_id) if recipe_id is not None else None
+                except UpstreamUnavailable:
+                    degraded.append("spoonacular")
+                    info = None
+                if info:
+                    await recipe_store.save(dish_name, info, detailed=True)
+                    try:
+                        fields = recipe_store.dish_fields(info)
+                    except Exception:
+                        scan_log.exception("[spoonacular] failed extracting steps/ingredients for dish '%s'", dish_name)
+            if fields is None and local:
+                fields = {"image_url": local["image_url"]}
+            if fields:
+                # Prefer the recipe image; steps, ingredient lines and macros when present
+                dish["image_url"] = fields.get("image_url") or dish.get("image_url")
+                for field in ("steps", "ingredients", "nutrition"):
+                    if fields.get(field):
+                        dish[field] = fields[field]
+
+            # Fallback to Google image search if still no image
+            if not dish.get("image_url") and dish_name and "google_cse" not in degraded:
+                try:
+                    dish["image_url"] = await google_image_search(f"{dish_name} food dish")
+                    if dish["image_url"]:
+                        scan_log.info("[identify-raw-ingredients] Found image for %s via Google", dish_name)
+                except UpstreamUnavailable:
+                    degraded.append("google_cse")
+
+        # Serve third-party dish images through our caching proxy
+        base = public_base_url(http_request)
+        for dish in dishes:
+            dish["image_url"] = dish_images.proxy_url(dish.get("image_url"), base)
+
+        # Log image status for debugging
+        dishes_with_images = sum(1 for d in dishes if d.get('image_url'))
+        scan_log.info("[identify-raw-ingredients] Returning %s ingredients and %s dishes (%s with images)", len(ingredients), len(dishes), dishes_with_images)
+
+        return {
+            "ingredients": [str(i) for i in ingredients if i],
+            "dishes": dishes,
+            "raw_response": response_text if include_raw else None,
+            "filters_applied": defaults,
+            "degraded": degraded or None,
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        scan_log.exception("[identify-raw-ingredients] Error: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class SuggestDishesWithFiltersRequest(BaseModel):
+    ingredients: List[str]
+    times: Optional[List[str]] = None
+    age: Optional[str] = None  # child | adult | old
+    diabetic: Optional[bool] = None
+
+
+class SuggestDishesResponse(BaseModel):
+    dishes: List[Dish]
+    filters_applied: AppliedFilters
+    degraded: Optional[List[str]] = None
+
+
+@router.post('/suggest-dishes-with-filters', response_model=SuggestDishesResponse, response_model_exclude_none=True)
+async def suggest_dishes_with_filters(req: SuggestDishesWithFiltersRequest, http_request: Request, authorization: Optional[str] = Header(None)):
+    """Re-generate dish suggestions for provided ingredients with explicit filters.
+    Merges provided filters over defaults derived from the authenticated profile when available.
+    """
+    try:
+        payload = get_user_from_auth_header(authorization)
+        defaults = await _default_filters_for_user(payload)
+        merged = _merge_filters(defaults, {
+            'times': req.times,
+            'age': req.age,
+            'diabetic': req.diabetic,
+        })
+
+        ingredients = [s for s in (req.ingredients or []) if isinstance(s, str) and s.strip()]
+        if not ingredients:
+            raise HTTPException(status_code=400, detail='ingredients must be a non-empty list of strings')
+
+        # Same ingredients (by canonical name, see canonical.py) + filters in any order reuse an earlier
+        # answer instead of a new model call
+        cache_key = suggestion_cache.cache_key(ingredients, merged, llm_json_model(), RECIPE_PROMPT_VERSION)
+        data = await suggestion_cache.get(cache_key)
+        if data is None:
+            prompt = _build_recipe_prompt(ingredients, merged)
+            try:
+                # The OpenAI SDK blocks; run it on a worker thread so other requests keep moving
+                data = await asyncio.to_thread(llm_json, prompt) or {}
+            except UpstreamUnavailable as e:
+                raise upstream_unavailable(e, 'Dish suggestions')
+            if data.get('dishes'):
+                await suggestion_cache.put(cache_key, data)
+        dishes = data.get('dishes') or []
+
+        # Enrich with images via Spoonacular and Google fallback, skipping unavailable providers
+        degraded: List[str] = []
+        enriched = []
+        for d in dishes[:5]:
+            name = (d.get('name') or '').strip()
+            if not name:
+                continue
+            image_url = None
+            
+            # Local recipe store first, then Spoonacular
+            local = await recipe_store.lookup(name, ingredients)
+            if local and local.get('image_url'):
+                image_url = local['image_url']
+            try:
+                if not image_url and SPOONACULAR_API_KEY and "spoonacular" not in degraded:
+                    info = await spoonacular_search_recipe(name, include_ingredients=ingredients)
+                    if info and info.get('image'):
+                        image_url = info['image']
+                        await recipe_store.save(name, info, detailed=False)
+            except UpstreamUnavailable:
+                degraded.append("spoonacular")
+            except Exception:
+                recipes_log.debug("Spoonacular lookup failed for '%s'", name)
+            
+            # Fallback to Google image search if no image yet
+            if not image_url and "google_cse" not in degraded:
+                try:
+                    image_url = await google_image_search(f"{name} indian food dish")
+                    if image_url:
+                        recipes_log.info("[filters] Found image for %s via Google", name)
+                except UpstreamUnavailable:
+                    degraded.append("google_cse")
+            
+            d['image_url'] = dish_images.proxy_url(image_url, public_base_url(http_request))
+            enriched.append(d)
+
+        return {"dishes": enriched, "filters_applied": merged, "degraded": degraded or None}
+    except HTTPException:
+        raise
+    except Exception:
+        recipes_log.exception('/suggest-dishes-with-filters failed')
+        raise HTTPException(status_code=500, detail='Failed to suggest dishes with filters')
+
@@ -0,0 +1,421 @@
+"""Image upload and food recognition endpoints."""
+import asyncio
+import base64
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+from fastapi import APIRouter, BackgroundTasks, File, Header, HTTPException, Request, UploadFile
+from pydantic import BaseModel
+
+from canonical import canonical_ingredient
+from common import ImageRequest, ImageURLRequest, NutritionTotals, public_base_url, summarize
+from config import CALORIENINJAS_API_KEY, OPENROUTER_API_KEY, OPENROUTER_IMAGE_MODEL, OPENROUTER_IMAGE_MODELS
+import db_writer
+import storage
+import upstream
+import uploads
+import variants
+from logs import get_logger, lazy
+from providers import (
+    calorieninjas_lookup,
+    get_openai_client,
+    provider_rate_limited,
+    upstream_unavailable,
+    vision_completion,
+)
+from security import get_user_from_auth_header
+from telemetry import observe, span
+from upstream import UpstreamUnavailable
+
+upload_log = get_logger("upload")
+scan_log = get_logger("scan")
+
+router = APIRouter()
+
+
+def _build_public_image_url(key: str, request: Request) -> str:
+    """Build a public URL for a stored image that is reachable by the client.
+    Use the storage backend's own URL when it has one (e.g. a bucket/CDN base), else /public/<key>
+    under public_base_url (configured PUBLIC_URL unless it points to localhost).
+    """
+    direct = storage.backend.public_url(key)
+    if direct:
+        return direct
+    url = f"{public_base_url(request)}/public/{key}"
+    upload_log.debug("[_build_public_image_url] %s", url)
+    return url
+
+
+async def _store_upload(file: UploadFile, authorization: Optional[str], scan_type: Optional[str],
+                        background: BackgroundTasks):
+    """Store an uploaded image (content-addressed, off the event loop), record it for expiry and
+    queue its thumbnail/preview variants to render after the response. Returns (key, size).
+    """
+    key, size, sha256 = await storage.put(file.file, file.filename)
+    # Uploads do not require auth; record the owner when a token is sent
+    payload = get_user_from_auth_header(authorization)
+    user_id = int(payload["user_id"]) if payload and payload.get("user_id") is not None else None
+    await db_writer.run(lambda conn: uploads.record_upload(conn, key, size, sha256, user_id, scan_type))
+    background.add_task(variants.generate_all, key)
+    return key, size
+
+
+@router.post("/upload")
+async def upload_image(request: Request, background: BackgroundTasks, file: UploadFile = File(...),
+                       scan_type: Optional[str] = None,
+                       authorization: Optional[str] = Header(None)):
+    upload_log.info("Received upload request")
+    try:
+        upload_log.info("Upload filename: %s, content_type: %s", file.filename, file.content_type)
+        key, size = await _store_upload(file, authorization, scan_type, background)
+        upload_log.info("Stored uploaded file as %s (%s), size=%s bytes", key, storage.backend.name, size)
+        
+        # Return a public URL reachable by the client (avoid localhost when on device)
+        image_url = _build_public_image_url(key, request)
+        upload_log.info("Image saved and URL returned: %s", image_url)
+        return {"image_url": image_url, "variants": variants.variant_urls(image_url)}
+    except Exception as e:
+        upload_log.exception("Error uploading image: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class NutritionResult(BaseModel):
+    items: List[Dict[str, Any]]
+    totals: NutritionTotals
+
+
+class IdentifyFoodResponse(BaseModel):
+    item_name: str
+    nutrition: Optional[NutritionResult] = None
+    degraded: Optional[List[str]] = None  # providers skipped (breaker open or quota exhausted)
+
+
+@router.post("/identify-food", response_model=IdentifyFoodResponse)
+async def identify_food(request: ImageRequest):
+    scan_log.info("Received request to /identify-food with URL: %s", request.image_url)
+    try:
+        scan_log.info("Preparing image bytes for AI (will send base64 data URI)")
+
+        # Try to load the image from our storage first (uploads are served under /public/<key>)
+        image_url = request.image_url
+        key = storage.key_for_url(image_url)
+        image_bytes = None
+        if key:
+            with span("identify_food.image_load"):
+                image_bytes = await storage.read(key)
+
+        if image_bytes is not None:
+            scan_log.info("Loaded stored image %s, size: %s bytes", key, len(image_bytes))
+        elif storage.is_own_url(image_url):
+            # Our own image URL: fetching it over HTTP would only come back here
+            raise HTTPException(status_code=404, detail="Image not found (expired or never uploaded)")
+        else:
+            scan_log.info("Image not in storage, attempting HTTP fetch of %s", image_url)
+            # Try fetching remotely (in case the URL is truly public)
+            try:
+                with span("identify_food.image_fetch", provider="remote_image"):
+                    async with httpx.AsyncClient(timeout=10.0) as client_http:
+                        resp = await client_http.get(image_url)
+                        resp.raise_for_status()
+                        image_bytes = resp.content
+                scan_log.info("Fetched image via HTTP, size=%s bytes, content-type=%s", len(image_bytes), resp.headers.get('content-type'))
+            except Exception as e:
+                scan_log.exception("Failed to fetch image from URL: %s", e)
+                raise HTTPException(status_code=400, detail=f"Could not retrieve image from URL: {e}")
+
+        # Convert to base64 data URI
+        with span("identify_food.base64_encode"):
+            b64 = base64.b64encode(image_bytes).decode("utf-8")
+        scan_log.debug("Base64 length: %s chars", len(b64))
+        data_uri = f"data:image/jpeg;base64,{b64}"
+
+        scan_log.info("Sending data URI to AI model (base64)")
+        # Use OpenRouter API directly with Gemma vision model
+        image_model = OPENROUTER_IMAGE_MODELS[0]  # vision_completion sets the model per attempt
+        scan_log.info("Starting AI call (image) using models=%s", OPENROUTER_IMAGE_MODELS)
+        
+        openrouter_payload = {
+            "model": image_model,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": "You are an image recognition assistant. Identify the food items on the plate (try to be specific) and estimate serving sizes. Return EXACTLY valid JSON with the shape: {\"items\": [{\"name\": \"<name>\", \"serving\": \"<brief serving>\"}]}. Do not include background objects or commentary. If no food is visible return {\"items\": []}."
+                        },
+                        {
+                            "type": "image_url",
+                            "image_url": {
+                                "url": data_uri
+                            }
+                        }
+                    ]
+                }
+            ]
+        }
+        
+        openrouter_headers = {
+            "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+            "HTTP-Referer": "http://localhost:8081",
+            "X-Title": "NutriGuard",
+            "Content-Type": "application/json"
+        }
+        
+        try:
+            ai_response = await vision_completion(openrouter_payload, openrouter_headers, stage="identify_food.vision")
+        except UpstreamUnavailable as e:
+            raise upstream_unavailable(e, "Food recognition")
+
+        scan_log.info("OpenRouter response status: %s", ai_response.status_code)
+        
+        if ai_response.status_code == 429:
+            raise provider_rate_limited(ai_response, "Food recognition")
+        if ai_response.status_code != 200:
+            scan_log.error("OpenRouter API error: %s", ai_response.text)
+            raise HTTPException(status_code=500, detail=f"AI error: {ai_response.text}")
+        
+        ai_result = ai_response.json()
+        scan_log.debug("AI completion preview: %s", lazy(summarize, ai_result))
+        
+        if "error" in ai_result:
+            scan_log.error("AI returned error: %s", ai_result['error'])
+            raise HTTPException(status_code=500, detail=f"AI error: {ai_result['error']}")
+        
+        if not ai_result.get("choices") or not ai_result["choices"][0].get("message"):
+            scan_log.error("AI response missing choices/message")
+            raise HTTPException(status_code=500, detail="Invalid response from AI model")
+        
+        response_text = ai_result["choices"][0]["message"].get("content", "")
+        if not response_text:
+            response_text = "Unable to identify item in the image."
+
+        scan_log.debug("Final response text: %s", lazy(summarize, response_text))
+
+        # Call CalorieNinjas API for nutrition data
+        nutrition_data = None
+        degraded: List[str] = []  # providers skipped (breaker open or quota exhausted)
+        identified_food_names = []  # Store parsed food names for display
+        if CALORIENINJAS_API_KEY and response_text != "Unable to identify item in the image.":
+            try:
+                # Prefer strict JSON output from the model: try to parse it
+                scan_log.debug("Raw AI identification text: %s", lazy(summarize, response_text, max_words=40))
+                parsed_items = None
+                parse_started = time.perf_counter()
+                try:
+                    raw_text = response_text
+                    if "```json" in raw_text:
+                        raw_text = raw_text.split("```json")[1].split("```")[0].strip()
+                    elif "```" in raw_text:
+                        raw_text = raw_text.split("```")[1].split("```")[0].strip()
+                    parsed = json.loads(raw_text)
+                    # Expect top-level {"items": [...]}
+                    if isinstance(parsed, dict) and isinstance(parsed.get("items"), list):
+                        parsed_items = parsed.get("items")
+                except Exception:
+                    parsed_items = None
+                observe("identify_food.parse", time.perf_counter() - parse_started, error=parsed_items is None)
+
+                items_to_query = []
+                if parsed_items:
+                    for it in parsed_items:
+                        try:
+                            name = (it.get("name") if isinstance(it, dict) else str(it)).strip()
+                            serving = (it.get("serving") if isinstance(it, dict) else "").strip()
+                        except Exception:
+                            name = str(it).strip()
+                            serving = ""
+                        if name:
+                            # Combine serving size with name for more accurate nutrition lookup
+                            # e.g., "1 slice cake" instead of just "cake"
+                            if serving:
+                                query_str = f"{serving} {name}"
+                            else:
+                                query_str = name
+                            items_to_query.append({"name": name, "query": query_str, "key": (serving, canonical_ingredient(name))})
+                    scan_log.info("Parsed JSON items to query CalorieNinjas: %s", items_to_query)
+                else:
+                    # Fallback: sanitize the AI response text as before
+                    cleaned = re.sub(r"\(.*?\)", "", response_text)
+                    raw_items = re.split(r",|\n|\band\b", cleaned)
+                    for s in raw_items:
+                        if not s or not s.strip():
+                            continue
+                        it = s.strip()
+                        it = re.sub(r'^[\-\u2022\u2023\*\•\s]+', '', it)
+                        it = re.sub(r"^\s*\d+\s*[\.\)]\s*", "", it)
+                        it = re.sub(r"\s+-\s+.*$", "", it)
+                        it = re.sub(r"\(.*?\)", "", it)
+                        it = re.sub(r"\b(piece|pieces|serving|servings|large|small|slice|slices)\b", "", it, flags=re.I)
+                        it = it.strip()
+                        if it:
+                            items_to_query.append({"name": it, "query": it, "key": ("", canonical_ingredient(it))})
+                    scan_log.info("Parsed (fallback) items to query CalorieNinjas: %s", items_to_query)
+
+                # The same food named twice ("Tomatoes", "tamatar"; see canonical.py) is looked up once,
+                # under the first name the model gave it
+                first_seen: Dict[tuple, Dict[str, Any]] = {}
+                for item in items_to_query:
+                    first_seen.setdefault(item.pop("key"), item)
+                items_to_query = list(first_seen.values())
+
+                # Store the parsed food names for display
+                identified_food_names = [item["name"] for item in items_to_query]
+
+                # Look items up concurrently; an open breaker skips the lookups instead of waiting on timeouts
+                lookups = await asyncio.gather(
+                    *(calorieninjas_lookup(item["query"], item["name"]) for item in items_to_query),
+                    return_exceptions=True,
+                )
+                all_items = []
+                for found in lookups:
+                    if isinstance(found, UpstreamUnavailable):
+                        if "calorieninjas" not in degraded:
+                            degraded.append("calorieninjas")
+                        continue
+                    if isinstance(found, BaseException):
+                        scan_log.error("Error querying CalorieNinjas: %s", found)
+                        continue
+                    all_items.extend(found)
+
+                items = all_items
+                # compute totals by summing the returned items
+                totals_calc = {"calories": 0.0, "carbs": 0.0, "fat": 0.0, "protein": 0.0, "fiber": 0.0, "sugar": 0.0}
+                for it in items:
+                    try:
+                        totals_calc["calories"] += float(it.get("calories", 0) or 0)
+                        totals_calc["carbs"] += float(it.get("carbohydrates_total_g", 0) or 0)
+                        totals_calc["fat"] += float(it.get("fat_total_g", 0) or 0)
+                        totals_calc["protein"] += float(it.get("protein_g", 0) or 0)
+                        totals_calc["fiber"] += float(it.get("fiber_g", 0) or 0)
+                        totals_calc["sugar"] += float(it.get("sugar_g", 0) or 0)
+                    except Exception:
+                        scan_log.exception("Error summing nutrition item")
+                nutrition_data = {"items": items, "totals": {k: round(v, 2) for k, v in totals_calc.items()}}
+                scan_log.info("Computed nutrition totals: %s", lazy(summarize, nutrition_data['totals'], max_words=20))
+            except Exception as e:
+                scan_log.exception("Error calling nutrition API: %s", e)
+
+        # Build a clean display name from identified foods
+        if identified_food_names:
+            display_name = ", ".join(identified_food_names)
+        else:
+            display_name = "Unknown food item"
+        
+        return {"item_name": display_name, "nutrition": nutrition_data, "degraded": degraded or None}
+    except HTTPException:
+        raise
+    except Exception as e:
+        scan_log.exception("Error in identify_food: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# New clean upload endpoint: accepts multipart file, saves to public/, returns public URL
+@router.post("/upload-image")
+async def upload_image_clean(request: Request, background: BackgroundTasks, file: UploadFile = File(...),
+                             scan_type: Optional[str] = None,
+                             authorization: Optional[str] = Header(None)):
+    upload_log.info("[upload-image] Received upload request")
+    try:
+        upload_log.info("[upload-image] filename=%s, content_type=%s", file.filename, file.content_type)
+        key, size = await _store_upload(file, authorization, scan_type, background)
+        upload_log.info("[upload-image] Stored %s (%s, %s bytes)", key, storage.backend.name, size)
+        image_url = _build_public_image_url(key, request)
+        upload_log.info("[upload-image] Returning image_url: %s", image_url)
+        return {"image_url": image_url, "variants": variants.variant_urls(image_url)}
+    except Exception as e:
+        upload_log.exception("[upload-image] Error saving file: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# New clean identify endpoint: accepts image_url, sends to model, returns raw model JSON
+@router.post("/identify-image")
+async def identify_image(request: ImageURLRequest):
+    scan_log.info("[identify-image] Received request for URL: %s", request.image_url)
+    try:
+        # Try to load bytes from our storage first
+        key = storage.key_for_url(request.image_url)
+        image_bytes = None
+        if key:
+            with span("identify_image.image_load"):
+                image_bytes = await storage.read(key)
+        if image_bytes is not None:
+            scan_log.info("[identify-image] Loaded stored image %s", key)
+        elif storage.is_own_url(request.image_url):
+            raise HTTPException(status_code=404, detail="Image not found (expired or never uploaded)")
+        else:
+            scan_log.info("[identify-image] Fetching remote URL: %s", request.image_url)
+            try:
+                with span("identify_image.image_fetch", provider="remote_image"):
+                    async with httpx.AsyncClient(timeout=10.0) as client_http:
+                        resp = await client_http.get(request.image_url)
+                        resp.raise_for_status()
+                        image_bytes = resp.content
+                scan_log.info("[identify-image] Fetched remote image, size=%s", len(image_bytes))
+            except Exception as e:
+                scan_log.exception("[identify-image] Failed to fetch image: %s", e)
+                raise HTTPException(status_code=400, detail=f"Could not retrieve image: {e}")
+
+        if not image_bytes:
+            raise HTTPException(status_code=400, detail="No image bytes available")
+
+        # Convert to base64 data URI
+        with span("identify_image.base64_encode"):
+            b64 = base64.b64encode(image_bytes).decode("utf-8")
+        data_uri = f"data:image/jpeg;base64,{b64}"
+
+        # Call the model via OpenRouter's OpenAI client; require JSON output
+        image_model = os.getenv("OPENROUTER_IMAGE_MODEL", OPENROUTER_IMAGE_MODEL)
+        scan_log.info("[identify-image] Calling image model %s (reasoning disabled)", image_model)
+        messages = [
+            {"role": "system", "content": "You are an image recognition assistant. Respond ONLY with valid JSON and NOTHING else. Expected JSON: {\"items\": [{\"name\": \"<short name>\", \"serving\": \"<brief serving>\"}]}. If no food present return {\"items\": []}."},
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": "Identify the food items on the plate in this image with quantity data, including approximate serving sizes. Return EXACT valid JSON using the schema in the system message. Do not include commentary. There will be mostly indian and regional indian food items, so give the best matching food names."},
+                    {"type": "image_url", "image_url": {"url": data_uri}}
+                ]
+            }
+        ]
+        # The OpenAI SDK blocks: run it on a worker thread, through the OpenRouter quota and breaker
+        try:
+            with span("identify_image.vision", provider="openrouter"):
+                completion = await asyncio.to_thread(upstream.call_sync, "openrouter", lambda: get_openai_client().chat.completions.create(
+                    extra_headers={"HTTP-Referer": "http://localhost:8081", "X-Title": "NutriGuard"},
+                    extra_body={"reasoning": {"enabled": False}},
+                    model=image_model,
+                    messages=messages,
+                ))
+        except UpstreamUnavailable as e:
+            raise upstream_unavailable(e, "Image identification")
+
+        scan_log.debug("[identify-image] Model call complete; preview: %s", lazy(summarize, completion, max_words=20))
+
+        if getattr(completion, "error", None):
+            scan_log.error("[identify-image] Model error: %s", completion.error)
+            raise HTTPException(status_code=500, detail=f"Model error: {completion.error}")
+
+        # Try to parse JSON from model output (handle fenced code blocks)
+        response_text = completion.choices[0].message.content if completion and completion.choices and completion.choices[0].message else None
+        if not response_text:
+            raise HTTPException(status_code=500, detail="Empty response from image model")
+        try:
+            raw_text = response_text
+            if "```json" in raw_text:
+                raw_text = raw_text.split("```json")[1].split("```")[0].strip()
+            elif "```" in raw_text:
+                raw_text = raw_text.split("```")[1].split("```")[0].strip()
+            parsed = json.loads(raw_text)
+            return {"parsed": parsed, "raw_response": response_text}
+        except Exception:
+            scan_log.exception("[identify-image] Failed to parse JSON from model output; returning raw text")
+            return {"raw_text": response_text, "model_response_preview": summarize(completion, max_words=20)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        scan_log.exception("[identify-image] Error processing request: %s", e)
+        raise HTTPException(status_code=500, detail=str(e))
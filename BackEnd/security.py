@@ -0,0 +1,46 @@
+"""Password hashing and JWT helpers."""
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import jwt as pyjwt
+
+from config import JWT_SECRET
+from logs import get_logger
+
+auth_log = get_logger("auth")
+
+
+def hash_password(password: str) -> str:
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+
+def create_token(user_id: int, email: str, username: Optional[str] = None) -> str:
+    payload = {"user_id": user_id, "email": email, "username": username, "iat": datetime.utcnow().timestamp()}
+    # Use PyJWT encode — ensure the imported jwt module supports encode
+    if not getattr(pyjwt, "encode", None):
+        auth_log.error("Imported jwt module does not expose 'encode'. Is PyJWT installed?")
+        raise RuntimeError("JWT encode not available. Install PyJWT instead of jwt package.")
+    token = pyjwt.encode(payload, JWT_SECRET, algorithm="HS256")
+    # PyJWT.encode may return bytes in some versions; coerce to str
+    if isinstance(token, bytes):
+        token = token.decode("utf-8")
+    return token
+
+
+def verify_token(token: str) -> Optional[Dict[str, Any]]:
+    try:
+        payload = pyjwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        return payload
+    except Exception:
+        return None
+
+
+def get_user_from_auth_header(auth_header: Optional[str]) -> Optional[Dict[str, Any]]:
+    if not auth_header:
+        return None
+    if not auth_header.lower().startswith("bearer "):
+        return None
+    token = auth_header.split(" ", 1)[1]
+    payload = verify_token(token)
+    return payload
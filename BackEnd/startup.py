@@ -0,0 +1,130 @@
+"""Cold-start timing.
+
+phase("name") times a block of import/init work. Phases are cheap to record, are
+always exported as nutriguard_startup_phase_seconds and are logged as a table once
+startup finishes when STARTUP_PROFILE=1.
+
+Measurement mode: `python startup.py` cold-starts the app in a scratch directory
+(import, lifespan startup, first request) and prints the per-phase cost:
+
+    python startup.py            # one cold start
+    python startup.py --runs 5   # median over 5 fresh interpreters
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+from logs import get_logger
+from telemetry import register_gauge
+
+log = get_logger("startup")
+
+# Roughly the process start; Main imports this module first
+T0 = time.perf_counter()
+PROFILE = os.getenv("STARTUP_PROFILE", "0") == "1"
+
+_phases: List[Tuple[str, float]] = []
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - start))
+
+
+def phases() -> List[Tuple[str, float]]:
+    return list(_phases)
+
+
+def report(label: str = "startup"):
+    """Log the recorded phases (only when STARTUP_PROFILE=1)."""
+    if not PROFILE:
+        return
+    total = time.perf_counter() - T0
+    lines = [f"{name:<28} {seconds * 1000:8.1f} ms" for name, seconds in _phases]
+    log.info("[%s] %.1f ms since import of startup.py\n%s", label, total * 1000, "\n".join(lines))
+
+
+def _collect() -> List[Tuple[Dict[str, object], float]]:
+    totals: Dict[str, float] = {}
+    for name, seconds in _phases:
+        totals[name] = totals.get(name, 0.0) + seconds
+    return [({"phase": name}, seconds) for name, seconds in totals.items()]
+
+
+register_gauge("nutriguard_startup_phase_seconds", "Time spent in each import/init phase of this process.", _collect)
+
+
+_CHILD = r"""
+import asyncio, json, os, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import Main
+t_import = time.perf_counter()
+import httpx
+import startup
+
+async def main():
+    async with Main.app.router.lifespan_context(Main.app):
+        t_ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=Main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            await client.get("/ping")
+        t_first = time.perf_counter()
+    print(json.dumps({
+        "phases": startup.phases(),
+        "import_main": t_import - t0,
+        "lifespan_startup": t_ready - t_import,
+        "first_request": t_first - t_ready,
+        "total": t_first - t0,
+    }))
+
+asyncio.run(main())
+"""
+
+
+def _measure_once(backend_dir: str) -> Dict[str, object]:
+    import json
+    import subprocess
+    import sys
+    import tempfile
+
+    workdir = tempfile.mkdtemp(prefix="nutriguard-startup-")
+    env = dict(os.environ, LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"))
+    env.setdefault("OPENROUTER_API_KEY", "startup-profile")
+    out = subprocess.run([sys.executable, "-c", _CHILD, backend_dir], cwd=workdir, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    import argparse
+    import statistics
+
+    ap = argparse.ArgumentParser(description="Measure NutriGuard cold-start cost per phase.")
+    ap.add_argument("--runs", type=int, default=1, help="fresh interpreters to run (median is reported)")
+    args = ap.parse_args()
+
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    runs = [_measure_once(backend_dir) for _ in range(max(1, args.runs))]
+
+    phase_names: List[str] = []
+    for run in runs:
+        for name, _ in run["phases"]:
+            if name not in phase_names:
+                phase_names.append(name)
+    print(f"{'phase':<28} {'median ms':>10}")
+    for name in phase_names:
+        values = [sum(s for n, s in run["phases"] if n == name) for run in runs]
+        print(f"{name:<28} {statistics.median(values) * 1000:10.1f}")
+    print("-" * 39)
+    for key in ("import_main", "lifespan_startup", "first_request", "total"):
+        print(f"{key:<28} {statistics.median(run[key] for run in runs) * 1000:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Image storage backends.
+
+Uploads are content-addressed: the key is the sha256 of the bytes, sharded by prefix
+("ab/cd/<sha256>.jpg"), so no directory grows past a few hundred entries and identical
+uploads share one object. Keys from before sharding (flat "<uuid>.jpg") still resolve.
+
+STORAGE_BACKEND=local (default) keeps files under public/.
+STORAGE_BACKEND=s3 keeps them in an S3-compatible bucket (AWS S3, MinIO, ...) so several
+app instances can share one image store:
+    STORAGE_S3_BUCKET        bucket name (required)
+    STORAGE_S3_ENDPOINT_URL  e.g. http://localhost:9000 for a local MinIO
+    STORAGE_S3_REGION        default us-east-1
+    STORAGE_S3_PREFIX        optional key prefix inside the bucket
+    STORAGE_S3_PUBLIC_URL    optional base URL the bucket/CDN serves keys from; without it
+                             images are served through the app's /public/<key> route
+Credentials come from the usual AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY. Requires boto3.
+Both backends are served under /public/<key> by routers/images.py.
+
+Backend methods block; the async helpers at the bottom run them in a worker thread.
+"""
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import BinaryIO, Optional, Tuple
+from urllib.parse import urlparse
+
+from common import public_dir, public_path_from_url
+from config import PUBLIC_URL
+from logs import get_logger
+
+log = get_logger("storage")
+
+_CHUNK = 1 << 16
+_EXT_RE = re.compile(r"^\.[a-z0-9]{1,5}$")
+# ab/cd/<sha256>[.ext][.<variant>.<fmt>] (variants are derived deterministically, see variants.py)
+_HASHED_KEY_RE = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(?:\.[a-z0-9]{1,5})?(?:\.([a-z]+)\.[a-z0-9]{1,5})?$")
+
+
+def _clean_ext(filename: Optional[str]) -> str:
+    ext = Path(filename or "").suffix.lower()
+    return ext if _EXT_RE.match(ext) else ""
+
+
+def shard_key(sha256: str, ext: str) -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{ext}"
+
+
+def immutable_tag(key: str) -> Optional[str]:
+    """Stable tag for content-addressed keys ("<sha256>" or "<sha256>.<variant>"); None for
+    legacy flat keys, whose content is not implied by the name.
+    """
+    m = _HASHED_KEY_RE.match(key)
+    if not m:
+        return None
+    return f"{m.group(1)}.{m.group(2)}" if m.group(2) else m.group(1)
+
+
+def safe_key(key: Optional[str]) -> Optional[str]:
+    """Reject keys that could escape the store (absolute paths, '..', empty parts)."""
+    if not key:
+        return None
+    parts = key.split("/")
+    if any(p in ("", ".", "..") or "\\" in p for p in parts):
+        return None
+    return key
+
+
+def content_type_for(key: str) -> str:
+    return mimetypes.guess_type(key)[0] or "application/octet-stream"
+
+
+def _spool_and_hash(src: BinaryIO, dest: BinaryIO) -> Tuple[int, str]:
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = src.read(_CHUNK)
+        if not chunk:
+            break
+        digest.update(chunk)
+        dest.write(chunk)
+        size += len(chunk)
+    return size, digest.hexdigest()
+
+
+class LocalStorage:
+    """Files under a local directory (public/ by default)."""
+
+    name = "local"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def local_path(self, key: str) -> Optional[Path]:
+        key = safe_key(key)
+        return self.root / key if key else None
+
+    def public_url(self, key: str) -> Optional[str]:
+        return None  # served by the app under /public
+
+    def put(self, src: BinaryIO, filename: Optional[str]) -> Tuple[str, int, str]:
+        """Store src; returns (key, size, sha256). An existing object with the same content is reused."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=".upload-", dir=self.root)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                size, sha256 = _spool_and_hash(src, tmp)
+            key = shard_key(sha256, _clean_ext(filename))
+            dest = self.root / key
+            if dest.exists():
+                os.unlink(tmp_name)
+            else:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp_name, dest)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+        return key, size, sha256
+
+    def write(self, key: str, data: bytes):
+        """Store data under an explicit key (derived objects such as variants)."""
+        dest = self.local_path(key)
+        if dest is None:
+            raise ValueError(f"invalid storage key {key!r}")
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=".variant-", dir=dest.parent)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            os.replace(tmp_name, dest)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def exists(self, key: str) -> bool:
+        path = self.local_path(key)
+        return path is not None and path.is_file()
+
+    def read(self, key: str) -> Optional[bytes]:
+        path = self.local_path(key)
+        if path is None or not path.is_file():
+            return None
+        return path.read_bytes()
+
+    def delete(self, key: str):
+        path = self.local_path(key)
+        if path is not None:
+            path.unlink(missing_ok=True)
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket."""
+
+    name = "s3"
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, region: str = "us-east-1",
+                 prefix: str = "", public_base_url: Optional[str] = None):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError as e:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)") from e
+        self._client_error = ClientError
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.public_base_url = (public_base_url or "").rstrip("/") or None
+
+    def _object_key(self, key: str) -> str:
+        return self.prefix + key
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return None
+
+    def public_url(self, key: str) -> Optional[str]:
+        return f"{self.public_base_url}/{key}" if self.public_base_url else None
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+            return True
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def put(self, src: BinaryIO, filename: Optional[str]) -> Tuple[str, int, str]:
+        # The key depends on the content hash, so spool (in memory up to 8MB) before uploading
+        with tempfile.SpooledTemporaryFile(max_size=8 << 20) as spool:
+            size, sha256 = _spool_and_hash(src, spool)
+            key = shard_key(sha256, _clean_ext(filename))
+            if not self.exists(key):
+                spool.seek(0)
+                self.client.upload_fileobj(spool, self.bucket, self._object_key(key),
+                                           ExtraArgs={"ContentType": content_type_for(key)})
+        return key, size, sha256
+
+    def write(self, key: str, data: bytes):
+        if not safe_key(key):
+            raise ValueError(f"invalid storage key {key!r}")
+        self.client.put_object(Bucket=self.bucket, Key=self._object_key(key), Body=data,
+                               ContentType=content_type_for(key))
+
+    def read(self, key: str) -> Optional[bytes]:
+        if not safe_key(key):
+            return None
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self._object_key(key))
+        except self._client_error as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return obj["Body"].read()
+
+    def delete(self, key: str):
+        if safe_key(key):
+            self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+
+def _create_backend():
+    kind = os.getenv("STORAGE_BACKEND", "local").strip().lower()
+    if kind == "s3":
+        bucket = os.getenv("STORAGE_S3_BUCKET")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 requires STORAGE_S3_BUCKET")
+        return S3Storage(
+            bucket,
+            endpoint_url=os.getenv("STORAGE_S3_ENDPOINT_URL") or None,
+            region=os.getenv("STORAGE_S3_REGION", "us-east-1"),
+            prefix=os.getenv("STORAGE_S3_PREFIX", ""),
+            public_base_url=os.getenv("STORAGE_S3_PUBLIC_URL"),
+        )
+    if kind != "local":
+        log.warning("Unknown STORAGE_BACKEND %r; using local storage", kind)
+    return LocalStorage(public_dir)
+
+
+backend = _create_backend()
+
+
+def key_for_url(url: Optional[str]) -> Optional[str]:
+    """Storage key behind one of our image URLs (/public/<key> or the bucket's public URL)."""
+    base = getattr(backend, "public_base_url", None)
+    if url and base and url.startswith(base + "/"):
+        return safe_key(url[len(base) + 1:].split("?", 1)[0])
+    return safe_key(public_path_from_url(url))
+
+
+def is_own_url(url: Optional[str]) -> bool:
+    """True when url points at this app's PUBLIC_URL or the bucket's public URL.
+    Such images are read from storage; fetching them over HTTP would only loop back to us.
+    """
+    host = urlparse(url or "").netloc
+    if not host:
+        return False
+    bases = (PUBLIC_URL, getattr(backend, "public_base_url", None))
+    return any(base and urlparse(base).netloc == host for base in bases)
+
+
+async def put(src: BinaryIO, filename: Optional[str]) -> Tuple[str, int, str]:
+    return await asyncio.to_thread(backend.put, src, filename)
+
+
+async def read(key: Optional[str]) -> Optional[bytes]:
+    if not safe_key(key):
+        return None
+    return await asyncio.to_thread(backend.read, key)
@@ -0,0 +1,108 @@
+"""Persistent cache of LLM dish suggestions for /suggest-dishes-with-filters.
+
+Users flip mealtime/age/diabetic filters back and forth on the results screen, and each
+combination used to cost a full model call. Answers are cached in SQLite under a key built
+from the normalized ingredient set, the merged filters, the model and the prompt version,
+so a combination seen before is answered from the table, also after a restart.
+
+Entries live SUGGESTION_CACHE_TTL_H hours; above SUGGESTION_CACHE_MAX entries the least
+recently used ones are evicted. SUGGESTION_CACHE=0 disables the cache.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import orjson
+
+import blobs
+import db_reader
+import db_writer
+from canonical import canonical_ingredient
+from logs import get_logger
+from telemetry import register_gauge
+
+log = get_logger("recipes")
+
+ENABLED = os.getenv("SUGGESTION_CACHE", "1") == "1"
+TTL_S = float(os.getenv("SUGGESTION_CACHE_TTL_H", "24")) * 3600
+MAX_ENTRIES = int(os.getenv("SUGGESTION_CACHE_MAX", "5000"))
+
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+register_gauge(
+    "nutriguard_suggestion_cache",
+    "LLM dish suggestion cache hits/misses/evictions since start.",
+    lambda: [({"stat": k}, v) for k, v in _stats.items()],
+)
+
+
+def cache_key(ingredients: Iterable[str], filters: Dict[str, Any], model: str, prompt_version: int) -> str:
+    """Order- and case-insensitive key: the same ingredients and filters always map to one entry."""
+    canonical = {
+        "ingredients": sorted({canonical_ingredient(i) for i in ingredients} - {""}),
+        "times": sorted(filters.get("times") or []),
+        "age": filters.get("age"),
+        "diabetic": bool(filters.get("diabetic")),
+        "model": model,
+        "prompt": prompt_version,
+    }
+    return hashlib.sha256(orjson.dumps(canonical, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def _get(conn: sqlite3.Connection, key: str) -> Optional[Tuple[Any, float]]:
+    row = conn.execute("SELECT value, created_at FROM suggestion_cache WHERE key = ?", (key,)).fetchone()
+    return (orjson.loads(blobs.unpack(row[0])), row[1]) if row else None
+
+
+def _touch(conn: sqlite3.Connection, key: str, now: float, expired: bool):
+    if expired:
+        conn.execute("DELETE FROM suggestion_cache WHERE key = ?", (key,))
+    else:
+        conn.execute("UPDATE suggestion_cache SET last_used = ? WHERE key = ?", (now, key))
+
+
+def _put(conn: sqlite3.Connection, key: str, value: Dict[str, Any], now: float):
+    conn.execute(
+        "INSERT OR REPLACE INTO suggestion_cache (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+        (key, blobs.pack(orjson.dumps(value).decode("utf-8")), now, now),
+    )
+    evicted = conn.execute("DELETE FROM suggestion_cache WHERE created_at < ?", (now - TTL_S,)).rowcount
+    excess = conn.execute("SELECT COUNT(*) FROM suggestion_cache").fetchone()[0] - MAX_ENTRIES
+    if excess > 0:
+        # Least recently used first (idx_suggestion_cache_last_used)
+        evicted += conn.execute(
+            "DELETE FROM suggestion_cache WHERE key IN (SELECT key FROM suggestion_cache ORDER BY last_used LIMIT ?)",
+            (excess,),
+        ).rowcount
+    _stats["evictions"] += evicted
+
+
+async def get(key: str) -> Optional[Dict[str, Any]]:
+    if not ENABLED:
+        return None
+    now = time.time()
+    try:
+        found = await db_reader.run(lambda conn: _get(conn, key))
+    except sqlite3.Error:
+        log.exception("[suggestion-cache] lookup failed")
+        return None
+    value = None
+    if found is not None:
+        expired = found[1] < now - TTL_S
+        value = None if expired else found[0]
+        # Bookkeeping only: queued with the next write batch, not awaited
+        db_writer.writer.submit(lambda conn: _touch(conn, key, now, expired))
+    _stats["hits" if value is not None else "misses"] += 1
+    return value
+
+
+async def put(key: str, value: Dict[str, Any]):
+    if not ENABLED:
+        return
+    try:
+        now = time.time()
+        await db_writer.run(lambda conn: _put(conn, key, value, now))
+    except sqlite3.Error:
+        log.exception("[suggestion-cache] store failed")
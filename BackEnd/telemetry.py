@@ -0,0 +1,172 @@
+"""Lightweight in-process latency telemetry for NutriGuard.
+
+Usage:
+    with span("identify_food.openrouter", provider="openrouter"):
+        ...
+
+Every span records its duration into a per-(stage, provider) sample window and
+counts errors (exceptions raised inside the span, or span.fail()). Snapshots give
+p50/p95/p99 and render_prometheus() exposes everything in Prometheus text format.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# Number of most recent samples kept per series for quantile estimation
+WINDOW_SIZE = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Series:
+    __slots__ = ("samples", "count", "total", "errors")
+
+    def __init__(self):
+        self.samples: Deque[float] = deque(maxlen=WINDOW_SIZE)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+
+def _quantile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[idx]
+
+
+class StatsRegistry:
+    """Thread-safe store of latency series keyed by (metric, stage, provider)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str, str], _Series] = {}
+
+    def observe(self, metric: str, stage: str, provider: str, seconds: float, error: bool = False):
+        key = (metric, stage, provider)
+        with self._lock:
+            s = self._series.get(key)
+            if s is None:
+                s = self._series[key] = _Series()
+            s.samples.append(seconds)
+            s.count += 1
+            s.total += seconds
+            if error:
+                s.errors += 1
+
+    def snapshot(self) -> List[Dict[str, object]]:
+        """Return one dict per series with count, sum, error count and quantiles (seconds)."""
+        with self._lock:
+            items = [(k, list(s.samples), s.count, s.total, s.errors) for k, s in self._series.items()]
+        out = []
+        for (metric, stage, provider), samples, count, total, errors in sorted(items):
+            samples.sort()
+            out.append({
+                "metric": metric,
+                "stage": stage,
+                "provider": provider,
+                "count": count,
+                "sum": total,
+                "errors": errors,
+                "quantiles": {q: _quantile(samples, q) for q in QUANTILES},
+            })
+        return out
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+
+registry = StatsRegistry()
+
+
+class Span:
+    __slots__ = ("stage", "provider", "metric", "failed")
+
+    def __init__(self, stage: str, provider: str, metric: str):
+        self.stage = stage
+        self.provider = provider
+        self.metric = metric
+        self.failed = False
+
+    def fail(self):
+        """Mark the span as an error without raising (e.g. upstream non-200 handled inline)."""
+        self.failed = True
+
+
+@contextmanager
+def span(stage: str, provider: Optional[str] = None, metric: str = "stage") -> Iterator[Span]:
+    """Time a block of work. Exceptions are counted as errors and re-raised.
+    Cancelled blocks (e.g. losing hedged requests) are not recorded at all."""
+    sp = Span(stage, provider or "internal", metric)
+    start = time.perf_counter()
+    try:
+        yield sp
+    except asyncio.CancelledError:
+        raise
+    except BaseException:
+        sp.failed = True
+        registry.observe(sp.metric, sp.stage, sp.provider, time.perf_counter() - start, True)
+        raise
+    registry.observe(sp.metric, sp.stage, sp.provider, time.perf_counter() - start, sp.failed)
+
+
+def observe(stage: str, seconds: float, provider: Optional[str] = None, error: bool = False, metric: str = "stage"):
+    """Record an externally measured duration."""
+    registry.observe(metric, stage, provider or "internal", seconds, error)
+
+
+async def monitor_event_loop_lag(interval: float = 0.1):
+    """Record how late the event loop wakes up from a fixed sleep (stage "event_loop.lag")."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        observe("event_loop.lag", max(0.0, time.perf_counter() - start - interval), metric="loop")
+
+
+# Extra gauges rendered by render_prometheus(): name -> (help text, collect() -> [(labels, value)])
+_gauges: Dict[str, Tuple[str, Callable[[], List[Tuple[Dict[str, object], float]]]]] = {}
+
+
+def register_gauge(name: str, help_text: str, collect: Callable[[], List[Tuple[Dict[str, object], float]]]):
+    """Register a gauge whose samples are collected at render time (e.g. circuit breaker state)."""
+    _gauges[name] = (help_text, collect)
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(d: Dict[str, object]) -> str:
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in d.items())
+
+
+def render_prometheus() -> str:
+    """Render all series as Prometheus text exposition (summaries + error counters)."""
+    lines: List[str] = []
+    by_metric: Dict[str, List[Dict[str, object]]] = {}
+    for row in registry.snapshot():
+        by_metric.setdefault(str(row["metric"]), []).append(row)
+    for metric, rows in by_metric.items():
+        name = f"nutriguard_{metric}_seconds"
+        lines.append(f"# HELP {name} Latency of {metric} spans in seconds.")
+        lines.append(f"# TYPE {name} summary")
+        for row in rows:
+            base = {"stage": row["stage"], "provider": row["provider"]}
+            for q, v in row["quantiles"].items():
+                lines.append(f"{name}{{{_labels({**base, 'quantile': q})}}} {v:.6f}")
+            lines.append(f"{name}_sum{{{_labels(base)}}} {row['sum']:.6f}")
+            lines.append(f"{name}_count{{{_labels(base)}}} {row['count']}")
+        err = f"nutriguard_{metric}_errors_total"
+        lines.append(f"# HELP {err} Failed {metric} spans.")
+        lines.append(f"# TYPE {err} counter")
+        for row in rows:
+            lines.append(f"{err}{{{_labels({'stage': row['stage'], 'provider': row['provider']})}}} {row['errors']}")
+    for name, (help_text, collect) in _gauges.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in collect():
+            lines.append(f"{name}{{{_labels(labels)}}} {value}" if labels else f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,126 @@
+"""Upload bookkeeping and expiry.
+
+Every stored image (see storage.py) gets a row in the uploads table (path, size, sha256,
+owner, scan type, expires_at). Expiry removes due, unpinned rows in small batches
+that walk the partial index on expires_at (read on db_reader, deleted through db_writer,
+objects removed in a worker thread), so a large backlog neither blocks the event loop nor
+lands as one burst of unlinks. Uploads referenced
+from history are pinned and never expire.
+
+Retention per scan type comes from UPLOAD_RETENTION_DAYS (config.py); uploads
+without a known scan type use its "default" entry.
+"""
+import asyncio
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Optional
+
+import db_reader
+import db_writer
+import storage
+import variants
+from config import UPLOAD_RETENTION_DAYS
+from logs import get_logger
+from telemetry import register_gauge
+
+log = get_logger("cleanup")
+
+EXPIRY_BATCH = int(os.getenv("UPLOAD_EXPIRY_BATCH", "200"))
+EXPIRY_INTERVAL_S = float(os.getenv("UPLOAD_EXPIRY_INTERVAL_S", "600"))
+# Pause between batches while a backlog is being drained
+EXPIRY_BATCH_PAUSE_S = float(os.getenv("UPLOAD_EXPIRY_BATCH_PAUSE_S", "0.5"))
+
+_expired_total = 0
+
+register_gauge(
+    "nutriguard_uploads_expired",
+    "Uploads removed by expiry (since start).",
+    lambda: [({}, _expired_total)],
+)
+
+
+def retention_for(scan_type: Optional[str]) -> timedelta:
+    days = UPLOAD_RETENTION_DAYS.get(scan_type or "default", UPLOAD_RETENTION_DAYS["default"])
+    return timedelta(days=days)
+
+
+def record_upload(conn: sqlite3.Connection, path: str, size: int, sha256: str, user_id: Optional[int], scan_type: Optional[str]):
+    """Record an upload for expiry, on the caller's connection/transaction."""
+    now = datetime.utcnow()
+    conn.execute(
+        # Keys are content hashes: re-uploading the same image extends its expiry and keeps its pin/owner
+        "INSERT INTO uploads (path, size, sha256, user_id, scan_type, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(path) DO UPDATE SET expires_at = MAX(expires_at, excluded.expires_at), "
+        "user_id = COALESCE(user_id, excluded.user_id)",
+        (
+            path,
+            size,
+            sha256,
+            user_id,
+            scan_type,
+            now.isoformat(timespec="seconds"),
+            (now + retention_for(scan_type)).isoformat(timespec="seconds"),
+        ),
+    )
+
+
+def pin(conn: sqlite3.Connection, image_url: Optional[str]) -> bool:
+    """Pin the upload behind image_url (if it is one of ours) on the caller's connection/transaction."""
+    path = storage.key_for_url(image_url)
+    if not path:
+        return False
+    return conn.execute("UPDATE uploads SET pinned = 1 WHERE path = ?", (path,)).rowcount > 0
+
+
+def _due(conn: sqlite3.Connection, cutoff: str, limit: int):
+    return conn.execute(
+        "SELECT id, path FROM uploads WHERE pinned = 0 AND expires_at <= ? ORDER BY expires_at LIMIT ?",
+        (cutoff, limit),
+    ).fetchall()
+
+
+def _delete_due(conn: sqlite3.Connection, due) -> list:
+    # Re-checks pinned, and skips paths re-uploaded since (same content hash, new row)
+    removed = [path for upload_id, path in due
+               if conn.execute("DELETE FROM uploads WHERE id = ? AND pinned = 0", (upload_id,)).rowcount]
+    return [path for path in removed if not conn.execute("SELECT 1 FROM uploads WHERE path = ?", (path,)).fetchone()]
+
+
+def _delete_objects(paths):
+    global _expired_total
+    for path in paths:
+        try:
+            storage.backend.delete(path)
+            variants.delete_all(path)
+            _expired_total += 1
+        except Exception:
+            log.exception("[cleanup] Failed removing %s", path)
+
+
+async def expire_batch(limit: int = EXPIRY_BATCH, now: Optional[datetime] = None) -> int:
+    """Remove up to limit expired, unpinned uploads; returns how many were due.
+    Due rows are read on a reader thread, then deleted (re-checking pinned) through the writer
+    and committed before their objects are deleted, so an upload pinned concurrently by
+    /history/save is never removed; an object re-uploaded in the meantime is kept as well.
+    """
+    cutoff = (now or datetime.utcnow()).isoformat(timespec="seconds")
+    due = await db_reader.run(lambda conn: _due(conn, cutoff, limit))
+    if not due:
+        return 0
+    removed = await db_writer.run(lambda conn: _delete_due(conn, due))
+    await asyncio.to_thread(_delete_objects, removed)
+    return len(due)
+
+
+async def expire_uploads_periodically():
+    """Drain expired uploads in batches of EXPIRY_BATCH, then check again every EXPIRY_INTERVAL_S."""
+    while True:
+        due = 0
+        try:
+            due = await expire_batch()
+            if due:
+                log.info("[cleanup] Removed %s expired uploads", due)
+        except Exception:
+            log.exception("[cleanup] Error expiring uploads")
+        await asyncio.sleep(EXPIRY_BATCH_PAUSE_S if due >= EXPIRY_BATCH else EXPIRY_INTERVAL_S)
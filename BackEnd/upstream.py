@@ -0,0 +1,476 @@
+"""Resilient access to third-party providers (OpenRouter, CalorieNinjas, Spoonacular, Google CSE).
+
+- One CircuitBreaker per provider over a rolling window of outcomes. Errors, 429/5xx
+  and calls slower than the provider's slow-call threshold count as failures. When
+  the failure ratio trips, the breaker opens and calls fail fast with BreakerOpenError
+  until a half-open probe succeeds.
+- Retries use full-jitter exponential backoff, honour Retry-After and draw from a
+  process-wide RetryBudget so retries cannot multiply load during an outage.
+- Every attempt first takes a token from the provider's ProviderQuota (token bucket
+  plus optional daily allowance, configured from the free-tier limits). Waiters are
+  served by priority: INTERACTIVE scans ahead of BACKGROUND enrichment. Background
+  work is shed when the daily allowance runs low and waits at most a short time;
+  a 429's Retry-After pauses the whole provider. Callers get QuotaExceededError.
+- Breaker state and quota levels are exported to /internal/stats.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from logs import get_logger
+from telemetry import register_gauge, span
+
+log = get_logger("upstream")
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+# Request priorities (lower is served first)
+INTERACTIVE, BACKGROUND = 0, 1
+
+
+class UpstreamUnavailable(Exception):
+    """A provider call was not attempted; retry_after is a hint in seconds (may be None)."""
+
+    def __init__(self, provider: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class BreakerOpenError(UpstreamUnavailable):
+    """Raised instead of calling a provider whose breaker is open."""
+
+    def __init__(self, provider: str, retry_after: Optional[float] = None):
+        super().__init__(provider, f"{provider} circuit open", retry_after)
+
+
+class QuotaExceededError(UpstreamUnavailable):
+    """Raised when a call cannot get a quota token in time (or was shed as low priority)."""
+
+    def __init__(self, provider: str, retry_after: Optional[float] = None, shed: bool = False):
+        super().__init__(provider, f"{provider} quota {'reserved for interactive calls' if shed else 'exhausted'}", retry_after)
+        self.shed = shed
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, window_s: float = 60.0, min_calls: int = 8, failure_ratio: float = 0.5,
+                 slow_call_s: Optional[float] = None, open_s: float = 30.0):
+        self.name = name
+        self.window_s = window_s
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call_s = slow_call_s
+        self.open_s = open_s
+        self._lock = threading.Lock()
+        self._events: Deque[Tuple[float, bool]] = deque()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    def _trim(self, now: float):
+        while self._events and now - self._events[0][0] > self.window_s:
+            self._events.popleft()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.open_s:
+                return HALF_OPEN
+            return self._state
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(0.0, self.open_s - (time.monotonic() - self._opened_at))
+
+    def allow(self) -> bool:
+        """True if a call may proceed. In half-open state only one probe is let through."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and time.monotonic() - self._opened_at < self.open_s:
+                return False
+            # Half-open: admit a single probe
+            if self._probe_in_flight:
+                return False
+            self._state = HALF_OPEN
+            self._probe_in_flight = True
+            return True
+
+    def release_probe(self):
+        """Forget an in-flight half-open probe without recording an outcome."""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+
+    def record(self, ok: bool, duration: float):
+        if ok and self.slow_call_s is not None and duration > self.slow_call_s:
+            ok = False
+        now = time.monotonic()
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self._state = CLOSED
+                    self._events.clear()
+                    log.info("[breaker] %s closed after successful probe", self.name)
+                else:
+                    self._state = OPEN
+                    self._opened_at = now
+                    log.warning("[breaker] %s probe failed; re-opened for %ss", self.name, self.open_s)
+                return
+            self._events.append((now, ok))
+            self._trim(now)
+            if self._state == CLOSED and len(self._events) >= self.min_calls:
+                failures = sum(1 for _, good in self._events if not good)
+                if failures / len(self._events) >= self.failure_ratio:
+                    self._state = OPEN
+                    self._opened_at = now
+                    log.warning("[breaker] %s opened (%s/%s failures in %ss)", self.name, failures, len(self._events), self.window_s)
+
+
+class ProviderQuota:
+    """Token bucket (rate_per_min, burst) plus an optional per-UTC-day allowance.
+
+    BACKGROUND callers leave `reserve` of the bucket and `daily_reserve` of the day's
+    allowance to INTERACTIVE callers, and are shed rather than queued once the daily
+    allowance is down to that reserve.
+    """
+
+    def __init__(self, name: str, rate_per_min: float, burst: float, daily: Optional[float] = None,
+                 reserve: float = 0.25, daily_reserve: float = 0.2):
+        self.name = name
+        self.rate = rate_per_min / 60.0
+        self.burst = max(1.0, burst)
+        self.daily = daily
+        self.reserve = reserve * self.burst
+        self.daily_reserve = (daily or 0) * daily_reserve
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._day = datetime.now(timezone.utc).date()
+        self._used_today = 0.0
+        self._waiters: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self.shed = 0
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+        today = datetime.now(timezone.utc).date()
+        if today != self._day:
+            self._day, self._used_today = today, 0.0
+
+    def _daily_left(self) -> float:
+        return float("inf") if self.daily is None else self.daily - self._used_today
+
+    def _seconds_to_midnight(self) -> float:
+        now = datetime.now(timezone.utc)
+        return (datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc) - now).total_seconds()
+
+    def _need(self, priority: int, cost: float) -> float:
+        # Background calls must leave the reserve in the bucket (capped so they can still run when idle)
+        return cost if priority == INTERACTIVE else min(self.burst, cost + self.reserve)
+
+    def _take(self, priority: int, cost: float, now: float) -> Optional[float]:
+        """Take tokens and return None, or return seconds until this caller could be served.
+        Raises QuotaExceededError when the daily allowance rules the call out."""
+        self._refill(now)
+        left = self._daily_left()
+        if left < cost:
+            raise QuotaExceededError(self.name, self._seconds_to_midnight())
+        if priority != INTERACTIVE and left - cost < self.daily_reserve:
+            self.shed += 1
+            raise QuotaExceededError(self.name, self._seconds_to_midnight(), shed=True)
+        if now < self._paused_until:
+            return self._paused_until - now
+        need = self._need(priority, cost)
+        if self._tokens < need:
+            return (need - self._tokens) / self.rate if self.rate > 0 else float("inf")
+        self._tokens -= cost
+        self._used_today += cost
+        return None
+
+    async def acquire(self, priority: int = INTERACTIVE, cost: float = 1.0, max_wait: float = 10.0):
+        """Wait (in priority order) for `cost` tokens, up to max_wait seconds."""
+        now = time.monotonic()
+        deadline = now + max_wait
+        ticket = (priority, next(self._seq))
+        with self._lock:
+            heapq.heappush(self._waiters, ticket)
+        try:
+            while True:
+                with self._lock:
+                    if self._waiters[0] == ticket:
+                        wait = self._take(priority, cost, now)
+                        if wait is None:
+                            return
+                    else:
+                        # Someone with higher priority (or earlier) is ahead; re-check shortly
+                        wait = 0.005
+                if now + wait > deadline:
+                    if priority != INTERACTIVE:
+                        self.shed += 1
+                    raise QuotaExceededError(self.name, wait)
+                await asyncio.sleep(wait)
+                now = time.monotonic()
+        finally:
+            with self._lock:
+                if ticket in self._waiters:
+                    self._waiters.remove(ticket)
+                    heapq.heapify(self._waiters)
+
+    def try_acquire(self, priority: int = INTERACTIVE, cost: float = 1.0):
+        """Non-blocking acquire for synchronous callers."""
+        with self._lock:
+            if self._waiters:
+                raise QuotaExceededError(self.name, 1.0)
+            wait = self._take(priority, cost, time.monotonic())
+        if wait is not None:
+            raise QuotaExceededError(self.name, wait)
+
+    def pause(self, seconds: float):
+        """Honour a provider 429: nobody calls it again until Retry-After has passed."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+        log.warning("[quota] %s paused for %.1fs after 429", self.name, seconds)
+
+    def levels(self) -> Tuple[float, float, int]:
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens, self._daily_left(), len(self._waiters)
+
+
+class RetryBudget:
+    """Allow retries up to `ratio` of recent requests (plus a small floor) within a sliding window."""
+
+    def __init__(self, ratio: float = 0.2, min_per_window: int = 5, window_s: float = 10.0):
+        self.ratio = ratio
+        self.min_per_window = min_per_window
+        self.window_s = window_s
+        self._lock = threading.Lock()
+        self._requests: Deque[float] = deque()
+        self._retries: Deque[float] = deque()
+
+    def _trim(self, now: float):
+        for q in (self._requests, self._retries):
+            while q and now - q[0] > self.window_s:
+                q.popleft()
+
+    def record_request(self):
+        with self._lock:
+            self._requests.append(time.monotonic())
+
+    def try_acquire(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            allowed = max(self.min_per_window, int(len(self._requests) * self.ratio))
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+# Per-provider breaker tuning: slow-call thresholds sit well under each call's timeout
+BREAKERS: Dict[str, CircuitBreaker] = {
+    "openrouter": CircuitBreaker("openrouter", window_s=120.0, min_calls=6, failure_ratio=0.6, slow_call_s=45.0, open_s=30.0),
+    "calorieninjas": CircuitBreaker("calorieninjas", window_s=60.0, min_calls=8, failure_ratio=0.5, slow_call_s=5.0, open_s=30.0),
+    "spoonacular": CircuitBreaker("spoonacular", window_s=60.0, min_calls=8, failure_ratio=0.5, slow_call_s=5.0, open_s=60.0),
+    "google_cse": CircuitBreaker("google_cse", window_s=60.0, min_calls=8, failure_ratio=0.5, slow_call_s=3.0, open_s=60.0),
+}
+
+def _quota_overrides(spec: Optional[str]) -> Dict[str, Tuple[float, Optional[float]]]:
+    """Parse UPSTREAM_QUOTAS="openrouter=20:50,google_cse=60:100" (requests/min[:requests/day])."""
+    out: Dict[str, Tuple[float, Optional[float]]] = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        name, value = part.split("=", 1)
+        rpm, _, daily = value.partition(":")
+        try:
+            out[name.strip()] = (float(rpm), float(daily) if daily.strip() else None)
+        except ValueError:
+            log.warning("[quota] ignoring invalid UPSTREAM_QUOTAS entry %r", part)
+    return out
+
+
+# Defaults follow the free tiers: OpenRouter :free models (20 req/min, 1000/day with credits),
+# Spoonacular free plan (150 points/day), Google CSE (100 queries/day). CalorieNinjas is monthly-capped only.
+_QUOTA_DEFAULTS: Dict[str, Tuple[float, float, Optional[float]]] = {
+    "openrouter": (20.0, 5.0, 1000.0),
+    "calorieninjas": (120.0, 20.0, None),
+    "spoonacular": (60.0, 5.0, 150.0),
+    "google_cse": (60.0, 10.0, 100.0),
+}
+_overrides = _quota_overrides(os.getenv("UPSTREAM_QUOTAS"))
+QUOTAS: Dict[str, ProviderQuota] = {}
+for _name, (_rpm, _burst, _daily) in _QUOTA_DEFAULTS.items():
+    _rpm, _daily = _overrides.get(_name, (_rpm, _daily))
+    QUOTAS[_name] = ProviderQuota(_name, _rpm, _burst, _daily)
+
+retry_budget = RetryBudget(
+    ratio=float(os.getenv("UPSTREAM_RETRY_BUDGET_RATIO", "0.2")),
+    min_per_window=int(os.getenv("UPSTREAM_RETRY_BUDGET_MIN", "5")),
+)
+
+register_gauge(
+    "nutriguard_breaker_state",
+    "Circuit breaker state per provider (0=closed, 1=half_open, 2=open).",
+    lambda: [({"provider": name}, _STATE_VALUE[b.state]) for name, b in BREAKERS.items()],
+)
+register_gauge(
+    "nutriguard_quota_tokens",
+    "Tokens currently available in each provider's rate bucket.",
+    lambda: [({"provider": name}, q.levels()[0]) for name, q in QUOTAS.items()],
+)
+register_gauge(
+    "nutriguard_quota_daily_remaining",
+    "Requests (or points) left in today's provider allowance.",
+    lambda: [({"provider": name}, q.levels()[1]) for name, q in QUOTAS.items() if q.daily is not None],
+)
+register_gauge(
+    "nutriguard_quota_waiting",
+    "Calls queued for a provider quota token.",
+    lambda: [({"provider": name}, q.levels()[2]) for name, q in QUOTAS.items()],
+)
+register_gauge(
+    "nutriguard_quota_shed",
+    "Background calls shed or timed out waiting for quota since start.",
+    lambda: [({"provider": name}, q.shed) for name, q in QUOTAS.items()],
+)
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Shared pooled client for upstream calls (created on first use)."""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=100, max_keepalive_connections=20))
+    return _http_client
+
+
+async def aclose():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def _retryable_status(code: int) -> bool:
+    return code == 429 or code >= 500
+
+
+def _retry_after_seconds(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def _backoff(attempt: int, base: float, cap: float, retry_after: Optional[str]) -> float:
+    seconds = _retry_after_seconds(retry_after)
+    if seconds is not None:
+        return min(cap, seconds)
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+async def request(provider: str, method: str, url: str, *, stage: str, timeout: float,
+                  retries: int = 1, backoff_base: float = 0.25, backoff_cap: float = 2.0,
+                  priority: int = INTERACTIVE, cost: float = 1.0, max_wait: Optional[float] = None,
+                  **kwargs: Any) -> httpx.Response:
+    """Issue an HTTP call through the provider's quota and breaker with bounded, budgeted retries.
+
+    Returns the final response (which may still be a 429/5xx once retries are exhausted).
+    Raises BreakerOpenError when the breaker rejects the call, QuotaExceededError when no
+    quota token is available within max_wait (10s interactive, 2s background), or the last
+    transport error.
+    """
+    breaker = BREAKERS[provider]
+    quota = QUOTAS[provider]
+    if max_wait is None:
+        max_wait = 10.0 if priority == INTERACTIVE else 2.0
+    client = get_http_client()
+    retry_budget.record_request()
+    attempt = 0
+    while True:
+        if breaker.state == OPEN:
+            raise BreakerOpenError(provider, breaker.retry_after())
+        await quota.acquire(priority, cost, max_wait)
+        if not breaker.allow():
+            raise BreakerOpenError(provider, breaker.retry_after())
+        start = time.perf_counter()
+        resp: Optional[httpx.Response] = None
+        error: Optional[Exception] = None
+        with span(stage, provider=provider) as sp:
+            try:
+                resp = await client.request(method, url, timeout=timeout, **kwargs)
+            except httpx.TransportError as e:
+                error = e
+            except asyncio.CancelledError:
+                # Cancelled by the caller (e.g. a losing hedge): not the provider's fault
+                breaker.release_probe()
+                raise
+            except BaseException:
+                # Unexpected errors must still release a half-open probe
+                breaker.record(False, time.perf_counter() - start)
+                raise
+            ok = resp is not None and not _retryable_status(resp.status_code)
+            if not ok:
+                sp.fail()
+        throttled = resp is not None and resp.status_code == 429
+        if throttled:
+            # Rate limiting is not an outage: pause the quota instead of counting it against the breaker
+            quota.pause(_retry_after_seconds(resp.headers.get("retry-after")) or 1.0)
+            breaker.record(True, time.perf_counter() - start)
+        else:
+            breaker.record(ok, time.perf_counter() - start)
+        if ok:
+            return resp
+        if attempt >= retries or not retry_budget.try_acquire():
+            if error is not None:
+                raise error
+            return resp
+        # After a 429 the quota pause already spaces the retry out
+        delay = 0.0 if throttled else _backoff(attempt, backoff_base, backoff_cap, None)
+        log.debug("[retry] %s %s attempt=%s delay=%.2fs", provider, stage, attempt + 1, delay)
+        attempt += 1
+        await asyncio.sleep(delay)
+
+
+def call_sync(provider: str, fn: Callable[[], Any], priority: int = INTERACTIVE, cost: float = 1.0) -> Any:
+    """Run a blocking provider call (e.g. the OpenAI SDK) through the provider's quota and breaker, without retries."""
+    breaker = BREAKERS[provider]
+    if breaker.state == OPEN:
+        raise BreakerOpenError(provider, breaker.retry_after())
+    QUOTAS[provider].try_acquire(priority, cost)
+    if not breaker.allow():
+        raise BreakerOpenError(provider, breaker.retry_after())
+    start = time.perf_counter()
+    try:
+        result = fn()
+    except BaseException as e:
+        if getattr(e, "status_code", None) == 429:
+            headers = getattr(getattr(e, "response", None), "headers", None) or {}
+            QUOTAS[provider].pause(_retry_after_seconds(headers.get("retry-after")) or 1.0)
+            breaker.record(True, time.perf_counter() - start)
+        else:
+            breaker.record(False, time.perf_counter() - start)
+        raise
+    breaker.record(True, time.perf_counter() - start)
+    return result
@@ -0,0 +1,158 @@
+"""Downscaled variants of stored images (list thumbnails and result-screen previews).
+
+A variant is stored next to its original under "<original key>.<variant>.<fmt>", e.g.
+ab/cd/<sha256>.jpg.thumb.webp, so its URL is the original URL plus a suffix and is as
+immutable as the original. Variants are generated after each upload (in the background)
+and lazily on the first request for one that is missing (routers/images.py).
+
+VARIANT_THUMB_PX / VARIANT_MEDIUM_PX bound the longest edge; VARIANT_FORMAT picks webp
+(default when Pillow supports it) or jpeg. Without Pillow no variants are offered and
+clients keep using the original image_url.
+"""
+import asyncio
+import importlib.util
+import io
+import os
+import re
+from typing import Dict, Optional, Tuple
+
+import storage
+from logs import get_logger
+from telemetry import span
+
+log = get_logger("variants")
+
+# Pillow (optional dependency) is imported on the first downscale, off the cold-start path;
+# find_spec only locates it (PIL._webp is the module features.check("webp") looks for)
+AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+VARIANTS: Dict[str, int] = {
+    "thumb": int(os.getenv("VARIANT_THUMB_PX", "256")),
+    "medium": int(os.getenv("VARIANT_MEDIUM_PX", "1024")),
+}
+_QUALITY = {"thumb": 70, "medium": 80}
+
+if AVAILABLE:
+    _default_format = "webp" if importlib.util.find_spec("PIL._webp") else "jpeg"
+    FORMAT = os.getenv("VARIANT_FORMAT", _default_format).lower()
+    if FORMAT not in ("webp", "jpeg"):
+        FORMAT = _default_format
+else:
+    FORMAT = "jpeg"
+_EXT = "webp" if FORMAT == "webp" else "jpg"
+MEDIA_TYPE = f"image/{FORMAT}"
+
+_VARIANT_KEY_RE = re.compile(r"^(.+)\.(" + "|".join(VARIANTS) + r")\.(webp|jpg)$")
+
+# Lazy generations in flight, so a burst of requests for one thumbnail renders it once
+_in_flight: Dict[str, "asyncio.Future[Optional[bytes]]"] = {}
+
+
+def variant_key(key: str, variant: str) -> str:
+    return f"{key}.{variant}.{_EXT}"
+
+
+def parse_variant_key(key: str) -> Optional[Tuple[str, str]]:
+    """(original key, variant) for a variant key in the current format, else None."""
+    m = _VARIANT_KEY_RE.match(key)
+    if not m or m.group(3) != _EXT or _VARIANT_KEY_RE.match(m.group(1)):
+        return None
+    return m.group(1), m.group(2)
+
+
+def variant_urls(image_url: Optional[str]) -> Optional[Dict[str, str]]:
+    """Variant URLs for one of our stored images (None for external URLs or without Pillow)."""
+    if not AVAILABLE or not storage.key_for_url(image_url):
+        return None
+    base = image_url.split("?", 1)[0]
+    return {variant: f"{base}.{variant}.{_EXT}" for variant in VARIANTS}
+
+
+def downscale(data: bytes, size: int, quality: int) -> bytes:
+    """Fit image bytes into a size x size box (never upscaling) and encode them in FORMAT.
+    Raises if data is not a decodable image.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft("RGB", (size, size))  # lets JPEG decode at a reduced scale
+        img = ImageOps.exif_transpose(img)
+        mode = "RGBA" if FORMAT == "webp" and "A" in img.getbands() else "RGB"
+        if img.mode != mode:
+            img = img.convert(mode)
+        img.thumbnail((size, size), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, format=FORMAT.upper(), quality=quality, **({"method": 4} if FORMAT == "webp" else {"optimize": True}))
+    return out.getvalue()
+
+
+def render(data: bytes, variant: str) -> bytes:
+    return downscale(data, VARIANTS[variant], _QUALITY[variant])
+
+
+def generate(key: str, variant: str, original: Optional[bytes] = None) -> Optional[bytes]:
+    """Render and store one variant of key; returns its bytes (None if the original is missing
+    or not a decodable image). Blocking.
+    """
+    if not AVAILABLE:
+        return None
+    if original is None:
+        original = storage.backend.read(key)
+        if original is None:
+            return None
+    try:
+        with span("variants.render", provider="pillow"):
+            data = render(original, variant)
+    except Exception as e:
+        log.info("[variants] Could not render %s of %s: %s", variant, key, e, sample=True)
+        return None
+    storage.backend.write(variant_key(key, variant), data)
+    return data
+
+
+def generate_all(key: str):
+    """Render every variant of a freshly stored upload (run as a background task)."""
+    if not AVAILABLE:
+        return
+    # Re-uploads of the same image map to the same key; its variants are already there
+    missing = [v for v in VARIANTS if not storage.backend.exists(variant_key(key, v))]
+    original = storage.backend.read(key) if missing else None
+    if original is None:
+        return
+    for variant in missing:
+        if generate(key, variant, original) is None:
+            return  # not a decodable image; the other sizes would fail the same way
+
+
+def delete_all(key: str):
+    """Delete the variants stored next to key (any format), e.g. when the original expires."""
+    for variant in VARIANTS:
+        for ext in ("webp", "jpg"):
+            storage.backend.delete(f"{key}.{variant}.{ext}")
+
+
+async def ensure(key: str) -> Optional[bytes]:
+    """Generate the (missing) variant stored at key and return its bytes; None if key is not a
+    variant key or its original is gone.
+    """
+    parsed = parse_variant_key(key)
+    if not AVAILABLE or parsed is None:
+        return None
+    existing = _in_flight.get(key)
+    if existing is not None:
+        return await asyncio.shield(existing)
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        data = await asyncio.to_thread(generate, *parsed)
+        future.set_result(data)
+        return data
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved when nobody else was waiting
+        raise
+    finally:
+        _in_flight.pop(key, None)
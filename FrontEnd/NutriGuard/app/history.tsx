@@ -8,10 +8,18 @@ interface HistoryItem {
   id: number;
   timestamp: string;
   image_url?: string;
+  // Downscaled copies of image_url (thumb/medium) when the backend can produce them
+  variants?: { thumb?: string; medium?: string } | null;
   scan_type: 'food' | 'raw_ingredients';
-  result_json: string;
+  // Returned as an embedded object by the backend; older servers sent a JSON string
+  result_json: string | Record<string, any> | null;
 }
 
+const parseResult = (item: HistoryItem): Record<string, any> => {
+  if (!item.result_json) return {};
+  return typeof item.result_json === 'string' ? JSON.parse(item.result_json) : item.result_json;
+};
+
 export default function History() {
   const [history, setHistory] = useState<HistoryItem[]>([]);
   const [loading, setLoading] = useState(true);
@@ -50,7 +58,7 @@ export default function History() {
 
   const getTitle = (item: HistoryItem) => {
     try {
-      const parsed = JSON.parse(item.result_json);
+      const parsed = parseResult(item);
       if (item.scan_type === 'food' && parsed.itemName) return parsed.itemName;
       if (item.scan_type === 'raw_ingredients') {
         const ingredients = parsed.ingredients || [];
@@ -67,7 +75,7 @@ export default function History() {
 
   const handlePress = (item: HistoryItem) => {
     try {
-      const parsed = JSON.parse(item.result_json);
+      const parsed = parseResult(item);
       console.log('History item parsed:', { scan_type: item.scan_type, parsed, image_url: item.image_url });
       
       if (item.scan_type === 'food') {
@@ -126,7 +134,7 @@ export default function History() {
           <TouchableOpacity style={styles.item} onPress={() => handlePress(item)}>
             <View style={styles.thumbnailContainer}>
               {item.image_url ? (
-                <Image source={{ uri: item.image_url }} style={styles.thumbnail} resizeMode="cover" />
+                <Image source={{ uri: item.variants?.thumb || item.image_url }} style={styles.thumbnail} resizeMode="cover" />
               ) : (
                 <View style={[styles.thumbnail, styles.placeholderThumbnail]}>
                   <MaterialIcons name={item.scan_type === 'food' ? 'restaurant' : 'kitchen'} size={32} color="#999" />